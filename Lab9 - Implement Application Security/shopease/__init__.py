@@ -1 +1,7 @@
 """Shopease package"""
+import time as _time
+
+from . import startup as _startup
+
+# start of the "import" phase in the startup report
+_startup.PACKAGE_IMPORTED = _time.perf_counter()
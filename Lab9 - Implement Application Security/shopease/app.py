@@ -1,205 +1,393 @@
-from fastapi import FastAPI
-import os
-from fastapi import HTTPException
+from fastapi import APIRouter, FastAPI
+import datetime
+import logging
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select, text
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 
 # Support running this file either as part of the package (recommended)
 # or directly as a script (so relative imports would fail). Try package
 # (relative) imports first and fall back to direct module imports.
 try:
-    from .db import init_engine, get_session
+    from .db import get_session
     from .models import SupportTicket, TicketStatus, Customer, SupportAgent
 except Exception:
     # fallback when running the file directly (python shopease/app.py)
-    from db import init_engine, get_session
+    from db import get_session
     from models import SupportTicket, TicketStatus, Customer, SupportAgent
 
-# Initialize engine (use DATABASE_URL env or fallback to local sqlite file)
-DATABASE_URL = os.environ.get("DATABASE_URL")
-init_engine(DATABASE_URL)
-
-app = FastAPI()
-# Enable CORS for development/testing. In production, restrict origins.
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 from pydantic import BaseModel
 from fastapi import HTTPException, status as http_status
 from . import auth
-from fastapi import Depends
+from . import bulk
+from . import cache
+from . import export
+from . import metrics
+from . import hashing
+from . import search
+from . import ngram_index
+from . import profiling
+from . import querywatch
+from . import responses
+from . import startup
+from . import versioning
+from .queries import (
+    DEFAULT_TICKET_PAGE_SIZE,
+    ticket_list_select,
+    ticket_detail_select,
+    ticket_row_to_dict,
+    ticket_page_select,
+    ticket_page_size,
+    split_ticket_page,
+    customer_to_dict,
+    DEFAULT_ADDRESS_PAGE_SIZE,
+    MAX_ADDRESS_PAGE_SIZE,
+    address_page_select,
+    split_address_page,
+    city_counts_select,
+)
+from fastapi import Depends, Form
 from .auth import Token
+from .schemas import TicketCreate, TicketUpdate, TicketBulkUpdate
+from . import db
+from .db import USE_ASYNC_DB, init_async_engine, init_engine
+from .pooling import pool_status
+
+logger = logging.getLogger(__name__)
+
+# The sync routes; create_app() mounts them behind the async variants
+# when USE_ASYNC_DB is set.
+router = APIRouter()
+
+# Most SQL statements each route may run, including the throttled
+# revocation-list refresh and principal lookup on authenticated routes.
+# Requests over budget are logged, or fail tests with QUERY_WATCH=raise.
+QUERY_BUDGETS = {
+    ("GET", "/adsweb/api/v1/tickets"): 2,
+    ("GET", "/adsweb/api/v1/tickets/{ticket_id}"): 2,
+    ("GET", "/adsweb/api/v1/customer/search/{searchString}"): 2,
+    ("GET", "/adsweb/api/v1/customer/addresses"): 1,
+    ("GET", "/adsweb/api/v1/customer/cities"): 1,
+    ("GET", "/adsweb/api/v1/export/tickets"): 3,
+    ("GET", "/adsweb/api/v1/export/customers"): 3,
+    ("POST", "/adsweb/api/v1/ticket"): 7,
+    ("POST", "/adsweb/api/v1/tickets/bulk"): 6,
+    ("PATCH", "/adsweb/api/v1/tickets/bulk"): 5,
+    ("PUT", "/adsweb/api/v1/ticket/{ticket_id}"): 7,
+    ("DELETE", "/adsweb/api/v1/ticket/{ticket_id}"): 6,
+    ("POST", "/adsweb/api/v1/token"): 3,
+    ("POST", "/adsweb/api/v1/token/refresh"): 4,
+    ("POST", "/adsweb/api/v1/signup"): 4,
+}
+
+
+def warm_up():
+    """Do the work the first requests would otherwise pay for.
+
+    Opens the first pooled connection, detects the search mode, loads the
+    revocation list and builds the in-memory search index when enabled.
+    The hashing pool stays lazy: spawning its workers adds about a second
+    to every start.
+    """
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        search.search_mode(conn)
+    auth.revocations.refresh()
+    if search.CUSTOMER_SEARCH_MODE == "memory":
+        ngram_index.enable(get_session)
+        logger.info("Customer search index built: %s", ngram_index.index.memory_usage())
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    with startup.phase("engine"):
+        init_engine()
+        metrics.instrument_engine(db.engine)
+        querywatch.instrument_engine(db.engine)
+        if USE_ASYNC_DB:
+            init_async_engine()
+            metrics.instrument_engine(db.async_engine.sync_engine)
+            querywatch.instrument_engine(db.async_engine.sync_engine)
+    with startup.phase("warm-up"):
+        warm_up()
+        if USE_ASYNC_DB:
+            async with db.async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+    startup.report()
+    yield
+    ngram_index.disable()
+    hashing.pool.shutdown()
+    db.engine.dispose()
+    if db.async_engine is not None:
+        await db.async_engine.dispose()
+
+
+def create_app() -> FastAPI:
+    """Build the API.
+
+    Nothing here touches the database: engines are created and warmed up
+    by the lifespan handler when the server (or a `with TestClient(...)`
+    block) starts. Serve with `uvicorn shopease.app:app`, or
+    `uvicorn --factory shopease.app:create_app`.
+    """
+    startup.mark_import_done()
+    with startup.phase("create_app"):
+        application = FastAPI(lifespan=lifespan)
+        # Enable CORS for development/testing. In production, restrict origins.
+        application.add_middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["X-Next-Cursor", "ETag"],
+        )
+        if USE_ASYNC_DB:
+            # Register the async variants first so they take precedence over
+            # the sync handlers for the same paths.
+            from .async_routes import router as async_router
+
+            application.include_router(async_router)
+        application.include_router(router)
+        application.add_middleware(querywatch.QueryWatchMiddleware, budgets=QUERY_BUDGETS)
+        application.add_middleware(metrics.MetricsMiddleware)
+        application.add_middleware(profiling.ProfilingMiddleware)
+    return application
+
 
+def get_ticket_page(limit: int | None = DEFAULT_TICKET_PAGE_SIZE, **filters):
+    """Return one page of tickets (newest first) and the cursor for the next page.
 
-def ticket_to_dict(ticket: SupportTicket) -> dict:
-    cust = None
-    agent = None
-    if ticket.customer:
-        cust = {
-            "customerID": ticket.customer.customerID,
-            "firstName": ticket.customer.firstName,
-            "lastName": ticket.customer.lastName,
-            "email": ticket.customer.email,
-        }
-    if ticket.supportAgent:
-        agent = {
-            "agentID": ticket.supportAgent.agentID,
-            "firstName": ticket.supportAgent.firstName,
-            "lastName": ticket.supportAgent.lastName,
-            "email": ticket.supportAgent.email,
-        }
-    return {
-        "ticketID": ticket.ticketID,
-        "issueDescription": ticket.issueDescription,
-        "createdAt": ticket.createdAt,
-        "status": ticket.status.name if ticket.status is not None else None,
-        "customer": cust,
-        "supportAgent": agent,
-    }
-
-
-def get_all_tickets():
+    `filters` are passed through to `queries.ticket_page_select`.
+    `next_cursor` is None on the last page; `limit=None` returns every ticket.
+    """
+    stmt = ticket_page_select(limit=limit, **filters)
     session = get_session()
     try:
-        tickets = (
-            session.query(SupportTicket)
-            .order_by(SupportTicket.createdAt.desc())
-            .all()
-        )
-        return [ticket_to_dict(t) for t in tickets]
+        rows = session.execute(stmt).all()
     finally:
         session.close()
+    return split_ticket_page(rows, limit)
 
 
-def customer_to_dict(cust: Customer) -> dict:
-    if cust is None:
-        return None
-    return {
-        "customerID": cust.customerID,
-        "firstName": cust.firstName,
-        "lastName": cust.lastName,
-        "email": cust.email,
-        "phone": cust.phone,
-        "address": cust.address,
-    }
-
-
-def _extract_city_from_address(address: str) -> str:
-    """Try to extract a city substring from a freeform address.
+def get_ticket_list_version():
+    session = get_session()
+    try:
+        return session.execute(versioning.version_select()).first()
+    finally:
+        session.close()
 
-    Strategy (best-effort):
-    - If address contains commas, take the second segment (after first comma) and strip it.
-    - Otherwise return empty string.
 
-    This is a heuristic because the data model stores address as a single string.
+@router.get("/adsweb/api/v1/tickets")
+def read_tickets(
+    request: Request,
+    response: Response,
+    limit: int | None = None,
+    cursor: str | None = None,
+    status: str | None = None,
+    customerID: int | None = None,
+    supportAgentID: int | None = None,
+    createdFrom: datetime.datetime | None = None,
+    createdTo: datetime.datetime | None = None,
+):
+    """List tickets newest first, one page at a time.
+
+    The body is the list of tickets for this page. When more tickets are
+    available the opaque cursor for the next page is returned in the
+    `X-Next-Cursor` header; pass it back as `?cursor=` to continue.
+    Without `limit` and `cursor` the whole list is returned, as before
+    paging existed; new clients should page with `limit`.
+
+    Responses carry ETag and Last-Modified from the ticket table version;
+    a matching If-None-Match gets 304 without the list query being run.
     """
-    if not address:
-        return ""
-    # split on comma and return second piece if available
-    parts = [p.strip() for p in address.split(",") if p.strip()]
-    if len(parts) >= 2:
-        return parts[1]
-    return ""
-
-
-@app.get("/adsweb/api/v1/tickets")
-def read_tickets():
-    return get_all_tickets()
-
-
-@app.get("/adsweb/api/v1/tickets/{ticket_id}")
-def read_ticket(ticket_id: int):
+    limit = ticket_page_size(limit, cursor)
+
+    etag, modified = versioning.validators(get_ticket_list_version(), str(request.query_params))
+    if versioning.is_not_modified(request, etag):
+        return versioning.not_modified_response(etag, modified)
+
+    tickets, next_cursor = get_ticket_page(
+        limit=limit,
+        cursor=cursor,
+        status=status,
+        customer_id=customerID,
+        agent_id=supportAgentID,
+        created_from=createdFrom,
+        created_to=createdTo,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    versioning.set_validators(response, etag, modified)
+    return responses.respond(tickets, response)
+
+
+def _ticket_detail_response(request: Request, response: Response, ticket: dict):
+    etag = versioning.content_etag(ticket)
+    if versioning.is_not_modified(request, etag):
+        return versioning.not_modified_response(etag, None)
+    versioning.set_validators(response, etag, None)
+    return ticket
+
+
+@router.get("/adsweb/api/v1/tickets/{ticket_id}")
+def read_ticket(ticket_id: int, request: Request, response: Response):
     # Validate ticket_id
     if ticket_id is None or ticket_id <= 0:
         raise HTTPException(status_code=400, detail="ticket_id must be a positive integer")
 
     session = get_session()
     try:
-        ticket = session.query(SupportTicket).filter(SupportTicket.ticketID == ticket_id).first()
-        if ticket is None:
-            raise HTTPException(status_code=404, detail=f"Ticket with id {ticket_id} not found")
-        return ticket_to_dict(ticket)
+        # entries from before another worker's write are stale
+        version = versioning.version_of(session.execute(versioning.version_select()).first())
+        cached = cache.cached_ticket(ticket_id, version)
+        if cached is not None:
+            return _ticket_detail_response(request, response, cached)
+
+        token = cache.ticket_cache.fill_token()
+        row = session.execute(ticket_detail_select(ticket_id)).first()
     finally:
         session.close()
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Ticket with id {ticket_id} not found")
+    ticket = ticket_row_to_dict(row)
+    cache.store_ticket(ticket_id, version, ticket, token)
+    return _ticket_detail_response(request, response, ticket)
 
 
-@app.get("/adsweb/api/v1/customer/search/{searchString}")
-def search_customers(searchString: str):
+@router.get("/adsweb/api/v1/customer/search/{searchString}")
+def search_customers(searchString: str, limit: int = search.DEFAULT_SEARCH_LIMIT):
     """Search customers by firstName, lastName, email, phone or address.
 
     Performs case-insensitive partial match across multiple fields and
-    returns a list of customer dicts.
+    returns up to `limit` customer dicts, best matches first when a search
+    index is available (see search.py).
     """
     if searchString is None or searchString.strip() == "":
         raise HTTPException(status_code=400, detail="searchString must be a non-empty string")
+    if limit <= 0 or limit > search.MAX_SEARCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {search.MAX_SEARCH_LIMIT}")
 
     session = get_session()
     try:
-        # Use ilike for case-insensitive partial matching (works for sqlite/postgres)
-        pattern = f"%{searchString}%"
-        results = (
-            session.query(Customer)
-            .filter(
-                (Customer.firstName.ilike(pattern))
-                | (Customer.lastName.ilike(pattern))
-                | (Customer.email.ilike(pattern))
-                | (Customer.phone.ilike(pattern))
-                | (Customer.address.ilike(pattern))
-            )
-            .all()
-        )
-
+        mode = search.session_search_mode(session)
+        results = session.execute(search.customer_search_stmt(searchString, limit, mode)).scalars().all()
         return [customer_to_dict(c) for c in results]
     finally:
         session.close()
 
 
-@app.get("/adsweb/api/v1/customer/addresses")
-def list_addresses():
-    """Return a list of addresses with customer data, sorted ascending by city.
+@router.get("/adsweb/api/v1/customer/addresses")
+def list_addresses(response: Response, limit: int = DEFAULT_ADDRESS_PAGE_SIZE, cursor: str | None = None):
+    """Return a page of addresses with customer data, sorted ascending by city.
 
-    Because `Customer.address` is a freeform string, we heuristically extract
-    the city by taking the second comma-separated segment (if present). The
-    response is a list of objects with keys: address, city, customer.
+    The city is the persisted `Customer.city` column, derived from the
+    freeform address on write (see models.extract_city_from_address). The
+    response is a list of objects with keys: address, city, customer; the
+    next page's cursor is returned in the `X-Next-Cursor` header.
+    """
+    if limit <= 0 or limit > MAX_ADDRESS_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_ADDRESS_PAGE_SIZE}")
+
+    session = get_session()
+    try:
+        rows = session.execute(address_page_select(limit, cursor)).all()
+    finally:
+        session.close()
+    results, next_cursor = split_address_page(rows, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return responses.respond(results, response)
+
+
+@router.get("/adsweb/api/v1/customer/cities")
+def list_city_counts():
+    """Number of customers per city, sorted by city."""
+    session = get_session()
+    try:
+        rows = session.execute(city_counts_select()).all()
+        return [{"city": r.city or "", "count": r.count} for r in rows]
+    finally:
+        session.close()
+
+
+TICKET_EXPORT_FIELDS = [
+    "ticketID",
+    "issueDescription",
+    "createdAt",
+    "status",
+    "customerID",
+    "customerFirstName",
+    "customerLastName",
+    "customerEmail",
+    "agentID",
+    "agentFirstName",
+    "agentLastName",
+    "agentEmail",
+]
+
+CUSTOMER_EXPORT_FIELDS = ["customerID", "firstName", "lastName", "email", "phone", "address", "role"]
+
+
+def _iter_query_rows(stmt):
+    """Yield rows of `stmt` in server-side batches.
+
+    `yield_per` makes the ORM fetch EXPORT_CHUNK_SIZE rows at a time (and
+    use a server-side cursor on drivers that support one), so the session
+    never buffers the full result. The session lives as long as the
+    generator and is closed when the response finishes or is aborted.
     """
     session = get_session()
     try:
-        customers = session.query(Customer).all()
-
-        results = []
-        for c in customers:
-            city = _extract_city_from_address(c.address)
-            results.append({
-                "address": c.address,
-                "city": city,
-                "customer": customer_to_dict(c),
-            })
-
-        # sort by city (case-insensitive); empty cities sort first
-        results.sort(key=lambda r: (r["city"].lower() if r["city"] else ""))
-        return results
+        for row in session.execute(stmt.execution_options(yield_per=export.EXPORT_CHUNK_SIZE)):
+            yield row
     finally:
         session.close()
 
 
-class TicketCreate(BaseModel):
-    customerID: int
-    issueDescription: str
-    supportAgentID: int | None = None
-    status: str | None = None
+def _export_response(records, fmt: str, fieldnames: list[str], filename: str):
+    if fmt == "csv":
+        body = export.csv_chunks(records, fieldnames)
+    else:
+        body = export.ndjson_chunks(records)
+    return StreamingResponse(
+        body,
+        media_type=export.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+def _validate_export_format(fmt: str):
+    if fmt not in export.MEDIA_TYPES:
+        valid = ", ".join(export.MEDIA_TYPES)
+        raise HTTPException(status_code=400, detail=f"Invalid format. Valid values: {valid}")
 
 
-class TicketUpdate(BaseModel):
-    customerID: int | None = None
-    issueDescription: str | None = None
-    supportAgentID: int | None = None
-    status: str | None = None
+@router.get("/adsweb/api/v1/export/tickets")
+def export_tickets(format: str = "ndjson", current_user=Depends(auth.require_role(["agent", "manager"]))):
+    """Stream every ticket as NDJSON (same shape as /tickets) or flat CSV."""
+    _validate_export_format(format)
+    rows = _iter_query_rows(ticket_list_select().order_by(SupportTicket.ticketID))
+    if format == "csv":
+        records = (r._asdict() for r in rows)
+    else:
+        records = (ticket_row_to_dict(r) for r in rows)
+    return _export_response(records, format, TICKET_EXPORT_FIELDS, "tickets")
 
 
-@app.post("/adsweb/api/v1/ticket", status_code=http_status.HTTP_201_CREATED)
+@router.get("/adsweb/api/v1/export/customers")
+def export_customers(format: str = "ndjson", current_user=Depends(auth.require_role(["agent", "manager"]))):
+    """Stream every customer (without password hashes) as NDJSON or CSV."""
+    _validate_export_format(format)
+    rows = _iter_query_rows(
+        select(*[getattr(Customer, name) for name in CUSTOMER_EXPORT_FIELDS]).order_by(Customer.customerID)
+    )
+    return _export_response((r._asdict() for r in rows), format, CUSTOMER_EXPORT_FIELDS, "customers")
+
+
+@router.post("/adsweb/api/v1/ticket", status_code=http_status.HTTP_201_CREATED)
 def create_ticket(payload: TicketCreate, current_user=Depends(auth.get_current_user)):
     # Validate payload.customerID exists
     session = get_session()
@@ -230,10 +418,65 @@ def create_ticket(payload: TicketCreate, current_user=Depends(auth.get_current_u
             status=(status_enum or TicketStatus.open),
         )
         session.add(new_ticket)
+        session.flush()
+        ticket_id = new_ticket.ticketID
         session.commit()
-        session.refresh(new_ticket)
+        cache.ticket_cache.invalidate(ticket_id)
 
-        return ticket_to_dict(new_ticket)
+        # one joined read instead of refresh() plus two lazy relationship loads
+        return ticket_row_to_dict(session.execute(ticket_detail_select(ticket_id)).first())
+    finally:
+        session.close()
+
+
+@router.post("/adsweb/api/v1/tickets/bulk")
+def create_tickets_bulk(payload: list[TicketCreate], current_user=Depends(auth.get_current_user)):
+    """Create up to bulk.MAX_BULK_TICKETS tickets in one transaction.
+
+    Referenced customers and agents are checked with one IN query each and
+    all valid tickets are inserted with a single batched INSERT. Invalid
+    items are skipped and reported by their position in the request:
+    { created: [{index, ticketID}], errors: [{index, detail}] }
+    """
+    bulk.check_batch_size(payload)
+    session = get_session()
+    try:
+        customer_ids = set(session.scalars(bulk.existing_customers_select(payload)))
+        agents_stmt = bulk.existing_agents_select(payload)
+        agent_ids = set(session.scalars(agents_stmt)) if agents_stmt is not None else set()
+        rows, indexes, errors = bulk.validate_new_tickets(payload, customer_ids, agent_ids)
+        ticket_ids = []
+        if rows:
+            dialect = session.get_bind().dialect.name
+            ticket_ids = bulk.inserted_ids(session.scalars(bulk.insert_tickets_stmt(dialect), rows), dialect)
+            versioning.bump(session.connection())
+            session.commit()
+            cache.ticket_cache.invalidate(*ticket_ids)
+        return bulk.created_result(indexes, ticket_ids, errors)
+    finally:
+        session.close()
+
+
+@router.patch("/adsweb/api/v1/tickets/bulk")
+def update_tickets_bulk(payload: TicketBulkUpdate, current_user=Depends(auth.require_role(["agent", "manager"]))):
+    """Change status and/or agent on many tickets with one UPDATE.
+
+    Targets either explicit `ticketIDs` or a `filter` (same fields as
+    GET /tickets), e.g. {"filter": {"status": "pending", "supportAgentID": 7},
+    "status": "closed"}. Returns { updated, ticketIDs }.
+    """
+    stmt = bulk.update_tickets_stmt(payload)
+    session = get_session()
+    try:
+        if payload.supportAgentID:
+            if session.execute(bulk.agent_exists_select(payload.supportAgentID)).first() is None:
+                raise HTTPException(status_code=400, detail=f"SupportAgent with id {payload.supportAgentID} does not exist")
+        ticket_ids = list(session.scalars(stmt))
+        if ticket_ids:
+            versioning.bump(session.connection())
+        session.commit()
+        cache.ticket_cache.invalidate(*ticket_ids)
+        return bulk.updated_result(ticket_ids)
     finally:
         session.close()
 
@@ -247,14 +490,14 @@ class SignupPayload(BaseModel):
     role: str | None = "customer"
 
 
-@app.post("/adsweb/api/v1/signup", status_code=http_status.HTTP_201_CREATED)
+@router.post("/adsweb/api/v1/signup", status_code=http_status.HTTP_201_CREATED)
 def signup(payload: SignupPayload):
     session = get_session()
     try:
         existing = session.query(Customer).filter(Customer.email == payload.email).first()
         if existing:
             raise HTTPException(status_code=400, detail="Email already registered")
-        hashed = auth.get_password_hash(payload.password)
+        hashed = hashing.pool.hash(payload.password)
         user = Customer(firstName=payload.firstName, lastName=payload.lastName, email=payload.email, password=hashed, role=payload.role or "customer")
         session.add(user)
         session.commit()
@@ -267,12 +510,12 @@ def signup(payload: SignupPayload):
 from fastapi.security import OAuth2PasswordRequestForm
 
 
-@app.post("/adsweb/api/v1/token", response_model=Token)
+@router.post("/adsweb/api/v1/token", response_model=Token)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """OAuth2 password flow compatible token endpoint.
 
     Accepts form fields: username, password, scope, grant_type, client_id.
-    Returns: { access_token, token_type }
+    Returns: { access_token, token_type, refresh_token }
     """
     session = get_session()
     try:
@@ -283,13 +526,44 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
                 detail="Incorrect username or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        access_token = auth.create_access_token({"sub": user.email, "role": user.role})
-        return {"access_token": access_token, "token_type": "bearer"}
+        return auth.issue_tokens(session, user)
     finally:
         session.close()
 
 
-@app.post("/adsweb/api/v1/login")
+@router.post("/adsweb/api/v1/token/refresh", response_model=Token)
+def refresh_access_token(grant_type: str = Form("refresh_token"), refresh_token: str = Form(...)):
+    """OAuth2 refresh_token grant.
+
+    Exchanges a refresh token for a new access token and a new refresh
+    token; the presented one cannot be used again.
+    Returns: { access_token, token_type, refresh_token }
+    """
+    if grant_type != "refresh_token":
+        raise HTTPException(status_code=400, detail="grant_type must be refresh_token")
+    session = get_session()
+    try:
+        return auth.rotate_refresh_token(session, refresh_token)
+    finally:
+        session.close()
+
+
+@router.post("/adsweb/api/v1/token/revoke")
+def revoke_token(token: str = Form(...)):
+    """Revoke an access or refresh token (e.g. on logout).
+
+    Always answers 200, as RFC 7009 asks, so the endpoint does not reveal
+    whether a token was valid.
+    """
+    session = get_session()
+    try:
+        auth.revoke_token(session, token)
+    finally:
+        session.close()
+    return {"revoked": True}
+
+
+@router.post("/adsweb/api/v1/login")
 def login(payload: dict):
     # simple JSON login: {"username": "...", "password": "..."}
     username = payload.get("username") or payload.get("email")
@@ -298,16 +572,15 @@ def login(payload: dict):
         raise HTTPException(status_code=400, detail="username/email and password required")
     session = get_session()
     try:
-        user = session.query(Customer).filter(Customer.email == username).first()
-        if not user or not auth.verify_password(password, user.password):
+        user = auth.authenticate_user(session, username, password)
+        if not user:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        access_token = auth.create_access_token({"sub": user.email, "role": user.role})
-        return {"access_token": access_token, "token_type": "bearer"}
+        return auth.issue_tokens(session, user)
     finally:
         session.close()
 
 
-@app.put("/adsweb/api/v1/ticket/{ticket_id}")
+@router.put("/adsweb/api/v1/ticket/{ticket_id}")
 def update_ticket(ticket_id: int, payload: TicketUpdate):
     # Validate ticket_id
     if ticket_id is None or ticket_id <= 0:
@@ -345,13 +618,13 @@ def update_ticket(ticket_id: int, payload: TicketUpdate):
 
         session.add(ticket)
         session.commit()
-        session.refresh(ticket)
-        return ticket_to_dict(ticket)
+        cache.ticket_cache.invalidate(ticket_id)
+        return ticket_row_to_dict(session.execute(ticket_detail_select(ticket_id)).first())
     finally:
         session.close()
 
 
-@app.delete("/adsweb/api/v1/ticket/{ticket_id}", status_code=http_status.HTTP_204_NO_CONTENT)
+@router.delete("/adsweb/api/v1/ticket/{ticket_id}", status_code=http_status.HTTP_204_NO_CONTENT)
 def delete_ticket(ticket_id: int):
     # Validate ticket_id
     if ticket_id is None or ticket_id <= 0:
@@ -365,12 +638,77 @@ def delete_ticket(ticket_id: int):
 
         session.delete(ticket)
         session.commit()
+        cache.ticket_cache.invalidate(ticket_id)
         # 204 No Content
         return None
     finally:
         session.close()
 
 
+@router.get("/adsweb/internal/metrics", response_class=PlainTextResponse)
+def read_metrics(_=Depends(auth.require_internal_token)):
+    """Per-route request, latency and SQL metrics for Prometheus to scrape."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/adsweb/internal/pool")
+def read_pool_status(_=Depends(auth.require_internal_token)):
+    """Connection pool gauges and counters for sizing DB_POOL_* settings."""
+    status = {"sync": pool_status(db.engine)}
+    if db.async_engine is not None:
+        status["async"] = pool_status(db.async_engine.sync_engine)
+    return status
+
+
+@router.get("/adsweb/internal/search-index")
+def read_search_index_status(_=Depends(auth.require_internal_token)):
+    """Size and memory use of the in-process customer search index."""
+    if ngram_index.index is None:
+        return {"enabled": False}
+    return {"enabled": True, **ngram_index.index.memory_usage()}
+
+
+@router.get("/adsweb/internal/cache")
+def read_cache_status(_=Depends(auth.require_internal_token)):
+    """Ticket and principal cache hit/miss/eviction counters."""
+    return {"tickets": cache.ticket_cache.stats(), "principals": auth.principal_cache.stats()}
+
+
+@router.get("/adsweb/internal/revocations")
+def read_revocation_status(_=Depends(auth.require_internal_token)):
+    """Size of the in-process revocation mirror and how often the Bloom filter was hit."""
+    return auth.revocations.stats()
+
+
+@router.get("/adsweb/internal/startup")
+def read_startup_timings(_=Depends(auth.require_internal_token)):
+    """Time spent in each startup phase of this process (see startup.py)."""
+    return startup.timings()
+
+
+@router.get("/adsweb/internal/hashing")
+def read_hashing_status(_=Depends(auth.require_internal_token)):
+    """Password hashing pool load: in-flight work, queue depth, rejections and timeouts."""
+    return hashing.pool.stats()
+
+
+@router.get("/adsweb/internal/profiles")
+def read_profiles(_=Depends(auth.require_internal_token)):
+    """Saved request profiles, newest first (see profiling.py)."""
+    return profiling.list_profiles()
+
+
+@router.get("/adsweb/internal/profiles/{name}")
+def download_profile(name: str, _=Depends(auth.require_internal_token)):
+    path = profiling.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {name} not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     # simple manual run for development: run the app object directly so
     # uvicorn doesn't need to import the package by name.
@@ -0,0 +1,239 @@
+"""Async variants of the ticket and customer endpoints.
+
+Enabled with USE_ASYNC_DB=1 (see `db.USE_ASYNC_DB`). The handlers run the
+same statements as the sync routes in `app.py`, but on the async engine, so a
+request waiting on the database does not hold a threadpool thread.
+"""
+import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status as http_status
+
+from . import auth
+from . import bulk
+from . import cache
+from . import responses
+from . import search
+from . import versioning
+from .db import get_async_session
+from .models import SupportTicket, TicketStatus, Customer, SupportAgent
+from .queries import (
+    ticket_detail_select,
+    ticket_row_to_dict,
+    ticket_page_select,
+    ticket_page_size,
+    split_ticket_page,
+    parse_ticket_status,
+    customer_to_dict,
+    DEFAULT_ADDRESS_PAGE_SIZE,
+    MAX_ADDRESS_PAGE_SIZE,
+    address_page_select,
+    split_address_page,
+    city_counts_select,
+)
+from .schemas import TicketCreate, TicketUpdate, TicketBulkUpdate
+
+router = APIRouter()
+
+
+async def _ticket_dict(session, ticket_id: int) -> dict:
+    row = (await session.execute(ticket_detail_select(ticket_id))).one()
+    return ticket_row_to_dict(row)
+
+
+@router.get("/adsweb/api/v1/tickets")
+async def read_tickets(
+    request: Request,
+    response: Response,
+    limit: int | None = None,
+    cursor: str | None = None,
+    status: str | None = None,
+    customerID: int | None = None,
+    supportAgentID: int | None = None,
+    createdFrom: datetime.datetime | None = None,
+    createdTo: datetime.datetime | None = None,
+):
+    limit = ticket_page_size(limit, cursor)
+
+    async with get_async_session() as session:
+        version = (await session.execute(versioning.version_select())).first()
+    etag, modified = versioning.validators(version, str(request.query_params))
+    if versioning.is_not_modified(request, etag):
+        return versioning.not_modified_response(etag, modified)
+
+    stmt = ticket_page_select(
+        limit=limit,
+        cursor=cursor,
+        status=status,
+        customer_id=customerID,
+        agent_id=supportAgentID,
+        created_from=createdFrom,
+        created_to=createdTo,
+    )
+    async with get_async_session() as session:
+        rows = (await session.execute(stmt)).all()
+    tickets, next_cursor = split_ticket_page(rows, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    versioning.set_validators(response, etag, modified)
+    return responses.respond(tickets, response)
+
+
+def _ticket_detail_response(request: Request, response: Response, ticket: dict):
+    etag = versioning.content_etag(ticket)
+    if versioning.is_not_modified(request, etag):
+        return versioning.not_modified_response(etag, None)
+    versioning.set_validators(response, etag, None)
+    return ticket
+
+
+@router.get("/adsweb/api/v1/tickets/{ticket_id}")
+async def read_ticket(ticket_id: int, request: Request, response: Response):
+    if ticket_id is None or ticket_id <= 0:
+        raise HTTPException(status_code=400, detail="ticket_id must be a positive integer")
+
+    async with get_async_session() as session:
+        version = versioning.version_of((await session.execute(versioning.version_select())).first())
+        cached = cache.cached_ticket(ticket_id, version)
+        if cached is not None:
+            return _ticket_detail_response(request, response, cached)
+
+        token = cache.ticket_cache.fill_token()
+        row = (await session.execute(ticket_detail_select(ticket_id))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Ticket with id {ticket_id} not found")
+    ticket = ticket_row_to_dict(row)
+    cache.store_ticket(ticket_id, version, ticket, token)
+    return _ticket_detail_response(request, response, ticket)
+
+
+@router.get("/adsweb/api/v1/customer/search/{searchString}")
+async def search_customers(searchString: str, limit: int = search.DEFAULT_SEARCH_LIMIT):
+    if searchString is None or searchString.strip() == "":
+        raise HTTPException(status_code=400, detail="searchString must be a non-empty string")
+    if limit <= 0 or limit > search.MAX_SEARCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {search.MAX_SEARCH_LIMIT}")
+
+    async with get_async_session() as session:
+        mode = await session.run_sync(search.session_search_mode)
+        results = (await session.execute(search.customer_search_stmt(searchString, limit, mode))).scalars().all()
+    return [customer_to_dict(c) for c in results]
+
+
+@router.get("/adsweb/api/v1/customer/addresses")
+async def list_addresses(response: Response, limit: int = DEFAULT_ADDRESS_PAGE_SIZE, cursor: str | None = None):
+    if limit <= 0 or limit > MAX_ADDRESS_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_ADDRESS_PAGE_SIZE}")
+
+    async with get_async_session() as session:
+        rows = (await session.execute(address_page_select(limit, cursor))).all()
+    results, next_cursor = split_address_page(rows, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return responses.respond(results, response)
+
+
+@router.get("/adsweb/api/v1/customer/cities")
+async def list_city_counts():
+    async with get_async_session() as session:
+        rows = (await session.execute(city_counts_select())).all()
+    return [{"city": r.city or "", "count": r.count} for r in rows]
+
+
+@router.post("/adsweb/api/v1/ticket", status_code=http_status.HTTP_201_CREATED)
+async def create_ticket(payload: TicketCreate, current_user=Depends(auth.get_current_user)):
+    async with get_async_session() as session:
+        if await session.get(Customer, payload.customerID) is None:
+            raise HTTPException(status_code=400, detail=f"Customer with id {payload.customerID} does not exist")
+        if payload.supportAgentID is not None and await session.get(SupportAgent, payload.supportAgentID) is None:
+            raise HTTPException(status_code=400, detail=f"SupportAgent with id {payload.supportAgentID} does not exist")
+
+        status_enum = parse_ticket_status(payload.status) if payload.status else TicketStatus.open
+        new_ticket = SupportTicket(
+            customerID=payload.customerID,
+            supportAgentID=payload.supportAgentID,
+            issueDescription=payload.issueDescription,
+            status=status_enum,
+        )
+        session.add(new_ticket)
+        await session.commit()
+        cache.ticket_cache.invalidate(new_ticket.ticketID)
+        return await _ticket_dict(session, new_ticket.ticketID)
+
+
+@router.post("/adsweb/api/v1/tickets/bulk")
+async def create_tickets_bulk(payload: list[TicketCreate], current_user=Depends(auth.get_current_user)):
+    bulk.check_batch_size(payload)
+    async with get_async_session() as session:
+        customer_ids = set(await session.scalars(bulk.existing_customers_select(payload)))
+        agents_stmt = bulk.existing_agents_select(payload)
+        agent_ids = set(await session.scalars(agents_stmt)) if agents_stmt is not None else set()
+        rows, indexes, errors = bulk.validate_new_tickets(payload, customer_ids, agent_ids)
+        ticket_ids = []
+        if rows:
+            dialect = session.bind.dialect.name
+            ticket_ids = bulk.inserted_ids(await session.scalars(bulk.insert_tickets_stmt(dialect), rows), dialect)
+            await session.run_sync(lambda s: versioning.bump(s.connection()))
+            await session.commit()
+            cache.ticket_cache.invalidate(*ticket_ids)
+    return bulk.created_result(indexes, ticket_ids, errors)
+
+
+@router.patch("/adsweb/api/v1/tickets/bulk")
+async def update_tickets_bulk(payload: TicketBulkUpdate, current_user=Depends(auth.require_role(["agent", "manager"]))):
+    stmt = bulk.update_tickets_stmt(payload)
+    async with get_async_session() as session:
+        if payload.supportAgentID:
+            if (await session.execute(bulk.agent_exists_select(payload.supportAgentID))).first() is None:
+                raise HTTPException(status_code=400, detail=f"SupportAgent with id {payload.supportAgentID} does not exist")
+        ticket_ids = list(await session.scalars(stmt))
+        if ticket_ids:
+            await session.run_sync(lambda s: versioning.bump(s.connection()))
+        await session.commit()
+        cache.ticket_cache.invalidate(*ticket_ids)
+    return bulk.updated_result(ticket_ids)
+
+
+@router.put("/adsweb/api/v1/ticket/{ticket_id}")
+async def update_ticket(ticket_id: int, payload: TicketUpdate):
+    if ticket_id is None or ticket_id <= 0:
+        raise HTTPException(status_code=400, detail="ticket_id must be a positive integer")
+
+    async with get_async_session() as session:
+        ticket = await session.get(SupportTicket, ticket_id)
+        if ticket is None:
+            raise HTTPException(status_code=404, detail=f"Ticket with id {ticket_id} not found")
+
+        if payload.customerID is not None:
+            if await session.get(Customer, payload.customerID) is None:
+                raise HTTPException(status_code=400, detail=f"Customer with id {payload.customerID} does not exist")
+            ticket.customerID = payload.customerID
+
+        if payload.supportAgentID is not None:
+            if payload.supportAgentID and await session.get(SupportAgent, payload.supportAgentID) is None:
+                raise HTTPException(status_code=400, detail=f"SupportAgent with id {payload.supportAgentID} does not exist")
+            ticket.supportAgentID = payload.supportAgentID
+
+        if payload.issueDescription is not None:
+            ticket.issueDescription = payload.issueDescription
+
+        if payload.status is not None:
+            ticket.status = parse_ticket_status(payload.status)
+
+        await session.commit()
+        cache.ticket_cache.invalidate(ticket_id)
+        return await _ticket_dict(session, ticket_id)
+
+
+@router.delete("/adsweb/api/v1/ticket/{ticket_id}", status_code=http_status.HTTP_204_NO_CONTENT)
+async def delete_ticket(ticket_id: int):
+    if ticket_id is None or ticket_id <= 0:
+        raise HTTPException(status_code=400, detail="ticket_id must be a positive integer")
+
+    async with get_async_session() as session:
+        ticket = await session.get(SupportTicket, ticket_id)
+        if ticket is None:
+            raise HTTPException(status_code=404, detail=f"Ticket with id {ticket_id} not found")
+        await session.delete(ticket)
+        await session.commit()
+        cache.ticket_cache.invalidate(ticket_id)
+    return None
@@ -2,21 +2,40 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-import jwt
-import bcrypt
-import hashlib
-import base64
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session
+import hmac
+import secrets
 
+from . import hashing
+from .revocation import revocations
+from .cache import NullCache, TTLCache
 from .db import get_session
-from .models import Customer
+from .models import Customer, RefreshToken
+
+# jwt is imported inside the functions that use it, so importing the app
+# (workers, test collection) does not load it.
 
 # Config
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+# Shared secret for /adsweb/internal/* endpoints, sent as X-Internal-Token.
+# When unset those endpoints answer 403, unless INTERNAL_ENDPOINTS_OPEN=1
+# opens them for local development.
+INTERNAL_API_TOKEN = os.environ.get("INTERNAL_API_TOKEN")
+INTERNAL_ENDPOINTS_OPEN = os.environ.get("INTERNAL_ENDPOINTS_OPEN", "").lower() in ("1", "true", "yes")
+# How get_current_user resolves the token subject:
+#   cache   (default) look the customer up once, then serve it from
+#           principal_cache for AUTH_PRINCIPAL_CACHE_TTL seconds
+#   db      look the customer up on every request
+#   claims  trust the signed `sub`/`role` claims; no database access, so
+#           role changes and deleted accounts apply only when tokens expire
+AUTH_PRINCIPAL_MODE = os.environ.get("AUTH_PRINCIPAL_MODE", "cache").lower()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/adsweb/api/v1/token")
 
@@ -24,6 +43,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/adsweb/api/v1/token")
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
 
 
 class TokenData(BaseModel):
@@ -31,81 +51,266 @@ class TokenData(BaseModel):
     role: Optional[str] = None
 
 
+class Principal(BaseModel):
+    """The authenticated caller, as returned by `get_current_user`."""
+    customerID: Optional[int] = None
+    email: str
+    role: Optional[str] = None
+
+
+if AUTH_PRINCIPAL_MODE == "cache":
+    principal_cache = TTLCache(
+        maxsize=int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", "4096")),
+        ttl=float(os.environ.get("AUTH_PRINCIPAL_CACHE_TTL", "60")),
+    )
+else:
+    principal_cache = NullCache()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    if not hashed_password:
-        return False
-    try:
-        # pre-hash the provided password with SHA-256, then base64-encode
-        pw_bytes = plain_password.encode("utf-8")
-        pre = hashlib.sha256(pw_bytes).digest()
-        encoded = base64.b64encode(pre)
-        # hashed_password stored as utf-8 string
-        return bcrypt.checkpw(encoded, hashed_password.encode("utf-8"))
-    except Exception:
-        return False
+    # runs bcrypt on the calling thread; request handlers use hashing.pool
+    return hashing.check_password(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    # pre-hash the password with SHA-256 and base64-encode the digest
-    pw_bytes = password.encode("utf-8")
-    pre = hashlib.sha256(pw_bytes).digest()
-    encoded = base64.b64encode(pre)
-    hashed = bcrypt.hashpw(encoded, bcrypt.gensalt())
-    return hashed.decode("utf-8")
+    return hashing.hash_password(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    # jti lets an access token be revoked before it expires
+    to_encode.setdefault("jti", secrets.token_urlsafe(16))
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def issue_refresh_token(session, user: Customer, family_id: Optional[str] = None) -> str:
+    """Record a new refresh token for `user` in `session` and return the signed JWT.
+
+    The caller commits. `family_id` links a rotated token to its
+    predecessors; a fresh login starts a new family.
+    """
+    import jwt
+
+    now = datetime.utcnow()
+    row = RefreshToken(
+        tokenID=secrets.token_urlsafe(24),
+        familyID=family_id or secrets.token_urlsafe(24),
+        customerID=user.customerID,
+        issuedAt=now,
+        expiresAt=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    session.add(row)
+    claims = {"sub": user.email, "typ": "refresh", "jti": row.tokenID, "exp": row.expiresAt}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def issue_tokens(session, user: Customer, family_id: Optional[str] = None) -> dict:
+    """Access + refresh token response body; commits the refresh token row."""
+    access_token = create_access_token({"sub": user.email, "role": user.role})
+    refresh_token = issue_refresh_token(session, user, family_id)
+    session.commit()
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+def rotate_refresh_token(session, token: str) -> dict:
+    """Exchange a refresh token for a new access/refresh pair.
+
+    Costs a signature check and a few primary-key statements; no password
+    hashing. Each refresh token is single-use: presenting one that was
+    already rotated is treated as theft and revokes its whole family.
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    import jwt
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise invalid
+    if payload.get("typ") != "refresh" or not payload.get("jti"):
+        raise invalid
+    if revocations.is_revoked(payload["jti"]):
+        raise invalid
+
+    row = session.get(RefreshToken, payload["jti"])
+    now = datetime.utcnow()
+    if row is None or row.revokedAt is not None or row.expiresAt <= now:
+        raise invalid
+
+    # conditional update so two concurrent refreshes cannot both succeed
+    claimed = session.execute(
+        update(RefreshToken)
+        .where(RefreshToken.tokenID == row.tokenID, RefreshToken.usedAt.is_(None))
+        .values(usedAt=now)
+    ).rowcount
+    if not claimed:
+        session.execute(
+            update(RefreshToken)
+            .where(RefreshToken.familyID == row.familyID, RefreshToken.revokedAt.is_(None))
+            .values(revokedAt=now)
+        )
+        session.commit()
+        raise invalid
+
+    user = session.get(Customer, row.customerID)
+    if user is None:
+        session.rollback()
+        raise invalid
+    return issue_tokens(session, user, row.familyID)
+
+
+def revoke_token(session, token: str):
+    """Revoke an access or refresh token before it expires (RFC 7009 semantics).
+
+    Revoking a refresh token revokes its whole rotation family. Tokens that
+    are malformed, already expired or carry no jti are ignored.
+    """
+    import jwt
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return
+    jti = payload.get("jti")
+    if not jti:
+        return
+    if payload.get("typ") == "refresh":
+        row = session.get(RefreshToken, jti)
+        if row is not None:
+            session.execute(
+                update(RefreshToken)
+                .where(RefreshToken.familyID == row.familyID, RefreshToken.revokedAt.is_(None))
+                .values(revokedAt=datetime.utcnow())
+            )
+    else:
+        revocations.revoke(session, jti, datetime.utcfromtimestamp(payload["exp"]))
+    session.commit()
+
+
 def get_user_by_email(session, email: str):
     return session.query(Customer).filter(Customer.email == email).first()
 
 
 def authenticate_user(session, email: str, password: str):
+    """The customer for `email` if `password` matches, else None.
+
+    The transaction ends before the password is verified, so the pooled
+    connection is not held while the request waits on the hashing pool.
+    Unknown emails are verified against a dummy hash and take as long as a
+    wrong password.
+    """
     user = get_user_by_email(session, email)
-    if not user:
+    if user is not None:
+        # keeps its loaded attributes through the commit below
+        session.expunge(user)
+    session.commit()
+    if user is None:
+        hashing.pool.verify(password, hashing.dummy_hash())
         return None
-    if not verify_password(password, user.password):
+    if not hashing.pool.verify(password, user.password):
         return None
+    if hashing.needs_rehash(user.password):
+        # upgrade to the current policy while we have the plaintext, in a
+        # short transaction of its own once the new hash is ready
+        new_hash = hashing.pool.hash(password)
+        session.execute(update(Customer).where(Customer.customerID == user.customerID).values(password=new_hash))
+        session.commit()
+        user.password = new_hash
     return user
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> Customer:
+def load_principal(email: str) -> Optional[Principal]:
+    token = principal_cache.fill_token()
+    session = get_session()
+    try:
+        user = get_user_by_email(session, email)
+    finally:
+        session.close()
+    if user is None:
+        return None
+    principal = Principal(customerID=user.customerID, email=user.email, role=user.role)
+    principal_cache.set(email, principal, token)
+    return principal
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    import jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         role: str = payload.get("role")
-        if email is None:
+        if email is None or payload.get("typ") == "refresh":
+            raise credentials_exception
+        if revocations.is_revoked(payload.get("jti")):
             raise credentials_exception
         token_data = TokenData(email=email, role=role)
     except jwt.PyJWTError:
         raise credentials_exception
 
-    session = get_session()
-    try:
-        user = get_user_by_email(session, token_data.email)
-        if user is None:
-            raise credentials_exception
-        return user
-    finally:
-        session.close()
+    if AUTH_PRINCIPAL_MODE == "claims":
+        return Principal(email=token_data.email, role=token_data.role)
+
+    user = principal_cache.get(token_data.email)
+    if user is None:
+        user = load_principal(token_data.email)
+    if user is None:
+        raise credentials_exception
+    return user
+
+
+_PRINCIPAL_FIELDS = ("email", "role", "password")
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_principal_changes(session, flush_context):
+    # emails whose cached principal must go once this transaction commits
+    stale = session.info.setdefault("stale_principals", set())
+    for obj in session.deleted:
+        if isinstance(obj, Customer):
+            stale.add(obj.email)
+    for obj in session.dirty:
+        if not isinstance(obj, Customer):
+            continue
+        state = inspect(obj)
+        for field in _PRINCIPAL_FIELDS:
+            history = state.attrs[field].history
+            if history.has_changes():
+                stale.add(obj.email)
+                if field == "email":
+                    stale.update(history.deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_principals(session):
+    stale = session.info.pop("stale_principals", None)
+    if stale:
+        principal_cache.invalidate(*stale)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_principal_changes(session):
+    session.info.pop("stale_principals", None)
 
 
 def require_role(required_roles: list[str]):
-    def role_checker(current_user: Customer = Depends(get_current_user)):
+    def role_checker(current_user: Principal = Depends(get_current_user)):
         if current_user.role not in required_roles:
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         return current_user
@@ -113,4 +318,13 @@ def require_role(required_roles: list[str]):
     return role_checker
 
 
+def require_internal_token(x_internal_token: Optional[str] = Header(default=None)):
+    if not INTERNAL_API_TOKEN:
+        if INTERNAL_ENDPOINTS_OPEN:
+            return
+        raise HTTPException(status_code=403, detail="Internal endpoints are disabled: INTERNAL_API_TOKEN is not set")
+    if not hmac.compare_digest(x_internal_token or "", INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid internal token")
+
+
 # Routes helpers for login/signup will be used from app.py
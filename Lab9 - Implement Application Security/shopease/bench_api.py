@@ -0,0 +1,265 @@
+"""Benchmark: drive the shopease API in-process and report latency percentiles.
+
+Builds a scratch database (a temporary SQLite file unless --database-url
+points at a throwaway database), fills it with shopease.generate, imports
+the app against it and sends requests through httpx's ASGI transport.
+There is no network hop, so the numbers measure the app and the database.
+
+Each scenario (list, detail, search, addresses, create, update, delete,
+token) runs --requests requests at --concurrency in-flight. The report
+gives p50/p95/p99 latency, throughput, error count and SQL statements per
+request. --save writes the results as a JSON baseline and --compare checks
+a run against one, exiting non-zero when a p95 regresses by more than
+--tolerance.
+
+The target database is modified, so never point this at a real deployment.
+
+Usage:
+    python -m shopease.bench_api --tickets 100000 --concurrency 16 --save baseline.json
+    python -m shopease.bench_api --tickets 100000 --concurrency 16 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+SCENARIOS = ["list", "detail", "search", "addresses", "create", "update", "delete", "token"]
+# bcrypt makes token requests ~1000x slower than the rest; run fewer of them
+TOKEN_REQUEST_SHARE = 0.1
+SEARCH_TERMS = ["smith", "new york", "mary", "lee", "park rd", "chen", "example.com", "iowa"]
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Context:
+    """Shared state the request builders draw from."""
+
+    def __init__(self, rng: random.Random, ticket_ids: list[int], customer_ids: list[int], token: str):
+        self.rng = rng
+        self.ticket_ids = ticket_ids
+        self.customer_ids = customer_ids
+        self.token = token
+        # tickets created by the bulk setup call, consumed by the delete scenario
+        self.deletable: list[int] = []
+
+
+def build_request(scenario: str, ctx: Context):
+    """(method, url, httpx keyword arguments) for one request of `scenario`."""
+    rng = ctx.rng
+    auth = {"Authorization": f"Bearer {ctx.token}"}
+    if scenario == "list":
+        return "GET", "/adsweb/api/v1/tickets", {"params": {"limit": 100}}
+    if scenario == "detail":
+        return "GET", f"/adsweb/api/v1/tickets/{rng.choice(ctx.ticket_ids)}", {}
+    if scenario == "search":
+        return "GET", f"/adsweb/api/v1/customer/search/{rng.choice(SEARCH_TERMS)}", {}
+    if scenario == "addresses":
+        return "GET", "/adsweb/api/v1/customer/addresses", {"params": {"limit": 100}}
+    if scenario == "create":
+        body = {"customerID": rng.choice(ctx.customer_ids), "issueDescription": "bench ticket"}
+        return "POST", "/adsweb/api/v1/ticket", {"json": body, "headers": auth}
+    if scenario == "update":
+        body = {"status": rng.choice(["open", "pending", "closed"])}
+        return "PUT", f"/adsweb/api/v1/ticket/{rng.choice(ctx.ticket_ids)}", {"json": body}
+    if scenario == "delete":
+        return "DELETE", f"/adsweb/api/v1/ticket/{ctx.deletable.pop()}", {}
+    if scenario == "token":
+        return "POST", "/adsweb/api/v1/token", {"data": {"username": "bench.agent@example.com", "password": "benchpass"}}
+    raise ValueError(f"unknown scenario {scenario}")
+
+
+async def run_scenario(client, scenario: str, ctx: Context, requests: int, concurrency: int, count_queries) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        method, url, kwargs = build_request(scenario, ctx)
+        async with semaphore:
+            start = time.perf_counter()
+            resp = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if resp.status_code >= 400:
+            errors += 1
+
+    with count_queries() as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50Ms": round(percentile(latencies, 50), 3),
+        "p95Ms": round(percentile(latencies, 95), 3),
+        "p99Ms": round(percentile(latencies, 99), 3),
+        "meanMs": round(statistics.fmean(latencies), 3),
+        "requestsPerSecond": round(requests / elapsed, 1),
+        "queriesPerRequest": round(counter.count / requests, 2),
+    }
+
+
+def prepare_database(args) -> str:
+    url = args.database_url or f"sqlite:///{tempfile.mktemp(suffix='.db')}"
+    # get_session() and the app's lifespan create the engine from DATABASE_URL
+    os.environ["DATABASE_URL"] = url
+
+    from . import generate
+    from .auth import get_password_hash
+    from .db import get_session
+    from .models import Customer
+
+    generate.generate(url, args.customers, args.agents, args.tickets, chunk=args.chunk, seed=args.seed)
+    session = get_session()
+    try:
+        session.add(Customer(firstName="Bench", lastName="Agent", email="bench.agent@example.com",
+                             password=get_password_hash("benchpass"), role="agent"))
+        session.commit()
+    finally:
+        session.close()
+    return url
+
+
+async def run_all(args) -> dict:
+    from . import db
+    from .app import app
+
+    # httpx's ASGI transport does not send lifespan events; run the handler
+    # so the engines are created and warmed up as under a real server
+    async with app.router.lifespan_context(app):
+        return await run_scenarios(args, app, db)
+
+
+async def run_scenarios(args, app, db) -> dict:
+    import httpx
+    from sqlalchemy import select
+
+    from .models import Customer, SupportTicket
+
+    count_queries = db.count_queries
+    if db.async_engine is not None:
+        def count_queries():
+            return db.count_queries(db.async_engine.sync_engine)
+
+    session = db.get_session()
+    try:
+        ticket_ids = list(session.scalars(select(SupportTicket.ticketID)))
+        customer_ids = list(session.scalars(select(Customer.customerID).where(Customer.role == "customer")))
+    finally:
+        session.close()
+
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        resp = await client.post("/adsweb/api/v1/token", data={"username": "bench.agent@example.com", "password": "benchpass"})
+        resp.raise_for_status()
+        ctx = Context(random.Random(args.seed), ticket_ids, customer_ids, resp.json()["access_token"])
+
+        for scenario in args.scenarios:
+            requests = args.requests
+            if scenario == "token":
+                requests = max(1, int(args.requests * TOKEN_REQUEST_SHARE))
+            if scenario == "delete":
+                # delete fresh tickets (without AI responses) made in bulk calls
+                ctx.deletable = await create_deletable_tickets(client, ctx, requests)
+            results[scenario] = await run_scenario(client, scenario, ctx, requests, args.concurrency, count_queries)
+            print(format_row(scenario, results[scenario]))
+    return results
+
+
+async def create_deletable_tickets(client, ctx, count: int) -> list[int]:
+    """Bulk-create `count` tickets, at most bulk.MAX_BULK_TICKETS per request."""
+    from .bulk import MAX_BULK_TICKETS
+
+    ticket_ids = []
+    for start in range(0, count, MAX_BULK_TICKETS):
+        body = [{"customerID": ctx.rng.choice(ctx.customer_ids), "issueDescription": "bench delete"}
+                for _ in range(min(MAX_BULK_TICKETS, count - start))]
+        resp = await client.post("/adsweb/api/v1/tickets/bulk", json=body, headers={"Authorization": f"Bearer {ctx.token}"})
+        if resp.status_code != 200:
+            raise RuntimeError(f"creating tickets to delete failed: {resp.status_code} {resp.text}")
+        ticket_ids.extend(c["ticketID"] for c in resp.json()["created"])
+    return ticket_ids
+
+
+def format_row(scenario: str, r: dict) -> str:
+    return (f"{scenario:<10} {r['p50Ms']:9.2f} {r['p95Ms']:9.2f} {r['p99Ms']:9.2f} "
+            f"{r['requestsPerSecond']:9.1f} {r['queriesPerRequest']:7.2f} {r['errors']:6d}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print p95/throughput changes against `baseline`; False if any p95 regressed beyond `tolerance`."""
+    ok = True
+    print("\nAgainst baseline:")
+    for scenario, r in results.items():
+        base = baseline.get("results", {}).get(scenario)
+        if not base:
+            continue
+        p95_change = (r["p95Ms"] - base["p95Ms"]) / base["p95Ms"] if base["p95Ms"] else 0.0
+        rps_change = (r["requestsPerSecond"] - base["requestsPerSecond"]) / base["requestsPerSecond"]
+        regressed = p95_change > tolerance
+        ok = ok and not regressed
+        print(f"{scenario:<10} p95 {p95_change:+7.1%}  rps {rps_change:+7.1%}  "
+              f"queries/req {base['queriesPerRequest']} -> {r['queriesPerRequest']}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="scratch database (default: temporary SQLite file)")
+    parser.add_argument("--customers", type=int, default=5_000)
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=50_000)
+    parser.add_argument("--chunk", type=int, default=20_000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write results to this JSON baseline file")
+    parser.add_argument("--compare", help="compare against this JSON baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    url = prepare_database(args)
+    print(f"{'scenario':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'q/req':>7} {'errors':>6}")
+    results = asyncio.run(run_all(args))
+
+    report = {
+        "meta": {
+            "database": url.split(":", 1)[0],
+            "asyncDb": os.environ.get("USE_ASYNC_DB", ""),
+            "customers": args.customers,
+            "tickets": args.tickets,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark: pick a password hashing cost for the current hardware.
+
+Times one hash at each bcrypt cost (or argon2id time cost, at the
+configured memory) and reports the most expensive setting whose median
+latency stays under --target-ms. It never recommends less than
+hashing.MIN_BCRYPT_ROUNDS / MIN_ARGON2_TIME_COST: on hardware too slow for
+those, add workers rather than weaken the hashes. Run it on the machine that serves logins;
+the result is the environment setting to deploy (see hashing.py).
+
+Every hash takes one worker for its whole latency, so the login capacity
+per worker is roughly 1000 / latency_ms hashes per second.
+
+Usage:
+    python -m shopease.bench_password_hash --target-ms 250
+    python -m shopease.bench_password_hash --scheme argon2id --target-ms 250
+"""
+import argparse
+import dataclasses
+import statistics
+import time
+
+from .hashing import MIN_ARGON2_TIME_COST, MIN_BCRYPT_ROUNDS, HashPolicy, hash_password, policy_from_env
+
+PASSWORD = "correct horse battery staple"
+
+
+def median_ms(policy: HashPolicy, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hash_password(PASSWORD, policy)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def sweep(base: HashPolicy, field: str, values, target_ms: float, repeat: int):
+    chosen = None
+    for value in values:
+        policy = dataclasses.replace(base, **{field: value})
+        ms = median_ms(policy, repeat)
+        marker = "ok" if ms <= target_ms else "over"
+        print(f"  {field}={value:<3} {ms:9.1f} ms  ~{1000 / ms:7.1f} hashes/s/worker  {marker}")
+        if ms > target_ms:
+            break
+        chosen = value
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2id"], help="default: PASSWORD_HASH_SCHEME")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="highest acceptable latency per hash")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = policy_from_env()
+    if args.scheme:
+        base = dataclasses.replace(base, scheme=args.scheme)
+
+    print(f"{base.scheme}: target {args.target_ms:.0f} ms per hash")
+    if base.scheme == "argon2id":
+        floor = MIN_ARGON2_TIME_COST
+        chosen = sweep(base, "argon2_time_cost", range(floor, 21), args.target_ms, args.repeat)
+        setting = "ARGON2_TIME_COST"
+    else:
+        floor = MIN_BCRYPT_ROUNDS
+        chosen = sweep(base, "bcrypt_rounds", range(floor, 18), args.target_ms, args.repeat)
+        setting = "BCRYPT_ROUNDS"
+
+    if chosen is None:
+        print(f"Even {setting}={floor}, the lowest acceptable setting, is over target; add workers or raise --target-ms.")
+        chosen = floor
+    print(f"Recommended: {setting}={chosen}")
+
+
+if __name__ == "__main__":
+    main()
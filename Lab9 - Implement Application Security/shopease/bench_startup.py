@@ -0,0 +1,84 @@
+"""Benchmark: cold start of the shopease app, measured in fresh processes.
+
+Each run starts a new interpreter that imports shopease.app, runs the
+lifespan handler (engine creation and warm-up) through TestClient and
+serves one GET /tickets. The child reports the phases recorded by
+shopease.startup; the parent adds the wall time from spawning the process
+to the first response, interpreter startup included. With --budget the
+exit status is non-zero when the median wall time is over it, so CI can
+keep container cold starts in check.
+
+Usage:
+    python -m shopease.bench_startup --runs 10 --budget 2.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CHILD = r"""
+import json
+from fastapi.testclient import TestClient
+from shopease import startup
+from shopease.app import app
+
+with TestClient(app) as client:
+    status = client.get("/adsweb/api/v1/tickets", params={"limit": 100}).status_code
+print(json.dumps({"phases": startup.phases, "status": status}))
+"""
+
+
+def run_once(env: dict, cwd: str) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", CHILD], env=env, cwd=cwd, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"child failed:\n{proc.stderr}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if result["status"] != 200:
+        raise RuntimeError(f"GET /tickets returned {result['status']}")
+    result["wall"] = wall
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="database to start against (default: seeded temporary SQLite file)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("STARTUP_BUDGET_SECONDS") or 0) or None,
+                        help="seconds allowed for the median cold start (default: STARTUP_BUDGET_SECONDS)")
+    args = parser.parse_args()
+
+    url = args.database_url
+    if url is None:
+        from . import seed
+
+        url = f"sqlite:///{tempfile.mktemp(suffix='.db')}"
+        seed.seed_all(url)
+
+    env = dict(os.environ, DATABASE_URL=url)
+    # the directory containing the shopease package
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    runs = [run_once(env, cwd) for _ in range(args.runs)]
+
+    names = list(runs[0]["phases"]) + ["wall"]
+    print(f"{'phase':<12} {'median s':>9} {'max s':>9}")
+    for name in names:
+        values = [r["wall"] if name == "wall" else r["phases"].get(name, 0.0) for r in runs]
+        print(f"{name:<12} {statistics.median(values):9.3f} {max(values):9.3f}")
+
+    median_wall = statistics.median(r["wall"] for r in runs)
+    if args.budget is not None:
+        verdict = "within" if median_wall <= args.budget else "OVER"
+        print(f"\nMedian cold start {median_wall:.3f}s is {verdict} the {args.budget:.3f}s budget")
+        if median_wall > args.budget:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
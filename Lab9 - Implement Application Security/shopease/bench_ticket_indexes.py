@@ -0,0 +1,140 @@
+"""Benchmark: ticket listing query plans before and after the supporttickets indexes.
+
+Builds a scratch database (a temporary SQLite file unless --database-url
+points at a throwaway Postgres database), drops the supporttickets indexes,
+loads synthetic tickets and prints the EXPLAIN output and median latency of
+every ticket listing query shape. It then runs migrate_add_ticket_indexes
+and prints the same report again.
+
+The target database is modified (indexes dropped, rows inserted), so never
+point this at a real deployment.
+
+Usage:
+    python -m shopease.bench_ticket_indexes --tickets 200000
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event, insert, select, text
+
+from . import migrate_add_ticket_indexes
+from .db import init_engine, create_schema, explain
+from .models import Customer, SupportAgent, SupportTicket, TicketStatus
+from .queries import ticket_page_select, encode_ticket_cursor
+
+CHUNK = 10_000
+
+
+def populate(engine, tickets: int, customers: int, agents: int, seed: int = 42):
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    statuses = [TicketStatus.open, TicketStatus.pending, TicketStatus.closed]
+    with engine.begin() as conn:
+        conn.execute(insert(Customer.__table__), [
+            {"firstname": f"First{i}", "lastname": f"Last{i}", "email": f"bench{i}@example.com", "role": "customer"}
+            for i in range(customers)
+        ])
+        conn.execute(insert(SupportAgent.__table__), [
+            {"firstname": f"Agent{i}", "lastname": "Bench", "email": f"agent{i}@example.com"}
+            for i in range(agents)
+        ])
+        for start in range(0, tickets, CHUNK):
+            conn.execute(insert(SupportTicket.__table__), [
+                {
+                    "customerid": rng.randint(1, customers),
+                    "supportagentid": rng.randint(1, agents) if rng.random() < 0.8 else None,
+                    "issuedescription": f"Synthetic issue {n}",
+                    "createdat": now - datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+                    "status": rng.choices(statuses, weights=[2, 1, 7])[0],
+                }
+                for n in range(start, min(start + CHUNK, tickets))
+            ])
+
+
+def query_shapes(engine):
+    """The statements the ticket list endpoint issues, with realistic arguments."""
+    with engine.connect() as conn:
+        total = conn.execute(text("SELECT COUNT(*) FROM supporttickets")).scalar()
+        middle_created, middle_id = conn.execute(
+            select(SupportTicket.createdAt, SupportTicket.ticketID)
+            .order_by(SupportTicket.createdAt.desc(), SupportTicket.ticketID.desc())
+            .offset(total // 2)
+            .limit(1)
+        ).one()
+    now = datetime.datetime.utcnow()
+    return [
+        ("first page", ticket_page_select(limit=100)),
+        ("deep page (cursor)", ticket_page_select(limit=100, cursor=encode_ticket_cursor(middle_created, middle_id))),
+        ("status=pending", ticket_page_select(limit=100, status="pending")),
+        ("customerID filter", ticket_page_select(limit=100, customer_id=42)),
+        ("supportAgentID filter", ticket_page_select(limit=100, agent_id=7)),
+        ("created range (7 days)", ticket_page_select(
+            limit=100, created_from=now - datetime.timedelta(days=37), created_to=now - datetime.timedelta(days=30)
+        )),
+    ]
+
+
+def report(engine, title: str, repeat: int):
+    print(f"\n=== {title} ===")
+    for name, stmt in query_shapes(engine):
+        with engine.connect() as conn:
+            captured = []
+
+            def capture(conn_, cursor, statement, parameters, context, executemany):
+                captured.append((statement, parameters))
+
+            event.listen(conn, "before_cursor_execute", capture)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(stmt).all()
+                timings.append(time.perf_counter() - start)
+            event.remove(conn, "before_cursor_execute", capture)
+
+            plan = explain(conn, *captured[0])
+        print(f"\n-- {name}: median {statistics.median(timings) * 1000:.2f} ms over {repeat} runs")
+        for line in plan:
+            print(f"   {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="scratch database (default: temporary SQLite file)")
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--customers", type=int, default=5_000)
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    url = args.database_url
+    if url is None:
+        tmpdir = tempfile.mkdtemp(prefix="shopease-bench-")
+        url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    print(f"Database: {url}")
+
+    engine = init_engine(url)
+    create_schema()
+    with engine.begin() as conn:
+        for index in SupportTicket.__table__.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    start = time.perf_counter()
+    populate(engine, args.tickets, args.customers, args.agents)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    print(f"Loaded {args.tickets} tickets in {time.perf_counter() - start:.1f}s")
+
+    report(engine, "before: no supporttickets indexes", args.repeat)
+    migrate_add_ticket_indexes.run(url)
+    # drop pooled connections so no statement prepared before the migration is reused
+    engine.dispose()
+    report(engine, "after: migrate_add_ticket_indexes", args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Set-based ticket writes for the bulk endpoints.
+
+Shared by the sync routes in app.py and the async ones in async_routes.py:
+the functions here only build statements and shape results, the caller
+executes them. These are Core statements, so the Session hooks that bump
+the ticket table version do not fire; callers bump it themselves.
+"""
+from fastapi import HTTPException
+from sqlalchemy import insert, select, update
+
+from .models import Customer, SupportAgent, SupportTicket, TicketStatus
+from .queries import parse_ticket_status, ticket_filters
+from .schemas import TicketBulkUpdate, TicketCreate
+
+MAX_BULK_TICKETS = 1000
+
+
+def check_batch_size(items):
+    if not items:
+        raise HTTPException(status_code=400, detail="At least one ticket is required")
+    if len(items) > MAX_BULK_TICKETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_TICKETS} tickets per request")
+
+
+def existing_customers_select(items: list[TicketCreate]):
+    return select(Customer.customerID).where(Customer.customerID.in_({i.customerID for i in items}))
+
+
+def existing_agents_select(items: list[TicketCreate]):
+    """Select the referenced agents that exist, or None if no item names one."""
+    ids = {i.supportAgentID for i in items if i.supportAgentID is not None}
+    if not ids:
+        return None
+    return select(SupportAgent.agentID).where(SupportAgent.agentID.in_(ids))
+
+
+def validate_new_tickets(items: list[TicketCreate], customer_ids: set, agent_ids: set):
+    """Split a batch into (insert parameter rows, their item indexes, per-item errors)."""
+    rows, indexes, errors = [], [], []
+    valid_statuses = ", ".join([e.value for e in TicketStatus])
+    for index, item in enumerate(items):
+        if item.customerID not in customer_ids:
+            errors.append({"index": index, "detail": f"Customer with id {item.customerID} does not exist"})
+            continue
+        if item.supportAgentID is not None and item.supportAgentID not in agent_ids:
+            errors.append({"index": index, "detail": f"SupportAgent with id {item.supportAgentID} does not exist"})
+            continue
+        try:
+            status = TicketStatus(item.status) if item.status else TicketStatus.open
+        except ValueError:
+            errors.append({"index": index, "detail": f"Invalid status. Valid values: {valid_statuses}"})
+            continue
+        rows.append({
+            "customerID": item.customerID,
+            "supportAgentID": item.supportAgentID,
+            "issueDescription": item.issueDescription,
+            "status": status,
+        })
+        indexes.append(index)
+    return rows, indexes, errors
+
+
+def insert_tickets_stmt(dialect_name: str):
+    """INSERT ... RETURNING ticketid, executed once with every row as parameters.
+
+    SQLAlchemy batches the rows into multi-row INSERTs ("insertmanyvalues").
+    PostgreSQL can return IDs in parameter order using the serial key as a
+    sentinel. SQLite cannot, and asking for ordered RETURNING there falls
+    back to one INSERT per row, so on SQLite pass the IDs through
+    `inserted_ids()` instead.
+
+    render_nulls keeps None values (an unassigned agent) in the statement.
+    Without it the ORM drops those keys, and rows with different key sets
+    go into separate INSERTs, so a mixed batch becomes one INSERT per row.
+    """
+    stmt = insert(SupportTicket).execution_options(render_nulls=True)
+    if dialect_name == "sqlite":
+        return stmt.returning(SupportTicket.ticketID)
+    return stmt.returning(SupportTicket.ticketID, sort_by_parameter_order=True)
+
+
+def inserted_ids(ticket_ids, dialect_name: str) -> list[int]:
+    # SQLite assigns rowids in VALUES order and runs the batches one after
+    # another, so ascending IDs are parameter order
+    if dialect_name == "sqlite":
+        return sorted(ticket_ids)
+    return list(ticket_ids)
+
+
+def created_result(indexes: list[int], ticket_ids: list[int], errors: list[dict]) -> dict:
+    return {
+        "created": [{"index": i, "ticketID": t} for i, t in zip(indexes, ticket_ids)],
+        "errors": errors,
+    }
+
+
+def update_tickets_stmt(payload: TicketBulkUpdate):
+    """One set-based UPDATE ... RETURNING ticketid for a bulk change.
+
+    Raises 400 unless exactly one of `ticketIDs`/`filter` selects the
+    tickets, the filter has at least one condition (so a typo cannot
+    rewrite every ticket) and at least one change is requested.
+    """
+    if (payload.ticketIDs is None) == (payload.filter is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of ticketIDs or filter")
+    if payload.status is None and payload.supportAgentID is None:
+        raise HTTPException(status_code=400, detail="Nothing to update: set status and/or supportAgentID")
+
+    if payload.ticketIDs is not None:
+        if not payload.ticketIDs:
+            raise HTTPException(status_code=400, detail="ticketIDs must not be empty")
+        if len(payload.ticketIDs) > MAX_BULK_TICKETS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_TICKETS} ticketIDs per request")
+        where = [SupportTicket.ticketID.in_(set(payload.ticketIDs))]
+    else:
+        f = payload.filter
+        where = ticket_filters(f.status, f.customerID, f.supportAgentID, f.createdFrom, f.createdTo)
+        if not where:
+            raise HTTPException(status_code=400, detail="filter must have at least one condition")
+
+    values = {}
+    if payload.status is not None:
+        values["status"] = parse_ticket_status(payload.status)
+    if payload.supportAgentID is not None:
+        values["supportAgentID"] = payload.supportAgentID or None
+
+    return (
+        update(SupportTicket)
+        .where(*where)
+        .values(**values)
+        .returning(SupportTicket.ticketID)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def agent_exists_select(agent_id: int):
+    return select(SupportAgent.agentID).where(SupportAgent.agentID == agent_id)
+
+
+def updated_result(ticket_ids: list[int]) -> dict:
+    return {"updated": len(ticket_ids), "ticketIDs": sorted(ticket_ids)}
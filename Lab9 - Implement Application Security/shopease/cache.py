@@ -0,0 +1,155 @@
+"""Read-through cache for ticket detail representations.
+
+`ticket_cache` holds the dict returned by GET /tickets/{id}, keyed by
+ticket ID and tagged with the ticket table version (versioning.py) it was
+read at. Each read looks the current version up (one primary-key query)
+and treats an entry from another version as a miss. The version is bumped
+by every worker's ticket writes and by customer/agent name or email
+changes, so no worker serves a detail older than the last such write.
+Handlers that change a ticket also call `invalidate()` after their commit
+to free the local entry. Settings (environment):
+
+    TICKET_CACHE_BACKEND   memory (default) or none
+    TICKET_CACHE_MAXSIZE   entries kept before LRU eviction (default 1024)
+    TICKET_CACHE_TTL       seconds an entry stays valid (default 30)
+
+Any object with the same get/fill_token/set/invalidate/clear/stats methods
+can be installed with `configure_ticket_cache()`, e.g. a shared cache.
+`TTLCache` also backs `auth.principal_cache`.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Fills are guarded against racing invalidations: a reader takes
+    `fill_token()` before querying the database and passes it to `set()`;
+    if any invalidation happened in between the value is dropped instead of
+    caching data that may predate the write.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def fill_token(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, token: int | None = None):
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class NullCache:
+    """Cache that stores nothing; every lookup goes to the database."""
+
+    def get(self, key):
+        return None
+
+    def fill_token(self):
+        return None
+
+    def set(self, key, value, token=None):
+        pass
+
+    def invalidate(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "none"}
+
+
+def _from_env():
+    if os.environ.get("TICKET_CACHE_BACKEND", "memory").lower() == "none":
+        return NullCache()
+    return TTLCache(
+        maxsize=int(os.environ.get("TICKET_CACHE_MAXSIZE", "1024")),
+        ttl=float(os.environ.get("TICKET_CACHE_TTL", "30")),
+    )
+
+
+ticket_cache = _from_env()
+
+
+def configure_ticket_cache(backend):
+    global ticket_cache
+    ticket_cache = backend
+    return backend
+
+
+def cached_ticket(ticket_id: int, version: int):
+    """The cached detail for `ticket_id` if it was read at `version`, else None."""
+    entry = ticket_cache.get(ticket_id)
+    if entry is None or entry[0] != version:
+        return None
+    return entry[1]
+
+
+def store_ticket(ticket_id: int, version: int, ticket: dict, token):
+    ticket_cache.set(ticket_id, (version, ticket), token)
@@ -1,52 +1,99 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 try:
     from .models import Base
+    from .pooling import pool_options_from_env
 except Exception:
     # fallback for when modules are run directly (no package context)
     from models import Base
+    from pooling import pool_options_from_env
 
-import dotenv
 from dotenv import find_dotenv, load_dotenv
 
-# Attempt to locate a .env file in this directory or parent directories and load it.
-dotenv_path = find_dotenv()
+# Load shopease/.env if there is one, otherwise the nearest .env in a
+# parent directory. This runs once, before the modules that read their
+# settings from the environment are imported.
+package_env = os.path.join(os.path.dirname(__file__), ".env")
+dotenv_path = package_env if os.path.exists(package_env) else find_dotenv()
 if dotenv_path:
     load_dotenv(dotenv_path)
 
-# First try to load a .env file located next to this module (shopease/.env)
-package_env = os.path.join(os.path.dirname(__file__), ".env")
-if os.path.exists(package_env):
-    load_dotenv(package_env)
-else:
-    # fallback to any .env found in parent dirs
-    dotenv_path = find_dotenv()
-    if dotenv_path:
-        load_dotenv(dotenv_path)
-
-# Now read DATABASE_URL from the environment
-DATABASE_URL = os.environ.get("DATABASE_URL")
+# Set USE_ASYNC_DB=1 to serve the ticket and customer endpoints from the
+# async engine (asyncpg on Postgres, aiosqlite on SQLite).
+USE_ASYNC_DB = os.environ.get("USE_ASYNC_DB", "").lower() in ("1", "true", "yes")
 
 engine = None
 SessionLocal = None
+async_engine = None
+AsyncSessionLocal = None
+
+# sync driver -> async driver used by init_async_engine
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
 
 
 def init_engine(url: str | None = None):
+    """Create the sync engine and session factory.
+
+    `url` defaults to DATABASE_URL, read when this is called (normally from
+    the app's lifespan handler), not when the module is imported.
+    """
     global engine, SessionLocal
     if url is None:
-        url = DATABASE_URL
+        url = os.environ.get("DATABASE_URL")
     if not url:
         raise RuntimeError(
             "DATABASE_URL not set in environment and no URL provided.\n"
             "Make sure you have a .env file with DATABASE_URL or set the environment variable."
         )
-    engine = create_engine(url, echo=False)
+    # pool sizing comes from DB_POOL_* environment variables (see pooling.py)
+    engine = create_engine(url, echo=False, **pool_options_from_env(url))
     SessionLocal = sessionmaker(bind=engine)
     return engine
 
 
+def to_async_url(url: str):
+    """Swap a sync driver in `url` for its async counterpart, if known."""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    if driver:
+        parsed = parsed.set(drivername=driver)
+    return parsed
+
+
+def init_async_engine(url: str | None = None):
+    """Create the async engine/session factory used by `async_routes`.
+
+    Falls back to ASYNC_DATABASE_URL, then DATABASE_URL, converting the
+    driver with `to_async_url`.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    global async_engine, AsyncSessionLocal
+    if url is None:
+        url = os.environ.get("ASYNC_DATABASE_URL") or os.environ.get("DATABASE_URL")
+    if not url:
+        raise RuntimeError(
+            "DATABASE_URL not set in environment and no URL provided.\n"
+            "Make sure you have a .env file with DATABASE_URL or set the environment variable."
+        )
+    # same DB_POOL_* settings as the sync engine (see pooling.py)
+    async_url = to_async_url(url)
+    async_engine = create_async_engine(async_url, echo=False, **pool_options_from_env(async_url, is_async=True))
+    # keep attributes loaded after commit; async sessions cannot lazy-load them
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    return async_engine
+
+
 def create_schema():
     if engine is None:
         raise RuntimeError("Engine not initialized. Call init_engine first.")
@@ -54,6 +101,72 @@ def create_schema():
 
 
 def get_session():
+    # scripts and tests that use the package without starting the app get
+    # an engine on first use
     if SessionLocal is None:
-        raise RuntimeError("SessionLocal not initialized. Call init_engine first.")
+        init_engine()
     return SessionLocal()
+
+
+def get_async_session():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("AsyncSessionLocal not initialized. Call init_async_engine first.")
+    return AsyncSessionLocal()
+
+
+class QueryCounter:
+    """Collects the SQL statements executed on an engine while active."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(bind=None):
+    """Count statements sent to the database inside a ``with`` block.
+
+    Usage:
+        with count_queries() as counter:
+            client.get("/adsweb/api/v1/tickets")
+        assert counter.count == 2
+    """
+    bind = bind or engine
+    if bind is None:
+        raise RuntimeError("Engine not initialized. Call init_engine first.")
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", counter._before_cursor_execute)
+
+
+EXPLAIN_PREFIX = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+}
+
+
+def explain(conn, statement: str, parameters=()) -> list[str]:
+    """Return the database's plan for an already-compiled statement.
+
+    `statement`/`parameters` are what the DBAPI cursor received (as seen by
+    a `before_cursor_execute` listener), so the plan is for exactly the SQL
+    that ran. `conn` is a SQLAlchemy Connection.
+    """
+    prefix = EXPLAIN_PREFIX.get(conn.dialect.name, "EXPLAIN ")
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    # sqlite returns (id, parent, notused, detail); postgres one text column
+    return [str(row[-1]) for row in rows]
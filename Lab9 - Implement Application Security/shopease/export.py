@@ -0,0 +1,58 @@
+"""Line-oriented encoders used by the streaming export endpoints.
+
+Each encoder consumes an iterable of dicts lazily and yields text chunks of
+roughly `chunk_size` records, so the caller never holds more than one chunk
+of the result set in memory.
+"""
+import csv
+import datetime
+import enum
+import io
+import json
+
+EXPORT_CHUNK_SIZE = 1000
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.name
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def ndjson_chunks(records, chunk_size: int = EXPORT_CHUNK_SIZE):
+    buf = []
+    for record in records:
+        buf.append(json.dumps(record, default=_json_default))
+        if len(buf) >= chunk_size:
+            yield "\n".join(buf) + "\n"
+            buf = []
+    if buf:
+        yield "\n".join(buf) + "\n"
+
+
+def csv_chunks(records, fieldnames: list[str], chunk_size: int = EXPORT_CHUNK_SIZE):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    pending = 0
+    for record in records:
+        writer.writerow({
+            k: (v.isoformat() if isinstance(v, datetime.datetime) else v.name if isinstance(v, enum.Enum) else v)
+            for k, v in record.items()
+        })
+        pending += 1
+        if pending >= chunk_size:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+            pending = 0
+    # always flush so an empty export still carries the header row
+    if pending or out.tell():
+        yield out.getvalue()
@@ -0,0 +1,327 @@
+"""Generate a large synthetic dataset for load and benchmark runs.
+
+Creates customers, agents, tickets, attachments, AI responses and
+notifications with skewed, realistic-looking distributions: a minority of
+customers file most tickets, and a few agents carry most of the load. Ticket
+age drives status (old tickets are mostly closed), roughly a third of tickets
+carry attachments and most get an AI response.
+
+Rows are generated and loaded in chunks. PostgreSQL loads use COPY
+(psycopg2 or psycopg 3) and other databases use executemany. Every customer
+gets the same password, hashed once up front. IDs are assigned from the
+current maximum, so chunks are independent and `--workers` processes load
+them in parallel (keep one worker on SQLite, which has a single writer).
+
+Usage:
+    python -m shopease.generate --customers 1000000 --tickets 10000000 --workers 8
+"""
+import argparse
+import csv
+import datetime
+import enum
+import io
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import create_engine, func, insert, select, text
+
+from . import versioning
+from .db import init_engine, create_schema
+from .hashing import hash_password
+from .models import (
+    Customer,
+    SupportAgent,
+    SupportTicket,
+    Attachment,
+    AIResponse,
+    Notification,
+    TicketStatus,
+    AttachmentType,
+    NotificationType,
+    extract_city_from_address,
+)
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Maria",
+    "Wei", "Fatima", "Ahmed", "Aisha", "Hiroshi", "Yuki", "Olga", "Ivan", "Priya", "Raj",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Nguyen", "Chen", "Khan", "Ali", "Tanaka", "Ivanova", "Patel", "Singh", "Kim",
+]
+STREETS = ["Main St", "High St", "Oak Ave", "Park Rd", "Maple Dr", "Cedar Ln", "Lake St", "Hill Rd", "Pine St", "Elm St"]
+# (city, relative weight): a few large cities hold most customers
+CITIES = [
+    ("New York", 30), ("Los Angeles", 18), ("Chicago", 12), ("Houston", 10), ("Phoenix", 7),
+    ("Philadelphia", 6), ("San Antonio", 5), ("San Diego", 5), ("Dallas", 5), ("Austin", 4),
+    ("Fairfield", 2), ("Springfield", 2), ("Iowa City", 1), ("Burlington", 1), ("Boulder", 1),
+]
+ISSUES = [
+    "Cannot checkout: payment page times out",
+    "Payment failed but card was charged",
+    "Order {n} arrived damaged",
+    "Wrong item received in order {n}",
+    "Refund for order {n} not received",
+    "Cannot reset password",
+    "Discount code rejected at checkout",
+    "Tracking number for order {n} does not work",
+    "Account locked after too many login attempts",
+    "Package marked delivered but not received",
+    "Want to change shipping address for order {n}",
+    "App crashes when opening cart",
+]
+AI_REPLIES = [
+    "Try clearing your browser cache and retrying the payment.",
+    "We have issued a refund; it should appear within 5 business days.",
+    "A replacement has been scheduled for shipment.",
+    "Please use the password reset link sent to your email.",
+    "The carrier reports a delay; tracking will update within 24 hours.",
+]
+NOTIFICATIONS = ["Your ticket was created", "Your ticket was updated", "Your ticket was closed", "Your order has shipped"]
+
+_CITY_NAMES = [c for c, _ in CITIES]
+_CITY_WEIGHTS = [w for _, w in CITIES]
+
+# engines opened by this worker process, by database URL
+_engines = {}
+
+
+def _skewed(rng: random.Random, n: int) -> int:
+    # index in [0, n) with density falling off towards n: the busiest 1%
+    # of customers (or agents) get about 10% of the tickets
+    return int(n * rng.random() ** 2)
+
+
+def _customer_rows(rng, start, stop, opts):
+    for cid in range(start, stop):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        city = rng.choices(_CITY_NAMES, _CITY_WEIGHTS)[0]
+        address = f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, {city}, {rng.randint(10000, 99999)}"
+        yield (
+            cid, first, last, f"{first.lower()}.{last.lower()}.{cid}@example.com",
+            f"{rng.randint(200, 999)}{rng.randint(1000000, 9999999)}", address,
+            opts["password_hash"], "customer", extract_city_from_address(address),
+        )
+
+
+def _notification_rows(rng, start, stop, opts):
+    now = opts["now"]
+    for cid in range(start, stop):
+        for _ in range(int(rng.expovariate(1 / opts["notifications_per_customer"])) if opts["notifications_per_customer"] else 0):
+            kind = NotificationType.email if rng.random() < 0.8 else NotificationType.sms
+            yield (cid, kind, rng.choice(NOTIFICATIONS), now - datetime.timedelta(seconds=rng.randint(0, opts["span_seconds"])))
+
+
+def _ticket_rows(rng, start, stop, opts):
+    now, span = opts["now"], opts["span_seconds"]
+    first_customer, customers = opts["customer_range"]
+    first_agent, agents = opts["agent_range"]
+    for tid in range(start, stop):
+        age = int(span * rng.random() ** 2)  # more recent tickets than old ones
+        created = now - datetime.timedelta(seconds=age)
+        open_odds = max(0.05, 1 - age / (14 * 86400))
+        roll = rng.random()
+        status = TicketStatus.open if roll < open_odds * 0.6 else TicketStatus.pending if roll < open_odds else TicketStatus.closed
+        agent = first_agent + _skewed(rng, agents) if agents and rng.random() < 0.85 else None
+        issue = rng.choice(ISSUES).format(n=rng.randint(100000, 999999))
+        yield (tid, first_customer + _skewed(rng, customers), agent, issue, created, status)
+
+
+def _attachment_rows(rng, ticket_ids, opts):
+    for tid in ticket_ids:
+        if rng.random() >= opts["attachment_rate"]:
+            continue
+        for k in range(rng.choice((1, 1, 1, 2, 3))):
+            kind = rng.choices([AttachmentType.image, AttachmentType.log, AttachmentType.other], [6, 3, 1])[0]
+            ext = {"image": "png", "log": "txt", "other": "bin"}[kind.name]
+            yield (tid, kind, f"/uploads/{tid}/{k}.{ext}", None)
+
+
+def _response_rows(rng, tickets, opts):
+    for tid, created in tickets:
+        if rng.random() >= opts["response_rate"]:
+            continue
+        score = round(rng.betavariate(5, 2), 3)
+        yield (tid, rng.choice(AI_REPLIES), score, created + datetime.timedelta(seconds=rng.randint(5, 600)))
+
+
+def _csv_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def write_rows(conn, table, columns: list[str], rows: list[tuple]):
+    """Append `rows` to `table`: COPY on PostgreSQL, executemany elsewhere."""
+    if not rows:
+        return
+    driver = conn.dialect.driver
+    if conn.dialect.name == "postgresql" and driver in ("psycopg2", "psycopg"):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow([_csv_value(v) for v in row])
+        copy_sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if driver == "psycopg2":
+                buf.seek(0)
+                cursor.copy_expert(copy_sql, buf)
+            else:
+                with cursor.copy(copy_sql) as copy:
+                    copy.write(buf.getvalue())
+        finally:
+            cursor.close()
+        return
+    conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+def _engine(url: str):
+    if url not in _engines:
+        engine = create_engine(url)
+        _engines[url] = engine
+    return _engines[url]
+
+
+def load_chunk(url: str, kind: str, start: int, stop: int, opts: dict) -> dict:
+    """Generate and load one independent chunk; runs in a worker process."""
+    rng = random.Random(f"{opts['seed']}-{kind}-{start}")
+    counts = {}
+    with _engine(url).begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA synchronous = OFF")
+        if kind == "customers":
+            cols = ["customerid", "firstname", "lastname", "email", "phone", "address", "password", "role", "city"]
+            rows = list(_customer_rows(rng, start, stop, opts))
+            write_rows(conn, Customer.__table__, cols, rows)
+            counts["customers"] = len(rows)
+            rows = list(_notification_rows(rng, start, stop, opts))
+            write_rows(conn, Notification.__table__, ["customerid", "type", "message", "sentat"], rows)
+            counts["notifications"] = len(rows)
+        else:
+            cols = ["ticketid", "customerid", "supportagentid", "issuedescription", "createdat", "status"]
+            tickets = list(_ticket_rows(rng, start, stop, opts))
+            write_rows(conn, SupportTicket.__table__, cols, tickets)
+            counts["tickets"] = len(tickets)
+            rows = list(_attachment_rows(rng, (t[0] for t in tickets), opts))
+            write_rows(conn, Attachment.__table__, ["ticketid", "type", "filepath", "transcription"], rows)
+            counts["attachments"] = len(rows)
+            rows = list(_response_rows(rng, ((t[0], t[4]) for t in tickets), opts))
+            write_rows(conn, AIResponse.__table__, ["ticketid", "generatedtext", "confidencescore", "timestamp"], rows)
+            counts["responses"] = len(rows)
+    return counts
+
+
+def _next_id(conn, column) -> int:
+    return (conn.execute(select(func.max(column))).scalar() or 0) + 1
+
+
+def _reset_sequences(conn):
+    # explicit IDs do not advance PostgreSQL serial sequences
+    for table, column in [("customers", "customerid"), ("supportagents", "agentid"), ("supporttickets", "ticketid")]:
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT MAX({column}) FROM {table}))"
+        ))
+
+
+def _run_chunks(url, units, opts, workers):
+    totals = {}
+    if workers <= 1:
+        results = (load_chunk(url, *unit, opts) for unit in units)
+        for counts in results:
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(load_chunk, url, *unit, opts) for unit in units]
+        for future in futures:
+            for key, value in future.result().items():
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def generate(database_url: str, customers: int, agents: int, tickets: int, workers: int = 1, chunk: int = 20_000,
+             attachment_rate: float = 0.3, response_rate: float = 0.6, notifications_per_customer: float = 1.5,
+             password: str = "password", days: int = 365, seed: int = 42) -> dict:
+    engine = init_engine(database_url)
+    create_schema()
+    url = engine.url.render_as_string(hide_password=False)
+
+    with engine.begin() as conn:
+        first_customer = _next_id(conn, Customer.customerID)
+        first_agent = _next_id(conn, SupportAgent.agentID)
+        first_ticket = _next_id(conn, SupportTicket.ticketID)
+        agent_rows = [
+            (first_agent + i, random.Random(f"{seed}-agent-{i}").choice(FIRST_NAMES), "Agent", f"agent{first_agent + i}@example.com")
+            for i in range(agents)
+        ]
+        write_rows(conn, SupportAgent.__table__, ["agentid", "firstname", "lastname", "email"], agent_rows)
+    # let worker processes open their own connections
+    engine.dispose()
+
+    opts = {
+        "seed": seed,
+        "now": datetime.datetime.utcnow(),
+        "span_seconds": days * 86400,
+        "password_hash": hash_password(password),
+        "customer_range": (first_customer, customers),
+        "agent_range": (first_agent, agents),
+        "attachment_rate": attachment_rate,
+        "response_rate": response_rate,
+        "notifications_per_customer": notifications_per_customer,
+    }
+    totals = {"agents": agents}
+    customer_units = [("customers", s, min(s + chunk, first_customer + customers)) for s in range(first_customer, first_customer + customers, chunk)]
+    totals.update(_run_chunks(url, customer_units, opts, workers))
+    if customers:
+        ticket_units = [("tickets", s, min(s + chunk, first_ticket + tickets)) for s in range(first_ticket, first_ticket + tickets, chunk)]
+        totals.update(_run_chunks(url, ticket_units, opts, workers))
+
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            _reset_sequences(conn)
+        versioning.bump(conn)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=1, help="parallel loader processes (use 1 on SQLite)")
+    parser.add_argument("--chunk", type=int, default=20_000, help="rows per generated chunk")
+    parser.add_argument("--attachment-rate", type=float, default=0.3, help="share of tickets with attachments")
+    parser.add_argument("--response-rate", type=float, default=0.6, help="share of tickets with an AI response")
+    parser.add_argument("--notifications-per-customer", type=float, default=1.5)
+    parser.add_argument("--password", default="password", help="password for every generated customer")
+    parser.add_argument("--days", type=int, default=365, help="spread ticket creation over this many days")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.customers <= 0 and args.tickets > 0:
+        parser.error("--tickets needs --customers > 0")
+
+    start = time.perf_counter()
+    totals = generate(
+        args.database_url, args.customers, args.agents, args.tickets, args.workers, args.chunk,
+        args.attachment_rate, args.response_rate, args.notifications_per_customer, args.password, args.days, args.seed,
+    )
+    elapsed = time.perf_counter() - start
+    rows = sum(totals.values())
+    print(", ".join(f"{k}={v}" for k, v in totals.items()))
+    print(f"Loaded {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Bounded executor for password hashing and verification.
+
+bcrypt is deliberately slow, so /token, /login and /signup hand it to a
+dedicated pool instead of running it on the request threadpool. Settings
+(environment):
+
+    PASSWORD_HASH_EXECUTOR   process (default) or thread
+    PASSWORD_HASH_WORKERS    concurrent hashes (default: half the CPUs, max 4)
+    PASSWORD_HASH_MAX_QUEUE  hashes allowed to wait for a worker (default 8 per worker)
+    PASSWORD_HASH_TIMEOUT    seconds a request waits for its result (default 5)
+
+The hashing policy for new hashes is configured the same way:
+
+    PASSWORD_HASH_SCHEME     bcrypt (default) or argon2id (needs argon2-cffi);
+                             anything else fails at startup
+    BCRYPT_ROUNDS            bcrypt cost factor (default 12)
+    ARGON2_TIME_COST         argon2id iterations (default 3)
+    ARGON2_MEMORY_KIB        argon2id memory in KiB (default 65536)
+    ARGON2_PARALLELISM       argon2id lanes (default 1)
+
+Stored hashes of either scheme always verify. `needs_rehash()` reports
+hashes made with other parameters so logins can upgrade them; use
+bench_password_hash to pick a cost for the current hardware.
+
+When workers and queue are all taken, further requests are rejected with 503
+immediately, so a login storm holds at most workers + queue request threads
+and the rest of the API keeps its threadpool.
+
+bcrypt (and argon2) are imported on first use, so importing the app does
+not load them. Process workers are started with spawn and import only
+this module, which needs just bcrypt and the standard library. As with
+any spawn pool, a script that serves the app directly must keep its
+startup code under `if __name__ == "__main__":`.
+"""
+import base64
+import hashlib
+import multiprocessing
+import os
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+@dataclass(frozen=True)
+class HashPolicy:
+    scheme: str = "bcrypt"
+    bcrypt_rounds: int = 12
+    argon2_time_cost: int = 3
+    argon2_memory_kib: int = 65536
+    argon2_parallelism: int = 1
+
+
+SCHEMES = ("bcrypt", "argon2id")
+# lowest costs bench_password_hash will recommend
+MIN_BCRYPT_ROUNDS = 10
+MIN_ARGON2_TIME_COST = 2
+
+
+def policy_from_env() -> HashPolicy:
+    scheme = os.environ.get("PASSWORD_HASH_SCHEME", "bcrypt").lower()
+    if scheme not in SCHEMES:
+        raise RuntimeError(f"PASSWORD_HASH_SCHEME must be one of {', '.join(SCHEMES)}, not {scheme!r}")
+    return HashPolicy(
+        scheme=scheme,
+        bcrypt_rounds=int(os.environ.get("BCRYPT_ROUNDS", "12")),
+        argon2_time_cost=int(os.environ.get("ARGON2_TIME_COST", "3")),
+        argon2_memory_kib=int(os.environ.get("ARGON2_MEMORY_KIB", "65536")),
+        argon2_parallelism=int(os.environ.get("ARGON2_PARALLELISM", "1")),
+    )
+
+
+def _argon2_hasher(policy: HashPolicy):
+    try:
+        from argon2 import PasswordHasher
+    except ImportError:
+        raise RuntimeError("PASSWORD_HASH_SCHEME=argon2id requires the argon2-cffi package")
+    return PasswordHasher(
+        time_cost=policy.argon2_time_cost,
+        memory_cost=policy.argon2_memory_kib,
+        parallelism=policy.argon2_parallelism,
+    )
+
+
+def _prehash(password: str) -> bytes:
+    # pre-hash with SHA-256 and base64-encode so passwords over bcrypt's
+    # 72-byte limit are not silently truncated
+    return base64.b64encode(hashlib.sha256(password.encode("utf-8")).digest())
+
+
+def hash_password(password: str, policy: HashPolicy | None = None) -> str:
+    import bcrypt
+
+    policy = policy or POLICY
+    if policy.scheme == "argon2id":
+        return _argon2_hasher(policy).hash(password)
+    return bcrypt.hashpw(_prehash(password), bcrypt.gensalt(rounds=policy.bcrypt_rounds)).decode("utf-8")
+
+
+def check_password(password: str, hashed_password: str) -> bool:
+    """Whether `password` matches; False for a mismatch or a malformed hash.
+
+    A missing argon2-cffi raises instead: that is a deployment problem, not
+    a wrong password.
+    """
+    if not hashed_password:
+        return False
+    if hashed_password.startswith("$argon2"):
+        hasher = _argon2_hasher(HashPolicy(scheme="argon2id"))
+        from argon2.exceptions import InvalidHashError, VerificationError
+
+        try:
+            return hasher.verify(hashed_password, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    import bcrypt
+
+    try:
+        return bcrypt.checkpw(_prehash(password), hashed_password.encode("utf-8"))
+    except ValueError:
+        # not a bcrypt hash ("Invalid salt")
+        return False
+
+
+def needs_rehash(hashed_password: str, policy: HashPolicy | None = None) -> bool:
+    """True if `hashed_password` was not made with the scheme and cost of `policy`."""
+    policy = policy or POLICY
+    if not hashed_password:
+        return False
+    if policy.scheme == "argon2id":
+        if not hashed_password.startswith("$argon2id$"):
+            return True
+        return _argon2_hasher(policy).check_needs_rehash(hashed_password)
+    # bcrypt: $2b$<cost>$<salt+hash>
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or parts[1] not in ("2a", "2b", "2y"):
+        return True
+    return parts[2] != f"{policy.bcrypt_rounds:02d}"
+
+
+_dummy_hash = None
+
+
+def dummy_hash() -> str:
+    """A hash under the current policy, for verifying logins of unknown users."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = pool.hash(base64.b64encode(os.urandom(12)).decode("ascii"))
+    return _dummy_hash
+
+
+def _default_workers() -> int:
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+class HashingPool:
+    def __init__(self, kind: str = "process", workers: int | None = None, max_queue: int | None = None, timeout: float = 5.0):
+        self.kind = kind
+        self.workers = workers or _default_workers()
+        self.max_queue = self.workers * 8 if max_queue is None else max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    # spawn, not fork: the server process has threads running
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hashing")
+            return self._executor
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for the result.
+
+        Raises 503 when the pool is saturated or the result takes longer
+        than `timeout`. A slot is only freed when the work actually
+        finishes, so timed-out jobs still count against the limit.
+        """
+        # imported here so spawned workers, which import this module, do not load fastapi
+        from fastapi import HTTPException
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HTTPException(status_code=503, detail="Authentication is busy, retry shortly", headers={"Retry-After": "1"})
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise HTTPException(status_code=503, detail="Authentication timed out, retry shortly", headers={"Retry-After": "1"})
+
+    def hash(self, password: str) -> str:
+        # pass the policy explicitly: process workers do not share POLICY
+        return self.run(hash_password, password, POLICY)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        if not hashed_password:
+            return False
+        return self.run(check_password, password, hashed_password)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executor": self.kind,
+                "workers": self.workers,
+                "maxQueue": self.max_queue,
+                "timeoutSeconds": self.timeout,
+                "inFlight": self.in_flight,
+                "queueDepth": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+def _from_env() -> HashingPool:
+    workers = os.environ.get("PASSWORD_HASH_WORKERS")
+    max_queue = os.environ.get("PASSWORD_HASH_MAX_QUEUE")
+    return HashingPool(
+        kind=os.environ.get("PASSWORD_HASH_EXECUTOR", "process").lower(),
+        workers=int(workers) if workers else None,
+        max_queue=int(max_queue) if max_queue else None,
+        timeout=float(os.environ.get("PASSWORD_HASH_TIMEOUT", "5")),
+    )
+
+
+POLICY = policy_from_env()
+pool = _from_env()
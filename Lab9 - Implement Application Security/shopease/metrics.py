@@ -0,0 +1,207 @@
+"""Per-route HTTP and database metrics in Prometheus text format.
+
+`MetricsMiddleware` records, per method and route template (so
+/tickets/{ticket_id} is one series however many IDs are requested):
+
+    shopease_http_requests_total            counter, also labelled by status
+    shopease_http_request_duration_seconds  histogram
+    shopease_http_requests_in_flight        gauge, by method only (the route
+                                            is known once routing has run)
+    shopease_db_statements_total            counter of SQL statements
+    shopease_http_request_db_seconds        histogram of DB time per request
+
+SQL statements are attributed to the request that ran them through a
+context variable set by the middleware and engine events installed by
+`instrument_engine()`. Context variables are copied into the threadpool
+that runs sync handlers and are shared by async sessions, so both sync and
+async routes are counted. `render()` produces the scrape body for
+/adsweb/internal/metrics.
+"""
+import contextvars
+import threading
+import time
+
+from sqlalchemy import event
+
+# seconds; covers cached hits through slow exports
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the RequestStats of the request being handled, if any
+current_request = contextvars.ContextVar("shopease_current_request", default=None)
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "_started")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self._started = None
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}         # (method, route, status) -> count
+        self.durations = {}        # (method, route) -> Histogram
+        self.db_durations = {}     # (method, route) -> Histogram
+        self.statements = {}       # (method, route) -> count
+        self.in_flight = {}        # method -> gauge
+
+    def start(self, method: str):
+        with self._lock:
+            self.in_flight[method] = self.in_flight.get(method, 0) + 1
+
+    def finish(self, key, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            self.in_flight[key[0]] -= 1
+            rkey = key + (str(status),)
+            self.requests[rkey] = self.requests.get(rkey, 0) + 1
+            self.durations.setdefault(key, Histogram()).observe(seconds)
+            self.db_durations.setdefault(key, Histogram()).observe(stats.db_seconds)
+            self.statements[key] = self.statements.get(key, 0) + stats.statements
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.durations.clear()
+            self.db_durations.clear()
+            self.statements.clear()
+
+
+registry = Registry()
+
+
+def _route_template(scope) -> str:
+    # set by the router once a route matched
+    route = scope.get("route")
+    if route is None:
+        # unmatched paths share one series so scanners cannot blow up cardinality
+        return "unmatched"
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware; cheaper than BaseHTTPMiddleware and streams untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        registry.start(method)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            key = (method, _route_template(scope))
+            registry.finish(key, status, time.perf_counter() - start, stats)
+            current_request.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats._started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    if stats is not None and stats._started is not None:
+        stats.db_seconds += time.perf_counter() - stats._started
+        stats._started = None
+
+
+def instrument_engine(engine):
+    """Attribute statements run on `engine` (a sync Engine) to the current request."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _labels(method, route, status=None) -> str:
+    route = route.replace("\\", "\\\\").replace('"', '\\"')
+    labels = f'method="{method}",route="{route}"'
+    if status is not None:
+        labels += f',status="{status}"'
+    return labels
+
+
+def _render_histogram(lines, name, series):
+    for (method, route), hist in sorted(series.items()):
+        labels = _labels(method, route)
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.total}')
+        lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {hist.total}")
+
+
+def render() -> str:
+    """Prometheus text exposition (format 0.0.4) of everything recorded so far."""
+    with registry._lock:
+        lines = [
+            "# HELP shopease_http_requests_total HTTP requests by route and status.",
+            "# TYPE shopease_http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(registry.requests.items()):
+            lines.append(f"shopease_http_requests_total{{{_labels(method, route, status)}}} {count}")
+
+        lines += [
+            "# HELP shopease_http_request_duration_seconds Request latency.",
+            "# TYPE shopease_http_request_duration_seconds histogram",
+        ]
+        _render_histogram(lines, "shopease_http_request_duration_seconds", registry.durations)
+
+        lines += [
+            "# HELP shopease_http_requests_in_flight Requests currently being handled.",
+            "# TYPE shopease_http_requests_in_flight gauge",
+        ]
+        for method, value in sorted(registry.in_flight.items()):
+            lines.append(f'shopease_http_requests_in_flight{{method="{method}"}} {value}')
+
+        lines += [
+            "# HELP shopease_db_statements_total SQL statements executed while handling requests.",
+            "# TYPE shopease_db_statements_total counter",
+        ]
+        for (method, route), count in sorted(registry.statements.items()):
+            lines.append(f"shopease_db_statements_total{{{_labels(method, route)}}} {count}")
+
+        lines += [
+            "# HELP shopease_http_request_db_seconds Time spent in SQL statements per request.",
+            "# TYPE shopease_http_request_db_seconds histogram",
+        ]
+        _render_histogram(lines, "shopease_http_request_db_seconds", registry.db_durations)
+    return "\n".join(lines) + "\n"
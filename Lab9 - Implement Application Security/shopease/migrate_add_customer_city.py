@@ -0,0 +1,65 @@
+"""Migration: add and backfill the indexed customers.city column.
+
+Adds `city` if missing, fills it in batches from the freeform address with
+the same `extract_city_from_address` used on writes (one transaction per
+batch so the table is never locked for long), then builds the
+(coalesce(lower(city), ''), customerid) index (CONCURRENTLY on PostgreSQL)
+that replaces the earlier ix_customers_city_lower.
+
+Usage:
+    python -m shopease.migrate_add_customer_city [batch_size]
+"""
+from sqlalchemy import inspect, text
+from .db import init_engine
+from .models import extract_city_from_address
+import os
+import sys
+
+
+def run(database_url: str | None = None, batch_size: int = 5000):
+    engine = init_engine(database_url)
+
+    cols = {c['name'] for c in inspect(engine).get_columns('customers')}
+    if 'city' not in cols:
+        add_column_sql = "ALTER TABLE customers ADD COLUMN city VARCHAR(255);"
+        print('Running:', add_column_sql)
+        with engine.begin() as conn:
+            conn.execute(text(add_column_sql))
+
+    select_batch = text(
+        "SELECT customerid, address FROM customers "
+        "WHERE city IS NULL AND customerid > :after ORDER BY customerid LIMIT :batch"
+    )
+    update_city = text("UPDATE customers SET city = :city WHERE customerid = :cid")
+    after = 0
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select_batch, {"after": after, "batch": batch_size}).all()
+            if not rows:
+                break
+            conn.execute(update_city, [
+                {"cid": cid, "city": extract_city_from_address(address)} for cid, address in rows
+            ])
+        after = rows[-1][0]
+        total += len(rows)
+        print(f'Backfilled city for {total} customers')
+
+    concurrently = "CONCURRENTLY " if engine.dialect.name == "postgresql" else ""
+    # same expression as models.city_sort_key
+    index_statements = [
+        f"CREATE INDEX {concurrently}IF NOT EXISTS ix_customers_city_key ON customers (coalesce(lower(city), ''), customerid);",
+        f"DROP INDEX {concurrently}IF EXISTS ix_customers_city_lower;",
+    ]
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for sql in index_statements:
+            print('Running:', sql)
+            conn.execute(text(sql))
+
+    print('Migration complete: customers.city backfilled and indexed.')
+
+
+if __name__ == '__main__':
+    db_url = os.environ.get('DATABASE_URL')
+    run(db_url, int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,80 @@
+"""Migration: create the indexes behind index-backed customer search.
+
+PostgreSQL: enables pg_trgm and builds a GIN trigram index on each searched
+customers column for the ILIKE filter, plus a GiST trigram index on the
+combined search text for the nearest-first ordering (CREATE INDEX
+CONCURRENTLY, so writes are not blocked).
+
+SQLite: creates the customers_fts FTS5 shadow table (trigram tokenizer,
+external content = customers), the triggers that keep it in sync with
+customers, and populates it from the existing rows.
+
+Usage:
+    python -m shopease.migrate_add_customer_search_indexes
+"""
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from .db import init_engine
+from .search import SEARCH_COLUMNS, reset_search_mode, search_text
+import os
+
+
+def postgres_ddl() -> list[str]:
+    statements = ["CREATE EXTENSION IF NOT EXISTS pg_trgm;"]
+    for col in SEARCH_COLUMNS:
+        statements.append(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_customers_{col}_trgm "
+            f"ON customers USING gin ({col} gin_trgm_ops);"
+        )
+    # must match search.search_text() exactly for the planner to use it
+    expr = search_text().compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    statements.append(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_customers_search_text_trgm "
+        f"ON customers USING gist (({expr}) gist_trgm_ops);"
+    )
+    return statements
+
+
+def sqlite_ddl() -> list[str]:
+    cols = ", ".join(SEARCH_COLUMNS)
+    new_vals = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+    old_vals = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+    delete_old = (
+        f"INSERT INTO customers_fts(customers_fts, rowid, {cols}) "
+        f"VALUES ('delete', old.customerid, {old_vals});"
+    )
+    insert_new = f"INSERT INTO customers_fts(rowid, {cols}) VALUES (new.customerid, {new_vals});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5({cols}, "
+        "content='customers', content_rowid='customerid', tokenize='trigram');",
+        f"CREATE TRIGGER IF NOT EXISTS customers_fts_ai AFTER INSERT ON customers BEGIN {insert_new} END;",
+        f"CREATE TRIGGER IF NOT EXISTS customers_fts_ad AFTER DELETE ON customers BEGIN {delete_old} END;",
+        f"CREATE TRIGGER IF NOT EXISTS customers_fts_au AFTER UPDATE ON customers BEGIN {delete_old} {insert_new} END;",
+        "INSERT INTO customers_fts(customers_fts) VALUES ('rebuild');",
+    ]
+
+
+def run(database_url: str | None = None):
+    engine = init_engine(database_url)
+
+    if engine.dialect.name == "postgresql":
+        statements = postgres_ddl()
+    elif engine.dialect.name == "sqlite":
+        statements = sqlite_ddl()
+    else:
+        print(f'No search indexes defined for {engine.dialect.name}; nothing to do.')
+        return
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for sql in statements:
+            print('Running:', sql)
+            conn.execute(text(sql))
+
+    reset_search_mode()
+    print('Migration complete: customer search indexes ensured.')
+
+
+if __name__ == '__main__':
+    db_url = os.environ.get('DATABASE_URL')
+    run(db_url)
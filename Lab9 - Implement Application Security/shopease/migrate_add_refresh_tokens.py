@@ -0,0 +1,22 @@
+"""Migration: create the refresh_tokens table used by /token/refresh.
+
+Usage:
+    python -m shopease.migrate_add_refresh_tokens
+"""
+from .db import init_engine
+from .models import RefreshToken
+import os
+
+
+def run(database_url: str | None = None):
+    engine = init_engine(database_url)
+
+    print('Running: CREATE TABLE IF NOT EXISTS refresh_tokens')
+    RefreshToken.__table__.create(bind=engine, checkfirst=True)
+
+    print('Migration complete: refresh_tokens ensured.')
+
+
+if __name__ == '__main__':
+    db_url = os.environ.get('DATABASE_URL')
+    run(db_url)
@@ -0,0 +1,33 @@
+"""Migration: create the revoked_tokens table used by revocation.py.
+
+Also deletes rows for tokens that have already expired, so it can be
+re-run periodically to keep the table small.
+
+Usage:
+    python -m shopease.migrate_add_revoked_tokens
+"""
+from sqlalchemy import delete
+from .db import init_engine
+from .models import RevokedToken
+import datetime
+import os
+
+
+def run(database_url: str | None = None):
+    engine = init_engine(database_url)
+
+    print('Running: CREATE TABLE IF NOT EXISTS revoked_tokens')
+    RevokedToken.__table__.create(bind=engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        pruned = conn.execute(
+            delete(RevokedToken).where(RevokedToken.expiresAt <= datetime.datetime.utcnow())
+        ).rowcount
+    print(f'Pruned {pruned} expired revocations')
+
+    print('Migration complete: revoked_tokens ensured.')
+
+
+if __name__ == '__main__':
+    db_url = os.environ.get('DATABASE_URL')
+    run(db_url)
@@ -0,0 +1,25 @@
+"""Migration: create the table_versions table used for ticket ETags.
+
+Creating the table also inserts the 'supporttickets' row (see the
+after_create hook on `models.TableVersion`).
+
+Usage:
+    python -m shopease.migrate_add_table_versions
+"""
+from .db import init_engine
+from .models import TableVersion
+import os
+
+
+def run(database_url: str | None = None):
+    engine = init_engine(database_url)
+
+    print('Running: CREATE TABLE IF NOT EXISTS table_versions')
+    TableVersion.__table__.create(bind=engine, checkfirst=True)
+
+    print('Migration complete: table_versions ensured.')
+
+
+if __name__ == '__main__':
+    db_url = os.environ.get('DATABASE_URL')
+    run(db_url)
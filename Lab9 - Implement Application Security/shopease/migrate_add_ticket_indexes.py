@@ -0,0 +1,48 @@
+"""Migration: build the supporttickets indexes declared in models.py.
+
+New databases get these from `create_schema()`. For existing deployments
+this builds them without blocking writes: on PostgreSQL each index is built
+with CREATE INDEX CONCURRENTLY (outside a transaction, one at a time); other
+databases use a plain CREATE INDEX IF NOT EXISTS.
+
+If a concurrent build is interrupted PostgreSQL leaves an INVALID index
+behind; drop it and run this again.
+
+Usage:
+    python -m shopease.migrate_add_ticket_indexes
+"""
+from sqlalchemy import text
+from .db import init_engine
+from .models import SupportTicket
+import os
+
+
+def index_ddl(dialect_name: str) -> list[str]:
+    concurrently = "CONCURRENTLY " if dialect_name == "postgresql" else ""
+    statements = []
+    for index in sorted(SupportTicket.__table__.indexes, key=lambda i: i.name):
+        cols = ", ".join(c.name for c in index.columns)
+        statements.append(
+            f"CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {SupportTicket.__tablename__} ({cols});"
+        )
+    return statements
+
+
+def run(database_url: str | None = None):
+    engine = init_engine(database_url)
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for sql in index_ddl(engine.dialect.name):
+            print('Running:', sql)
+            conn.execute(text(sql))
+        analyze_sql = f"ANALYZE {SupportTicket.__tablename__};"
+        print('Running:', analyze_sql)
+        conn.execute(text(analyze_sql))
+
+    print('Migration complete: supporttickets indexes ensured.')
+
+
+if __name__ == '__main__':
+    db_url = os.environ.get('DATABASE_URL')
+    run(db_url)
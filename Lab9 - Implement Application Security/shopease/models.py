@@ -7,6 +7,11 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     Enum,
+    Index,
+    DDL,
+    event,
+    func,
+    literal_column,
 )
 from sqlalchemy.orm import relationship, declarative_base
 import enum
@@ -32,6 +37,15 @@ class AttachmentType(enum.Enum):
     other = "other"
 
 
+def city_sort_key(city):
+    """lower(city) with NULL as '', the /customer/addresses sort key.
+
+    The query, its keyset cursor and ix_customers_city_key must all use this
+    same expression; the '' is inlined so SQLite matches it to the index.
+    """
+    return func.coalesce(func.lower(city), literal_column("''"))
+
+
 class Customer(Base):
     __tablename__ = "customers"
     customerID = Column("customerid", Integer, primary_key=True)
@@ -44,11 +58,42 @@ class Customer(Base):
     password = Column("password", String(255))
     # role: either 'customer', 'agent', or 'manager'
     role = Column("role", String(50), default="customer")
+    # derived from address on every write (see _set_customer_city); backs
+    # the /customer/addresses ordering and the per-city counts
+    city = Column("city", String(255))
+
+    __table_args__ = (
+        Index("ix_customers_city_key", city_sort_key(city), customerID),
+    )
 
     tickets = relationship("SupportTicket", back_populates="customer")
     notifications = relationship("Notification", back_populates="customer")
 
 
+def extract_city_from_address(address: str) -> str:
+    """Try to extract a city substring from a freeform address.
+
+    Strategy (best-effort):
+    - If address contains commas, take the second segment (after first comma) and strip it.
+    - Otherwise return empty string.
+
+    This is a heuristic because the data model stores address as a single string.
+    """
+    if not address:
+        return ""
+    # split on comma and return second piece if available
+    parts = [p.strip() for p in address.split(",") if p.strip()]
+    if len(parts) >= 2:
+        return parts[1]
+    return ""
+
+
+@event.listens_for(Customer, "before_insert")
+@event.listens_for(Customer, "before_update")
+def _set_customer_city(mapper, connection, target):
+    target.city = extract_city_from_address(target.address)
+
+
 class SupportAgent(Base):
     __tablename__ = "supportagents"
     agentID = Column("agentid", Integer, primary_key=True)
@@ -77,6 +122,18 @@ class SupportTicket(Base):
     createdAt = Column("createdat", DateTime, default=datetime.datetime.utcnow)
     status = Column("status", Enum(TicketStatus), default=TicketStatus.open)
 
+    # Every ticket listing orders by (createdat, ticketid) and may filter on
+    # one of status/customer/agent first, so each index leads with the
+    # equality column and ends with the sort key. Postgres scans them
+    # backwards for the DESC ordering. Existing databases get these from
+    # migrate_add_ticket_indexes.
+    __table_args__ = (
+        Index("ix_supporttickets_createdat_ticketid", "createdat", "ticketid"),
+        Index("ix_supporttickets_status_createdat", "status", "createdat", "ticketid"),
+        Index("ix_supporttickets_customerid_createdat", "customerid", "createdat", "ticketid"),
+        Index("ix_supporttickets_supportagentid_createdat", "supportagentid", "createdat", "ticketid"),
+    )
+
     customer = relationship("Customer", back_populates="tickets")
     supportAgent = relationship("SupportAgent", back_populates="tickets")
     attachments = relationship("Attachment", back_populates="ticket")
@@ -114,3 +171,52 @@ class Notification(Base):
     sentAt = Column("sentat", DateTime, default=datetime.datetime.utcnow)
 
     customer = relationship("Customer", back_populates="notifications")
+
+
+class TableVersion(Base):
+    """Change counter per logical table, bumped in the writing transaction.
+
+    Backs the ETag/Last-Modified headers on the ticket endpoints (see
+    versioning.py) so a conditional GET costs one primary-key lookup.
+    """
+    __tablename__ = "table_versions"
+    name = Column("name", String(64), primary_key=True)
+    version = Column("version", Integer, nullable=False, default=0)
+    updatedAt = Column("updatedat", DateTime, default=datetime.datetime.utcnow)
+
+
+event.listen(
+    TableVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO table_versions (name, version, updatedat) VALUES ('supporttickets', 0, CURRENT_TIMESTAMP)"),
+)
+
+
+class RefreshToken(Base):
+    """One issued refresh token, looked up by its JWT ID on /token/refresh.
+
+    Tokens rotate: each refresh marks the presented token used and issues a
+    new one in the same `familyID`. Presenting a used token again revokes
+    the whole family.
+    """
+    __tablename__ = "refresh_tokens"
+    tokenID = Column("tokenid", String(64), primary_key=True)
+    familyID = Column("familyid", String(64), nullable=False, index=True)
+    customerID = Column("customerid", Integer, ForeignKey("customers.customerid", ondelete="CASCADE"), nullable=False)
+    issuedAt = Column("issuedat", DateTime, default=datetime.datetime.utcnow)
+    expiresAt = Column("expiresat", DateTime, nullable=False)
+    usedAt = Column("usedat", DateTime, nullable=True)
+    revokedAt = Column("revokedat", DateTime, nullable=True)
+
+
+class RevokedToken(Base):
+    """A JWT (by its jti) revoked before its expiry.
+
+    Processes pull the revocations they have not seen yet by `revocationID`
+    and `revokedAt` (see revocation.py; IDs may commit out of order).
+    """
+    __tablename__ = "revoked_tokens"
+    revocationID = Column("revocationid", Integer, primary_key=True, autoincrement=True)
+    tokenID = Column("tokenid", String(64), nullable=False, unique=True)
+    revokedAt = Column("revokedat", DateTime, default=datetime.datetime.utcnow)
+    expiresAt = Column("expiresat", DateTime, nullable=False, index=True)
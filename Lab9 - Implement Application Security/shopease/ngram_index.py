@@ -0,0 +1,323 @@
+"""In-process trigram inverted index over customer search fields.
+
+For deployments where the database has no trigram support, set
+CUSTOMER_SEARCH_MODE=memory. The app then builds a `CustomerNgramIndex` at
+startup, and /customer/search answers from it. The index returns candidate
+IDs by intersecting posting lists, confirms them against the stored field
+text, and hydrates only the final IDs from the database.
+
+Posting lists are sorted `array('I')` of customer IDs (4 bytes per entry).
+Customer rows inserted, updated or deleted through the ORM in this process
+are applied by Session events when their transaction commits. Writes made
+by other worker processes (and bulk Core inserts, which bypass the ORM) are
+picked up in two ways:
+
+    CUSTOMER_INDEX_REFRESH_SECONDS  at most this often, one search per process
+                                    adds customers with an ID above the
+                                    highest one loaded (default 30); see
+                                    `maybe_refresh()`
+    CUSTOMER_INDEX_REBUILD_SECONDS  this often a background thread rebuilds
+                                    the index from the table, which also
+                                    applies other workers' updates and
+                                    deletes (default 600; 0 disables it)
+
+The rebuild reads the table into a fresh index off the request path and
+swaps it in under the lock, so searches keep using the old one meanwhile.
+Writes applied to the old index while the rebuild ran are replayed on the
+new one after the swap.
+
+So with several workers a new customer is searchable everywhere within the
+refresh interval, and a changed one within the rebuild interval. Deleted
+customers never show up in results in the meantime: matched IDs are
+hydrated from the database.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .models import Customer
+
+logger = logging.getLogger(__name__)
+
+N = 3
+FIELDS = ("firstName", "lastName", "email", "phone", "address")
+
+REFRESH_SECONDS = float(os.environ.get("CUSTOMER_INDEX_REFRESH_SECONDS", "30"))
+REBUILD_SECONDS = float(os.environ.get("CUSTOMER_INDEX_REBUILD_SECONDS", "600"))
+
+# the process-wide index, set by enable()
+index = None
+_next_refresh = 0.0
+_refresh_lock = threading.Lock()
+# background rebuild thread and its stop signal, set by enable()
+_rebuilder = None
+_stop_rebuilding = None
+
+
+def ngrams(text: str) -> set[str]:
+    return {text[i:i + N] for i in range(len(text) - N + 1)}
+
+
+def _contains(postings: array, value: int) -> bool:
+    i = bisect_left(postings, value)
+    return i < len(postings) and postings[i] == value
+
+
+class CustomerNgramIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings: dict[str, array] = {}
+        # customerID -> lowercased field values, used to confirm candidates
+        self._docs: dict[int, tuple[str, ...]] = {}
+        # highest customerID read from the table; not advanced by Session
+        # events, so other workers' lower IDs are still pulled by refresh()
+        self._last_id = 0
+        # (customerID, values or None) applied while build() reads the table
+        self._journal = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, customer_id: int, values):
+        texts = tuple((v or "").lower() for v in values)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((customer_id, values))
+            if customer_id in self._docs:
+                self._remove_locked(customer_id)
+            self._docs[customer_id] = texts
+            grams = set()
+            for text in texts:
+                grams |= ngrams(text)
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if postings is None:
+                    self._postings[gram] = array("I", [customer_id])
+                elif not postings or postings[-1] < customer_id:
+                    # IDs usually arrive in ascending order
+                    postings.append(customer_id)
+                else:
+                    postings.insert(bisect_left(postings, customer_id), customer_id)
+
+    def remove(self, customer_id: int):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((customer_id, None))
+            self._remove_locked(customer_id)
+
+    def _remove_locked(self, customer_id: int):
+        texts = self._docs.pop(customer_id, None)
+        if texts is None:
+            return
+        grams = set()
+        for text in texts:
+            grams |= ngrams(text)
+        for gram in grams:
+            postings = self._postings[gram]
+            i = bisect_left(postings, customer_id)
+            if i < len(postings) and postings[i] == customer_id:
+                postings.pop(i)
+            if not postings:
+                del self._postings[gram]
+
+    def search(self, term: str, limit: int):
+        """Return up to `limit` matching customer IDs, or None if `term` is too short to index.
+
+        Matches are the same as a case-insensitive substring match on any
+        one field. Customers with a field starting with the term rank first,
+        then by customerID.
+        """
+        term = term.lower()
+        if len(term) < N:
+            return None
+        with self._lock:
+            lists = []
+            for gram in ngrams(term):
+                postings = self._postings.get(gram)
+                if postings is None:
+                    return []
+                lists.append(postings)
+            lists.sort(key=len)
+            candidates = lists[0]
+            for postings in lists[1:]:
+                candidates = [cid for cid in candidates if _contains(postings, cid)]
+                if not candidates:
+                    return []
+            prefix, other = [], []
+            for cid in candidates:
+                texts = self._docs[cid]
+                if any(text.startswith(term) for text in texts):
+                    prefix.append(cid)
+                elif any(term in text for text in texts):
+                    other.append(cid)
+                if len(prefix) >= limit:
+                    break
+        return (prefix + other)[:limit]
+
+    def memory_usage(self) -> dict:
+        with self._lock:
+            postings_bytes = sum(sys.getsizeof(p) for p in self._postings.values())
+            keys_bytes = sum(sys.getsizeof(k) for k in self._postings)
+            docs_bytes = sum(
+                sys.getsizeof(t) + sum(sys.getsizeof(s) for s in t) for t in self._docs.values()
+            )
+            dict_bytes = sys.getsizeof(self._postings) + sys.getsizeof(self._docs)
+            return {
+                "customers": len(self._docs),
+                "ngrams": len(self._postings),
+                "postings": sum(len(p) for p in self._postings.values()),
+                "postingsBytes": postings_bytes,
+                "totalBytes": postings_bytes + keys_bytes + docs_bytes + dict_bytes,
+            }
+
+    def build(self, session, batch_size: int = 5000):
+        """Reload the index from the table; searches use the old contents until the swap."""
+        cols = [getattr(Customer, f) for f in FIELDS]
+        stmt = select(Customer.customerID, *cols).order_by(Customer.customerID)
+        with self._lock:
+            self._journal = journal = []
+        fresh = CustomerNgramIndex()
+        last_id = 0
+        try:
+            for row in session.execute(stmt.execution_options(yield_per=batch_size)):
+                fresh.add(row[0], row[1:])
+                last_id = row[0]
+        except BaseException:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            # the read may predate these writes; adding twice is harmless
+            for customer_id, values in journal:
+                if values is None:
+                    fresh.remove(customer_id)
+                else:
+                    fresh.add(customer_id, values)
+            self._postings, self._docs = fresh._postings, fresh._docs
+            self._last_id = max(self._last_id, last_id)
+            self._journal = None
+
+    def refresh(self, session) -> int:
+        """Add customers with an ID above the highest one read so far; returns the count."""
+        cols = [getattr(Customer, f) for f in FIELDS]
+        stmt = select(Customer.customerID, *cols).where(Customer.customerID > self._last_id).order_by(Customer.customerID)
+        rows = session.execute(stmt).all()
+        for row in rows:
+            self.add(row[0], row[1:])
+        if rows:
+            with self._lock:
+                self._last_id = max(self._last_id, rows[-1][0])
+        return len(rows)
+
+
+def _fields(customer: Customer):
+    return tuple(getattr(customer, f) for f in FIELDS)
+
+
+def _after_flush(session, flush_context):
+    pending = session.info.setdefault("ngram_index_changes", [])
+    for obj in session.new:
+        if isinstance(obj, Customer):
+            pending.append((obj.customerID, _fields(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Customer) and session.is_modified(obj):
+            pending.append((obj.customerID, _fields(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Customer):
+            pending.append((obj.customerID, None))
+
+
+def _after_commit(session):
+    changes = session.info.pop("ngram_index_changes", None)
+    if not changes or index is None:
+        return
+    for customer_id, values in changes:
+        if values is None:
+            index.remove(customer_id)
+        else:
+            index.add(customer_id, values)
+
+
+def _after_rollback(session):
+    session.info.pop("ngram_index_changes", None)
+
+
+def enable(session_factory):
+    """Build the process-wide index, start tracking Customer writes and start the rebuild thread."""
+    global index, _next_refresh, _rebuilder, _stop_rebuilding
+    disable()
+    new_index = CustomerNgramIndex()
+    session = session_factory()
+    try:
+        new_index.build(session)
+    finally:
+        session.close()
+    index = new_index
+    _next_refresh = time.monotonic() + REFRESH_SECONDS
+    if not event.contains(Session, "after_flush", _after_flush):
+        event.listen(Session, "after_flush", _after_flush)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
+    if REBUILD_SECONDS > 0:
+        _stop_rebuilding = threading.Event()
+        _rebuilder = threading.Thread(
+            target=_rebuild_loop, args=(session_factory, _stop_rebuilding),
+            name="customer-ngram-rebuild", daemon=True,
+        )
+        _rebuilder.start()
+    return index
+
+
+def disable():
+    """Stop the rebuild thread, e.g. on shutdown; the index itself stays usable."""
+    global _rebuilder, _stop_rebuilding
+    if _rebuilder is None:
+        return
+    _stop_rebuilding.set()
+    _rebuilder.join()
+    _rebuilder = _stop_rebuilding = None
+
+
+def rebuild(session_factory):
+    session = session_factory()
+    try:
+        index.build(session)
+    finally:
+        session.close()
+
+
+def _rebuild_loop(session_factory, stop: threading.Event):
+    while not stop.wait(REBUILD_SECONDS):
+        try:
+            rebuild(session_factory)
+        except Exception:
+            # keep serving the current index; the next interval tries again
+            logger.exception("Customer search index rebuild failed")
+
+
+def maybe_refresh(session):
+    """Pull customers added by other workers into the index when the interval is due.
+
+    Called with the search's (sync) Session. Only the cheap incremental
+    refresh runs here; full rebuilds happen on the background thread. Only
+    one caller per process does the work; concurrent searches go ahead
+    with the current index.
+    """
+    global _next_refresh
+    now = time.monotonic()
+    if index is None or now < _next_refresh or not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        if now < _next_refresh:
+            return
+        _next_refresh = now + REFRESH_SECONDS
+        index.refresh(session)
+    finally:
+        _refresh_lock.release()
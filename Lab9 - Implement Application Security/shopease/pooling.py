@@ -0,0 +1,147 @@
+"""Connection pool configuration and telemetry for `db.init_engine` and
+`db.init_async_engine`.
+
+Pool settings come from the environment (all optional, SQLAlchemy defaults
+otherwise):
+
+    DB_POOL_SIZE        connections kept open in the pool
+    DB_MAX_OVERFLOW     extra connections allowed above DB_POOL_SIZE
+    DB_POOL_TIMEOUT     seconds to wait for a connection before failing
+    DB_POOL_RECYCLE     seconds after which a connection is replaced
+    DB_POOL_PRE_PING    1/true to test connections on checkout
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+_INT_OPTIONS = {
+    "DB_POOL_SIZE": "pool_size",
+    "DB_MAX_OVERFLOW": "max_overflow",
+    "DB_POOL_RECYCLE": "pool_recycle",
+}
+
+
+def pool_options_from_env(url, is_async: bool = False) -> dict:
+    """Return create_engine() / create_async_engine() pool keyword arguments for `url`.
+
+    In-memory SQLite databases are left alone: each pooled connection would
+    otherwise see its own empty database.
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+
+    options = {"poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool}
+    for env_name, option in _INT_OPTIONS.items():
+        value = os.environ.get(env_name)
+        if value:
+            options[option] = int(value)
+    timeout = os.environ.get("DB_POOL_TIMEOUT")
+    if timeout:
+        options["pool_timeout"] = float(timeout)
+    pre_ping = os.environ.get("DB_POOL_PRE_PING")
+    if pre_ping:
+        options["pool_pre_ping"] = pre_ping.lower() in ("1", "true", "yes")
+    return options
+
+
+class PoolStats:
+    """Thread-safe counters describing how connections are handed out."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def record_checkout(self, waited: bool, elapsed: float, overflowed: bool):
+        with self._lock:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait_time = max(self.max_wait_time, elapsed)
+            if overflowed:
+                self.overflow_events += 1
+
+    def record_timeout(self, elapsed: float):
+        with self._lock:
+            self.timeouts += 1
+            self.waits += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "waitTimeSeconds": round(self.wait_time, 6),
+                "maxWaitTimeSeconds": round(self.max_wait_time, 6),
+                "overflowEvents": self.overflow_events,
+                "timeouts": self.timeouts,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkouts, waits and overflow in `self.stats`.
+
+    A checkout counts as a wait when no idle connection was available and
+    the overflow limit had already been reached, i.e. the caller had to
+    block until another request returned its connection.
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        overflow_before = self.overflow()
+        at_limit = self._max_overflow > -1 and overflow_before >= self._max_overflow
+        waited = self.checkedin() == 0 and at_limit
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_timeout(time.perf_counter() - start)
+            raise
+        self.stats.record_checkout(
+            waited, time.perf_counter() - start, self.overflow() > max(overflow_before, 0)
+        )
+        return conn
+
+    def recreate(self):
+        # keep counting across engine.dispose()
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """InstrumentedQueuePool with the asyncio-compatible queue async engines need."""
+
+
+def pool_status(engine) -> dict:
+    """Current gauges plus cumulative counters for `engine`'s pool."""
+    pool = engine.pool
+    status = {"poolClass": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "poolSize": pool.size(),
+            "checkedOut": pool.checkedout(),
+            "checkedIn": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "maxOverflow": pool._max_overflow,
+            "timeoutSeconds": pool.timeout(),
+        })
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update(stats.snapshot())
+    return status
@@ -0,0 +1,222 @@
+"""On-demand profiling of single requests.
+
+A request is profiled when it carries `X-Profile: 1` together with a valid
+`X-Internal-Token` (so INTERNAL_API_TOKEN must be set for this to work at
+all), or when it is picked by random sampling. Settings (environment):
+
+    PROFILE_SAMPLE_RATE   fraction of requests to profile (default 0)
+    PROFILE_MODE          sample (default) or cprofile
+    PROFILE_INTERVAL_MS   stack sampling interval (default 5)
+    PROFILE_DIR           where profiles are written (default: <tmp>/shopease-profiles)
+    PROFILE_MAX_FILES     newest profiles kept (default 100)
+
+"sample" snapshots thread stacks every interval and keeps those running the
+matched route's endpoint or dependencies, including sync handlers on the
+threadpool. It writes collapsed stacks (`<name>.collapsed`) that
+flamegraph.pl, speedscope and inferno read directly. Concurrent requests to
+the same route land in the same profile, which is usually what you want.
+
+"cprofile" runs cProfile on the event loop thread and writes pstats
+(`<name>.prof`, for snakeviz or flameprof). It only sees async code, so
+use it with USE_ASYNC_DB=1; sync handlers run on other threads.
+
+One request is profiled at a time; requests that would be profiled while
+another one is running are served normally. The profile's file name is
+returned in the `X-Profile-Id` header, and profiles can be listed and
+downloaded from /adsweb/internal/profiles. With no token and a zero sample
+rate the middleware passes requests straight through.
+"""
+import cProfile
+import hmac
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from .auth import INTERNAL_API_TOKEN
+
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+MODE = os.environ.get("PROFILE_MODE", "sample").lower()
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "shopease-profiles")
+MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "100"))
+PROFILE_SUFFIXES = (".collapsed", ".prof")
+
+_profile_lock = threading.Lock()
+
+
+def _header(scope, name: bytes) -> bytes | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+
+def wants_profile(scope) -> bool:
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return True
+    if not INTERNAL_API_TOKEN or _header(scope, b"x-profile") != b"1":
+        return False
+    token = _header(scope, b"x-internal-token") or b""
+    # constant time, as in auth.require_internal_token
+    return hmac.compare_digest(token, INTERNAL_API_TOKEN.encode())
+
+
+def _route_codes(route) -> set:
+    """Code objects of the route's endpoint and all of its dependencies."""
+    codes = set()
+    pending = [getattr(route, "dependant", None)]
+    while pending:
+        dependant = pending.pop()
+        if dependant is None:
+            continue
+        call = dependant.call
+        # functions, or callable instances such as OAuth2PasswordBearer
+        code = getattr(call, "__code__", None) or getattr(getattr(type(call), "__call__", None), "__code__", None)
+        if code is not None:
+            codes.add(code)
+        pending.extend(dependant.dependencies)
+    return codes
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the stacks of threads running a given route until stopped."""
+
+    def __init__(self, scope, interval: float = INTERVAL):
+        self.scope = scope
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        codes = None
+        while not self._stop.wait(self.interval):
+            if codes is None:
+                # the router sets scope["route"] once the request matched
+                route = self.scope.get("route")
+                if route is None:
+                    continue
+                codes = _route_codes(route)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                relevant = False
+                while frame is not None:
+                    relevant = relevant or frame.f_code in codes
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if relevant:
+                    self.stacks[";".join(_frame_label(c) for c in reversed(stack))] += 1
+                    self.samples += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _profile_name(scope, elapsed_ms: float) -> str:
+    route = getattr(scope.get("route"), "path", None) or "unmatched"
+    slug = "".join(c if c.isalnum() else "_" for c in route.strip("/"))[-60:]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return f"{stamp}-{scope['method']}-{slug}-{elapsed_ms:.0f}ms"
+
+
+def _prune(directory: str, keep: int):
+    names = sorted(n for n in os.listdir(directory) if n.endswith(PROFILE_SUFFIXES))
+    for name in names[:-keep] if keep > 0 else names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles() -> list[dict]:
+    """Saved profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith(PROFILE_SUFFIXES):
+            profiles.append({"name": name, "bytes": os.path.getsize(os.path.join(PROFILE_DIR, name))})
+    return profiles
+
+
+def profile_path(name: str) -> str | None:
+    """Path of a saved profile, or None if `name` is not one (no path traversal)."""
+    if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIXES):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware; with no token and no sampling it only forwards the call."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (SAMPLE_RATE or INTERNAL_API_TOKEN) or not wants_profile(scope):
+            return await self.app(scope, receive, send)
+        if not _profile_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if MODE == "cprofile":
+                profiler, suffix = cProfile.Profile(), ".prof"
+            else:
+                profiler, suffix = StackSampler(scope), ".collapsed"
+
+            name = None
+
+            async def send_wrapper(message):
+                nonlocal name
+                if message["type"] == "http.response.start":
+                    # named when the response starts so the client learns the id
+                    name = _profile_name(scope, (time.perf_counter() - start) * 1000) + suffix
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", name.encode())]
+                await send(message)
+
+            start = time.perf_counter()
+            if MODE == "cprofile":
+                profiler.enable()
+            else:
+                profiler.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if MODE == "cprofile":
+                    profiler.disable()
+                else:
+                    profiler.stop()
+                if name is None:
+                    name = _profile_name(scope, (time.perf_counter() - start) * 1000) + suffix
+                path = os.path.join(PROFILE_DIR, name)
+                if MODE == "cprofile":
+                    profiler.dump_stats(path)
+                else:
+                    profiler.write(path)
+                _prune(PROFILE_DIR, MAX_FILES)
+        finally:
+            _profile_lock.release()
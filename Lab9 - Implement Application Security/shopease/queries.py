@@ -0,0 +1,291 @@
+"""Statement builders and row serializers shared by the sync and async routes.
+
+Everything here is plain SQLAlchemy `select()` construction or pure Python,
+so the same statement can be run with `session.execute(...)` on the sync
+engine or `await session.execute(...)` on the async one.
+"""
+import base64
+import datetime
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import func, literal_column, select, tuple_
+
+from .models import SupportTicket, TicketStatus, Customer, SupportAgent, city_sort_key
+
+DEFAULT_TICKET_PAGE_SIZE = 100
+MAX_TICKET_PAGE_SIZE = 1000
+
+
+def ticket_list_select():
+    """Column-only select for ticket listings.
+
+    Customer and agent columns are pulled in through outer joins so a list
+    is fetched in a single round trip instead of two lazy loads per ticket.
+    """
+    return (
+        select(
+            SupportTicket.ticketID,
+            SupportTicket.issueDescription,
+            SupportTicket.createdAt,
+            SupportTicket.status,
+            Customer.customerID,
+            Customer.firstName.label("customerFirstName"),
+            Customer.lastName.label("customerLastName"),
+            Customer.email.label("customerEmail"),
+            SupportAgent.agentID,
+            SupportAgent.firstName.label("agentFirstName"),
+            SupportAgent.lastName.label("agentLastName"),
+            SupportAgent.email.label("agentEmail"),
+        )
+        .select_from(SupportTicket)
+        .outerjoin(Customer, SupportTicket.customerID == Customer.customerID)
+        .outerjoin(SupportAgent, SupportTicket.supportAgentID == SupportAgent.agentID)
+    )
+
+
+def ticket_detail_select(ticket_id: int):
+    return ticket_list_select().where(SupportTicket.ticketID == ticket_id)
+
+
+def ticket_rows_to_dicts(rows) -> list[dict]:
+    """Ticket dicts, as served by the ticket endpoints, from `ticket_list_select` rows.
+
+    Rows are unpacked positionally, in `ticket_list_select` column order;
+    that is several times faster than Row attribute access on large pages.
+    """
+    tickets = []
+    for (ticket_id, description, created_at, status,
+         customer_id, customer_first, customer_last, customer_email,
+         agent_id, agent_first, agent_last, agent_email) in rows:
+        tickets.append({
+            "ticketID": ticket_id,
+            "issueDescription": description,
+            "createdAt": created_at,
+            "status": status.name if status is not None else None,
+            "customer": None if customer_id is None else {
+                "customerID": customer_id,
+                "firstName": customer_first,
+                "lastName": customer_last,
+                "email": customer_email,
+            },
+            "supportAgent": None if agent_id is None else {
+                "agentID": agent_id,
+                "firstName": agent_first,
+                "lastName": agent_last,
+                "email": agent_email,
+            },
+        })
+    return tickets
+
+
+def ticket_row_to_dict(row) -> dict:
+    """One ticket dict, as served by GET /tickets/{id}, from a `ticket_list_select` row."""
+    return ticket_rows_to_dicts((row,))[0]
+
+
+def parse_ticket_status(value: str) -> TicketStatus:
+    try:
+        return TicketStatus(value)
+    except ValueError:
+        valid = ", ".join([e.value for e in TicketStatus])
+        raise HTTPException(status_code=400, detail=f"Invalid status. Valid values: {valid}")
+
+
+def _encode_cursor(data: dict) -> str:
+    raw = json.dumps(data).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return data
+
+
+def encode_ticket_cursor(created_at: datetime.datetime, ticket_id: int) -> str:
+    """Opaque cursor pointing just past (created_at, ticket_id) in list order."""
+    return _encode_cursor({"c": created_at.isoformat(), "id": ticket_id})
+
+
+def decode_ticket_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    data = _decode_cursor(cursor)
+    try:
+        return datetime.datetime.fromisoformat(data["c"]), int(data["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def ticket_filters(
+    status: str | None = None,
+    customer_id: int | None = None,
+    agent_id: int | None = None,
+    created_from: datetime.datetime | None = None,
+    created_to: datetime.datetime | None = None,
+) -> list:
+    """WHERE clauses for the ticket list filters; shared by listing and bulk updates."""
+    filters = []
+    if status is not None:
+        filters.append(SupportTicket.status == parse_ticket_status(status))
+    if customer_id is not None:
+        filters.append(SupportTicket.customerID == customer_id)
+    if agent_id is not None:
+        filters.append(SupportTicket.supportAgentID == agent_id)
+    if created_from is not None:
+        filters.append(SupportTicket.createdAt >= created_from)
+    if created_to is not None:
+        filters.append(SupportTicket.createdAt < created_to)
+    return filters
+
+
+def ticket_page_size(limit: int | None, cursor: str | None) -> int | None:
+    """Validated page size for GET /tickets; None means the whole list.
+
+    Clients that send neither `limit` nor `cursor` predate paging and still
+    get every ticket in one response. Paging starts with the first `limit`
+    (or `cursor`, which implies DEFAULT_TICKET_PAGE_SIZE).
+    """
+    if limit is None:
+        return DEFAULT_TICKET_PAGE_SIZE if cursor is not None else None
+    if limit <= 0 or limit > MAX_TICKET_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_TICKET_PAGE_SIZE}")
+    return limit
+
+
+def ticket_page_select(
+    limit: int | None = DEFAULT_TICKET_PAGE_SIZE,
+    cursor: str | None = None,
+    status: str | None = None,
+    customer_id: int | None = None,
+    agent_id: int | None = None,
+    created_from: datetime.datetime | None = None,
+    created_to: datetime.datetime | None = None,
+):
+    """Select one page of tickets, newest first.
+
+    Pages are keyed on (createdAt, ticketID) rather than OFFSET, so every
+    page is a range scan on the (createdat, ticketid) ordering no matter how
+    deep the client pages. One extra row is selected so `split_ticket_page`
+    can tell whether another page exists. `limit=None` selects every ticket.
+    """
+    if limit is not None and limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    filters = ticket_filters(status, customer_id, agent_id, created_from, created_to)
+    if cursor is not None:
+        cursor_created, cursor_id = decode_ticket_cursor(cursor)
+        filters.append(tuple_(SupportTicket.createdAt, SupportTicket.ticketID) < (cursor_created, cursor_id))
+
+    stmt = (
+        ticket_list_select()
+        .where(*filters)
+        .order_by(SupportTicket.createdAt.desc(), SupportTicket.ticketID.desc())
+    )
+    return stmt if limit is None else stmt.limit(limit + 1)
+
+
+def split_ticket_page(rows, limit: int | None):
+    """Turn `ticket_page_select` rows into (ticket dicts, next cursor or None)."""
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_ticket_cursor(last.createdAt, last.ticketID)
+    return ticket_rows_to_dicts(rows), next_cursor
+
+
+def customer_to_dict(cust: Customer) -> dict:
+    if cust is None:
+        return None
+    return {
+        "customerID": cust.customerID,
+        "firstName": cust.firstName,
+        "lastName": cust.lastName,
+        "email": cust.email,
+        "phone": cust.phone,
+        "address": cust.address,
+    }
+
+
+def customer_search_select(search_string: str):
+    # Use ilike for case-insensitive partial matching (works for sqlite/postgres)
+    pattern = f"%{search_string}%"
+    return select(Customer).where(
+        (Customer.firstName.ilike(pattern))
+        | (Customer.lastName.ilike(pattern))
+        | (Customer.email.ilike(pattern))
+        | (Customer.phone.ilike(pattern))
+        | (Customer.address.ilike(pattern))
+    )
+
+
+DEFAULT_ADDRESS_PAGE_SIZE = 100
+MAX_ADDRESS_PAGE_SIZE = 1000
+
+
+def address_page_select(limit: int = DEFAULT_ADDRESS_PAGE_SIZE, cursor: str | None = None):
+    """Select one page of customers ordered by city (case-insensitive), then customerID.
+
+    Served by the ix_customers_city_key index; pages are keyed on
+    (city_sort_key, customerID) like the ticket list. The key is selected
+    too, so the cursor carries the database's own value: Python's lower()
+    folds non-ASCII letters that SQLite's does not.
+    """
+    city_key = city_sort_key(Customer.city)
+    # columns rather than entities: pages are serialized straight from the rows
+    stmt = select(
+        Customer.customerID,
+        Customer.firstName,
+        Customer.lastName,
+        Customer.email,
+        Customer.phone,
+        Customer.address,
+        Customer.city,
+        city_key.label("city_key"),
+    )
+    if cursor is not None:
+        data = _decode_cursor(cursor)
+        try:
+            stmt = stmt.where(tuple_(city_key, Customer.customerID) > (str(data["city"]), int(data["id"])))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return stmt.order_by(city_key, Customer.customerID).limit(limit + 1)
+
+
+def split_address_page(rows, limit: int):
+    """Turn `address_page_select` rows into (address dicts, next cursor or None)."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor({"city": last.city_key, "id": last.customerID})
+    results = [
+        {
+            "address": address,
+            "city": city or "",
+            "customer": {
+                "customerID": customer_id,
+                "firstName": first_name,
+                "lastName": last_name,
+                "email": email,
+                "phone": phone,
+                "address": address,
+            },
+        }
+        for customer_id, first_name, last_name, email, phone, address, city, _ in rows
+    ]
+    return results, next_cursor
+
+
+def city_counts_select():
+    # NULL (not yet backfilled) and '' both count as "no city"
+    city = func.coalesce(Customer.city, literal_column("''"))
+    return (
+        select(city.label("city"), func.count().label("count"))
+        .group_by(city)
+        .order_by(city_sort_key(city), city)
+    )
@@ -0,0 +1,166 @@
+"""Per-request SQL checks: repeated statements (N+1), budgets and slow queries.
+
+`QueryWatchMiddleware` collects the statements each request runs, through
+engine events installed by `instrument_engine()`. When the request ends it
+reports:
+
+  * statements run QUERY_REPEAT_THRESHOLD or more times that differ only
+    by their parameters - the signature of a lazy relationship load inside
+    a loop;
+  * more statements than the route's budget, if it has one (budgets are
+    keyed by (method, route template), see QUERY_BUDGETS in app.py).
+
+Statements slower than SLOW_QUERY_MS are logged with their EXPLAIN plan
+whether or not they run inside a request. Settings (environment):
+
+    QUERY_WATCH             log (default), raise or off
+    QUERY_REPEAT_THRESHOLD  repeats that count as N+1 (default 5)
+    SLOW_QUERY_MS           slow statement threshold in ms (default 250, 0 disables)
+
+In log mode problems go to the "shopease.queries" logger. In raise mode
+the request raises `QueryBudgetExceeded` instead, which the test client
+re-raises, so tests fail when an endpoint goes over budget. Off installs
+nothing. The per-statement cost otherwise is a dict increment and two
+clock reads; statements are only normalised once per request.
+"""
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from .db import explain
+
+logger = logging.getLogger("shopease.queries")
+
+MODE = os.environ.get("QUERY_WATCH", "log").lower()
+REPEAT_THRESHOLD = int(os.environ.get("QUERY_REPEAT_THRESHOLD", "5"))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "250"))
+
+# the RequestQueries of the request being handled, if any
+current_queries = contextvars.ContextVar("shopease_current_queries", default=None)
+
+# literals and expanded IN lists, so statements that only differ by values
+# (including values inlined into the SQL) compare equal
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+))*\s*\)")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more statements than its budget, or an N+1 pattern."""
+
+
+class RequestQueries:
+    __slots__ = ("statements", "total")
+
+    def __init__(self):
+        self.statements = Counter()
+        self.total = 0
+
+
+def normalize(statement: str) -> str:
+    statement = _LITERALS.sub("?", statement)
+    return " ".join(_IN_LISTS.sub("(?)", statement).split())
+
+
+def find_problems(queries: RequestQueries, budget: int | None = None) -> list[str]:
+    """Human-readable problems with the statements in `queries`."""
+    problems = []
+    if budget is not None and queries.total > budget:
+        problems.append(f"{queries.total} SQL statements, budget is {budget}")
+    repeats = Counter()
+    for statement, count in queries.statements.items():
+        repeats[normalize(statement)] += count
+    for statement, count in repeats.most_common():
+        if count < REPEAT_THRESHOLD:
+            break
+        problems.append(f"statement ran {count} times with different parameters (N+1?): {statement[:300]}")
+    return problems
+
+
+@contextmanager
+def track():
+    """Collect the statements run inside a ``with`` block, as the middleware does.
+
+    Usage:
+        with track() as queries:
+            build_report()
+        assert not find_problems(queries, budget=3)
+    """
+    queries = RequestQueries()
+    token = current_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        current_queries.reset(token)
+
+
+def report(label: str, problems: list[str]):
+    if not problems:
+        return
+    if MODE == "raise":
+        raise QueryBudgetExceeded(f"{label}: " + "; ".join(problems))
+    for problem in problems:
+        logger.warning("%s: %s", label, problem)
+
+
+class QueryWatchMiddleware:
+    """Pure ASGI middleware reporting each request's SQL problems when it ends."""
+
+    def __init__(self, app, budgets: dict | None = None):
+        self.app = app
+        self.budgets = budgets or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or MODE == "off":
+            return await self.app(scope, receive, send)
+
+        with track() as queries:
+            await self.app(scope, receive, send)
+
+        # set by the router once a route matched
+        route = getattr(scope.get("route"), "path", None)
+        if route is None or not queries.total:
+            return
+        key = (scope["method"], route)
+        report(f"{key[0]} {route}", find_problems(queries, self.budgets.get(key)))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = current_queries.get()
+    if queries is not None:
+        queries.statements[statement] += 1
+        queries.total += 1
+    conn.info["querywatch_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("querywatch_started", None)
+    if started is None or not SLOW_QUERY_MS:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+
+    plan = ""
+    # executemany parameters are a list of rows, which EXPLAIN cannot take
+    if not executemany and statement.lstrip().upper().startswith(_EXPLAINABLE):
+        try:
+            plan = "\n    ".join(explain(conn, statement, parameters))
+        except Exception as exc:
+            plan = f"(no plan: {exc})"
+    logger.warning("Slow SQL statement (%.1f ms): %s\n    %s", elapsed_ms, " ".join(statement.split()), plan)
+
+
+def instrument_engine(engine):
+    """Watch statements run on `engine` (a sync Engine); a no-op when QUERY_WATCH=off."""
+    if MODE == "off":
+        return
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
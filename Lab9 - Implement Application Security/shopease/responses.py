@@ -0,0 +1,48 @@
+"""Opt-in orjson rendering for the large list endpoints.
+
+FastAPI turns a returned list of dicts into JSON by walking it with
+jsonable_encoder and then calling json.dumps, which costs more than the
+query on /tickets and /customer/addresses. With JSON_RESPONSE=orjson
+(needs the orjson package) those endpoints return an `ORJSONResponse`
+directly: orjson encodes the dicts in C, including datetimes (ISO 8601)
+and enums (by value), and FastAPI skips its encoder.
+
+The default (JSON_RESPONSE=std) keeps FastAPI's normal rendering.
+"""
+import os
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+JSON_RESPONSE = os.environ.get("JSON_RESPONSE", "std").lower()
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError:
+        raise RuntimeError("JSON_RESPONSE=orjson requires the orjson package")
+    return orjson
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return _orjson().dumps(content)
+
+
+if JSON_RESPONSE == "orjson":
+    # fail at startup rather than on the first request
+    _orjson()
+
+
+def respond(content, response: Response):
+    """Return `content` from an endpoint, rendered with orjson when enabled.
+
+    `response` is the endpoint's injected Response; FastAPI does not copy
+    its headers onto a Response the endpoint returns, so this does.
+    """
+    if JSON_RESPONSE != "orjson":
+        return content
+    out = ORJSONResponse(content, status_code=response.status_code or 200)
+    out.headers.raw.extend((k, v) for k, v in response.headers.raw if k != b"content-length")
+    return out
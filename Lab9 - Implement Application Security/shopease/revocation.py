@@ -0,0 +1,227 @@
+"""Revocation list for JWTs, checked on every authenticated request.
+
+Revoked token IDs (`jti`) are persisted in revoked_tokens and mirrored into
+each process as a Bloom filter plus an exact dict. A check for a token that
+was never revoked, which is almost every request, is answered by the Bloom
+filter without touching the dict or the database. A Bloom hit is confirmed
+against the exact dict, so false positives never reject a valid token.
+
+The mirror is refreshed incrementally: at most every
+REVOCATION_REFRESH_SECONDS (default 5) one request per process pulls rows
+with a revocationID above the last one seen. That alone is not enough on
+databases with sequences (Postgres): IDs are handed out at insert time but
+become visible at commit, so a lower ID can appear after a higher one was
+read and would be skipped for good. Each refresh therefore also re-reads
+rows revoked within REVOCATION_OVERLAP_SECONDS of the previous refresh,
+and every REVOCATION_RESYNC_SECONDS the whole (unexpired) table is read
+again to catch anything slower than that, such as long transactions or
+clock skew between the processes stamping revokedAt. Re-read rows are
+already known and cost nothing but the read. Revocations made in this
+process apply immediately. Entries are dropped once the token would have
+expired anyway.
+
+    REVOCATION_REFRESH_SECONDS  seconds between refreshes (default 5)
+    REVOCATION_OVERLAP_SECONDS  revokedAt window re-read on each refresh (default 60)
+    REVOCATION_RESYNC_SECONDS   seconds between full re-reads (default 300)
+    REVOCATION_BLOOM_CAPACITY   entries before the filter is resized (default 100000)
+    REVOCATION_BLOOM_FP_RATE    target false-positive rate (default 0.001)
+"""
+import datetime
+import hashlib
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from .db import get_session
+from .models import RevokedToken
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.size = max(8, int(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _hash(self, key: str):
+        # double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def add(self, key: str):
+        h1, h2 = self._hash(key)
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % self.size
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        # stops at the first clear bit, which for an absent key is usually the first
+        h1, h2 = self._hash(key)
+        bits, size = self._bits, self.size
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % size
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    def __init__(self, session_factory=None, refresh_seconds: float = 5.0, capacity: int = 100000, fp_rate: float = 0.001,
+                 overlap_seconds: float = 60.0, resync_seconds: float = 300.0):
+        self.session_factory = session_factory
+        self.refresh_seconds = refresh_seconds
+        self.overlap = datetime.timedelta(seconds=overlap_seconds)
+        self.resync_seconds = resync_seconds
+        self.fp_rate = fp_rate
+        self._bloom = BloomFilter(capacity, fp_rate)
+        # jti -> expiry (naive UTC)
+        self._revoked: dict[str, datetime.datetime] = {}
+        self._last_id = 0
+        # wall time (naive UTC) the last refresh started; None until the first one
+        self._last_refresh: datetime.datetime | None = None
+        self._next_refresh = 0.0
+        self._next_resync = 0.0
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.bloom_hits = 0
+        self.refreshes = 0
+        self.resyncs = 0
+
+    def _add_locked(self, token_id: str, expires_at: datetime.datetime):
+        if token_id in self._revoked:
+            return
+        self._revoked[token_id] = expires_at
+        if self._bloom.count >= self._bloom.capacity:
+            self._rebuild_locked(self._bloom.capacity * 2)
+        self._bloom.add(token_id)
+
+    def _rebuild_locked(self, capacity: int):
+        now = datetime.datetime.utcnow()
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        bloom = BloomFilter(max(capacity, len(self._revoked) * 2), self.fp_rate)
+        for jti in self._revoked:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def refresh(self, full: bool = False):
+        """Pull revocations made by other processes since the last refresh.
+
+        With `full` (and on the first refresh) every unexpired row is read.
+        """
+        if self.session_factory is None:
+            return
+        started = datetime.datetime.utcnow()
+        stmt = (
+            select(RevokedToken.revocationID, RevokedToken.tokenID, RevokedToken.expiresAt)
+            .where(RevokedToken.expiresAt > started)
+            .order_by(RevokedToken.revocationID)
+        )
+        full = full or self._last_refresh is None
+        if not full:
+            # IDs committed out of order land below _last_id; the window catches them
+            stmt = stmt.where(or_(
+                RevokedToken.revocationID > self._last_id,
+                RevokedToken.revokedAt >= self._last_refresh - self.overlap,
+            ))
+        session = self.session_factory()
+        try:
+            rows = session.execute(stmt).all()
+        finally:
+            session.close()
+        with self._lock:
+            for revocation_id, token_id, expires_at in rows:
+                self._add_locked(token_id, expires_at)
+                self._last_id = max(self._last_id, revocation_id)
+            self._last_refresh = started
+            self.refreshes += 1
+            if full:
+                self.resyncs += 1
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if now < self._next_refresh or not self._lock.acquire(blocking=False):
+            return
+        try:
+            if now < self._next_refresh:
+                return
+            self._next_refresh = now + self.refresh_seconds
+            full = now >= self._next_resync
+            if full:
+                self._next_resync = now + self.resync_seconds
+        finally:
+            self._lock.release()
+        self.refresh(full=full)
+
+    def is_revoked(self, token_id: str | None) -> bool:
+        if not token_id:
+            return False
+        self._maybe_refresh()
+        self.checks += 1
+        if token_id not in self._bloom:
+            return False
+        self.bloom_hits += 1
+        return token_id in self._revoked
+
+    def revoke(self, session, token_id: str, expires_at: datetime.datetime):
+        """Persist a revocation in `session` (the caller commits) and apply it locally.
+
+        Revoking a token twice, including from two concurrent requests, is
+        not an error: the insert is an upsert that keeps the first row.
+        """
+        dialect = session.get_bind().dialect.name
+        values = {"tokenID": token_id, "expiresAt": expires_at}
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            session.execute(
+                dialect_insert(RevokedToken).values(**values).on_conflict_do_nothing(index_elements=[RevokedToken.tokenID])
+            )
+        else:
+            try:
+                with session.begin_nested():
+                    session.execute(insert(RevokedToken).values(**values))
+            except IntegrityError:
+                pass
+        with self._lock:
+            self._add_locked(token_id, expires_at)
+
+    def prune(self, session) -> int:
+        """Delete rows for tokens that have expired anyway; returns the count."""
+        now = datetime.datetime.utcnow()
+        deleted = session.execute(delete(RevokedToken).where(RevokedToken.expiresAt <= now)).rowcount
+        with self._lock:
+            self._rebuild_locked(self._bloom.capacity)
+        return deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "revoked": len(self._revoked),
+                "bloomBits": self._bloom.size,
+                "bloomHashes": self._bloom.hashes,
+                "bloomCapacity": self._bloom.capacity,
+                "checks": self.checks,
+                "bloomHits": self.bloom_hits,
+                "refreshes": self.refreshes,
+                "resyncs": self.resyncs,
+                "lastRevocationID": self._last_id,
+            }
+
+
+revocations = RevocationList(
+    session_factory=get_session,
+    refresh_seconds=float(os.environ.get("REVOCATION_REFRESH_SECONDS", "5")),
+    capacity=int(os.environ.get("REVOCATION_BLOOM_CAPACITY", "100000")),
+    fp_rate=float(os.environ.get("REVOCATION_BLOOM_FP_RATE", "0.001")),
+    overlap_seconds=float(os.environ.get("REVOCATION_OVERLAP_SECONDS", "60")),
+    resync_seconds=float(os.environ.get("REVOCATION_RESYNC_SECONDS", "300")),
+)
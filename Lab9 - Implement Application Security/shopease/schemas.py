@@ -0,0 +1,38 @@
+"""Request payload models shared by the sync and async routes."""
+import datetime
+
+from pydantic import BaseModel
+
+
+class TicketCreate(BaseModel):
+    customerID: int
+    issueDescription: str
+    supportAgentID: int | None = None
+    status: str | None = None
+
+
+class TicketUpdate(BaseModel):
+    customerID: int | None = None
+    issueDescription: str | None = None
+    supportAgentID: int | None = None
+    status: str | None = None
+
+
+class TicketFilter(BaseModel):
+    """Same filters as GET /tickets."""
+    status: str | None = None
+    customerID: int | None = None
+    supportAgentID: int | None = None
+    createdFrom: datetime.datetime | None = None
+    createdTo: datetime.datetime | None = None
+
+
+class TicketBulkUpdate(BaseModel):
+    """Targets (`ticketIDs` or `filter`) and the changes to apply to them.
+
+    `supportAgentID: 0` unassigns the tickets.
+    """
+    ticketIDs: list[int] | None = None
+    filter: TicketFilter | None = None
+    status: str | None = None
+    supportAgentID: int | None = None
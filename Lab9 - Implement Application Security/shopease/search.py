@@ -0,0 +1,131 @@
+"""Index-backed customer search for /customer/search.
+
+Modes, picked per database the first time a search runs:
+
+    trigram  PostgreSQL with pg_trgm: ILIKE served by the GIN trigram
+             indexes, ordered by word-similarity distance (`<->>`) to the
+             customer's search text, which its GiST trigram index can
+             serve as a KNN scan. Postgres picks per term: a bitmap scan
+             plus sort for rare terms, or walking the GiST index nearest
+             first until `limit` rows pass the filter for common ones, so
+             no term scores the whole table.
+    fts5     SQLite with the customers_fts shadow table (FTS5, trigram
+             tokenizer), ranked by bm25.
+    like     the original ILIKE scan; used when neither index exists or the
+             term is shorter than a trigram.
+    memory   the in-process trigram index from ngram_index.py; only used
+             when CUSTOMER_SEARCH_MODE=memory. Each worker holds its own
+             copy and picks up other workers' writes periodically.
+
+Run migrate_add_customer_search_indexes to create the database indexes. Set
+CUSTOMER_SEARCH_MODE=like to force the scan.
+"""
+import os
+
+from sqlalchemy import bindparam, case, column, false, func, literal_column, select, table, text
+
+from . import ngram_index
+from .models import Customer
+from .queries import customer_search_select
+
+CUSTOMER_SEARCH_MODE = os.environ.get("CUSTOMER_SEARCH_MODE", "auto").lower()
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+# trigram indexes cannot answer shorter terms
+MIN_INDEXED_TERM_LENGTH = 3
+
+SEARCH_COLUMNS = ["firstname", "lastname", "email", "phone", "address"]
+
+customers_fts = table("customers_fts", column("rowid"), column("rank"))
+
+# engine url -> detected mode
+_modes: dict[str, str] = {}
+
+
+def _detect(conn) -> str:
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        found = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customers_fts'")
+        ).first()
+        return "fts5" if found else "like"
+    if dialect == "postgresql":
+        found = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+        return "trigram" if found else "like"
+    return "like"
+
+
+def search_mode(conn) -> str:
+    """Search mode for the database behind `conn` (a sync Connection)."""
+    if CUSTOMER_SEARCH_MODE != "auto":
+        return CUSTOMER_SEARCH_MODE
+    key = str(conn.engine.url)
+    if key not in _modes:
+        _modes[key] = _detect(conn)
+    return _modes[key]
+
+
+def session_search_mode(session) -> str:
+    """search_mode() for a sync Session; in memory mode, refreshes the index when due."""
+    mode = search_mode(session.connection())
+    if mode == "memory":
+        ngram_index.maybe_refresh(session)
+    return mode
+
+
+def reset_search_mode():
+    """Forget detected modes, e.g. after running the search index migration."""
+    _modes.clear()
+
+
+def _fts5_select(search_string: str, limit: int):
+    # quote as a single FTS5 phrase so user input is never parsed as query syntax
+    phrase = '"' + search_string.replace('"', '""') + '"'
+    return (
+        select(Customer)
+        .join(customers_fts, customers_fts.c.rowid == Customer.customerID)
+        .where(literal_column("customers_fts").op("MATCH")(bindparam("fts_query", phrase)))
+        .order_by(customers_fts.c.rank)
+        .limit(limit)
+    )
+
+
+def search_text():
+    """All searched columns in one string; ix_customers_search_text_trgm indexes exactly this."""
+    cols = [Customer.firstName, Customer.lastName, Customer.email, Customer.phone, Customer.address]
+    # || and coalesce rather than concat_ws, which is not immutable and cannot be indexed
+    text_expr = func.coalesce(cols[0], literal_column("''"))
+    for col in cols[1:]:
+        text_expr = text_expr.op("||")(literal_column("' '")).op("||")(func.coalesce(col, literal_column("''")))
+    return text_expr
+
+
+def _trigram_select(search_string: str, limit: int):
+    distance = search_text().op("<->>")(bindparam("trigram_term", search_string))
+    return (
+        customer_search_select(search_string)
+        .order_by(distance, Customer.customerID)
+        .limit(limit)
+    )
+
+
+def _memory_select(ids: list[int]):
+    # hydrate only the IDs the in-process index matched, keeping its ranking
+    if not ids:
+        return select(Customer).where(false())
+    order = case({cid: pos for pos, cid in enumerate(ids)}, value=Customer.customerID)
+    return select(Customer).where(Customer.customerID.in_(ids)).order_by(order)
+
+
+def customer_search_stmt(search_string: str, limit: int, mode: str):
+    """Select up to `limit` matching customers, best matches first."""
+    if mode == "memory" and ngram_index.index is not None:
+        ids = ngram_index.index.search(search_string, limit)
+        if ids is not None:
+            return _memory_select(ids)
+    if len(search_string) >= MIN_INDEXED_TERM_LENGTH:
+        if mode == "fts5":
+            return _fts5_select(search_string, limit)
+        if mode == "trigram":
+            return _trigram_select(search_string, limit)
+    return customer_search_select(search_string).order_by(Customer.customerID).limit(limit)
@@ -0,0 +1,64 @@
+"""Startup timing for the cold-start report.
+
+`create_app()` and the lifespan handler time their phases here:
+
+    import      importing the package until create_app() is called
+    create_app  building the app, routers and middleware
+    engine      creating (and instrumenting) the database engines
+    warm-up     first connection, search mode detection, revocation list,
+                in-memory search index when enabled
+
+`report()` logs one line (INFO, "shopease.startup") once the app is ready
+to serve and a warning when the total exceeds STARTUP_BUDGET_SECONDS
+(unset: no budget). The timings
+are served at /adsweb/internal/startup; bench_startup measures whole cold
+starts in fresh processes.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# set when the package is first imported (shopease/__init__.py)
+PACKAGE_IMPORTED = None
+
+BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS") or 0) or None
+
+phases: dict[str, float] = {}
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = time.perf_counter() - started
+
+
+def mark_import_done():
+    """Record the import phase; called at the start of create_app()."""
+    if PACKAGE_IMPORTED is not None and "import" not in phases:
+        phases["import"] = time.perf_counter() - PACKAGE_IMPORTED
+
+
+def total() -> float:
+    return sum(phases.values())
+
+
+def timings() -> dict:
+    return {
+        "phasesSeconds": {name: round(seconds, 4) for name, seconds in phases.items()},
+        "totalSeconds": round(total(), 4),
+        "budgetSeconds": BUDGET_SECONDS,
+        "overBudget": BUDGET_SECONDS is not None and total() > BUDGET_SECONDS,
+    }
+
+
+def report():
+    line = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in phases.items())
+    logger.info("Startup: %s; total %.3fs", line, total())
+    if BUDGET_SECONDS is not None and total() > BUDGET_SECONDS:
+        logger.warning("Startup took %.3fs, over the %.3fs budget (STARTUP_BUDGET_SECONDS)", total(), BUDGET_SECONDS)
@@ -17,10 +17,59 @@ def token_request(username: str, password: str):
     return resp
 
 
-def get_tickets(token: str):
+def refresh_request(refresh_token: str):
+    url = f"{API_BASE}/token/refresh"
+    data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    return requests.post(url, data=data)
+
+
+def store_tokens(data: dict):
+    st.session_state.token = data.get("access_token")
+    st.session_state.refresh_token = data.get("refresh_token")
+
+
+def refresh_session() -> bool:
+    """Swap the refresh token for a new pair instead of asking for the password again."""
+    if not st.session_state.get("refresh_token"):
+        return False
+    resp = refresh_request(st.session_state.refresh_token)
+    if resp.status_code != 200:
+        st.session_state.token = None
+        st.session_state.refresh_token = None
+        return False
+    store_tokens(resp.json())
+    return True
+
+
+def get_tickets(token: str, etag: str | None = None, cursor: str | None = None):
+    """Request one page of tickets; the next page's cursor is in X-Next-Cursor."""
     url = f"{API_BASE}/tickets"
     headers = {"Authorization": f"Bearer {token}"}
-    return requests.get(url, headers=headers)
+    if etag:
+        headers["If-None-Match"] = etag
+    params = {"cursor": cursor} if cursor else None
+    return requests.get(url, headers=headers, params=params)
+
+
+def get_all_tickets(token: str, etag: str | None = None):
+    """Fetch every page of tickets, following X-Next-Cursor.
+
+    Returns (first page response, tickets). Only the first page is
+    revalidated with `etag`; the ticket list version behind it covers all
+    pages, so on 304 (or an error) the tickets are None.
+    """
+    resp = get_tickets(token, etag)
+    if resp.status_code != 200:
+        return resp, None
+    tickets = resp.json()
+    cursor = resp.headers.get("X-Next-Cursor")
+    while cursor:
+        page = get_tickets(token, cursor=cursor)
+        if page.status_code != 200:
+            return page, None
+        tickets.extend(page.json())
+        cursor = page.headers.get("X-Next-Cursor")
+    return resp, tickets
 
 
 def create_ticket(token: str, customerID: int, issue: str, supportAgentID: int | None = None):
@@ -43,8 +92,7 @@ def main():
         if st.button("Login"):
             resp = token_request(username, password)
             if resp.status_code == 200:
-                data = resp.json()
-                st.session_state.token = data.get("access_token")
+                store_tokens(resp.json())
                 st.success("Logged in")
             else:
                 st.error(f"Login failed: {resp.status_code} {resp.text}")
@@ -52,12 +100,20 @@ def main():
         if st.session_state.token:
             if st.button("Logout"):
                 st.session_state.token = None
+                st.session_state.refresh_token = None
 
     if st.session_state.token:
         st.subheader("Tickets")
-        resp = get_tickets(st.session_state.token)
-        if resp.status_code == 200:
-            tickets = resp.json()
+        # revalidate instead of re-downloading the list on every rerun
+        cached = st.session_state.get("tickets_cache")
+        resp, tickets = get_all_tickets(st.session_state.token, cached[0] if cached else None)
+        if resp.status_code == 401 and refresh_session():
+            resp, tickets = get_all_tickets(st.session_state.token, cached[0] if cached else None)
+        if resp.status_code == 304 and cached:
+            tickets = cached[1]
+        elif tickets is not None:
+            st.session_state.tickets_cache = (resp.headers.get("ETag"), tickets)
+        if tickets is not None:
             for t in tickets:
                 st.markdown(f"**Ticket {t['ticketID']}** - {t['status']}")
                 st.write(t['issueDescription'])
@@ -75,6 +131,8 @@ def main():
             if submitted:
                 agent_id = int(agent) if agent.strip().isdigit() else None
                 r = create_ticket(st.session_state.token, cid, issue, agent_id)
+                if r.status_code == 401 and refresh_session():
+                    r = create_ticket(st.session_state.token, cid, issue, agent_id)
                 if r.status_code in (200, 201):
                     st.success("Ticket created")
                 else:
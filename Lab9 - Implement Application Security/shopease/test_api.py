@@ -2,6 +2,8 @@ import os
 import time
 import threading
 
+import pytest
+
 from . import seed
 
 
@@ -24,9 +26,1181 @@ def main():
 
     import requests
 
-    resp = requests.get("http://127.0.0.1:8080/adsweb/api/v1/tickets")
-    print("Status:", resp.status_code)
-    print(resp.json())
+    # the list is paged; follow X-Next-Cursor to the end
+    url = "http://127.0.0.1:8080/adsweb/api/v1/tickets"
+    tickets, cursor = [], None
+    while True:
+        resp = requests.get(url, params={"cursor": cursor} if cursor else None)
+        print("Status:", resp.status_code)
+        if resp.status_code != 200:
+            break
+        tickets.extend(resp.json())
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    print(f"{len(tickets)} tickets")
+    print(tickets)
+
+
+def _seeded_sqlite(tmp_path, monkeypatch):
+    db_url = f"sqlite:///{tmp_path / 'shopease_test.db'}"
+    monkeypatch.setenv("DATABASE_URL", db_url)
+    seed.seed_all(db_url)
+    return db_url
+
+
+def _app_client():
+    """TestClient for a fresh app; entering it runs the lifespan against DATABASE_URL."""
+    from fastapi.testclient import TestClient
+
+    from . import auth, cache
+    from .app import create_app
+
+    # process-wide caches outlive each test's database
+    cache.ticket_cache.clear()
+    auth.principal_cache.clear()
+    return TestClient(create_app())
+
+
+def _bearer(email="tom.agent@example.com", role="agent"):
+    # signed directly so tests do not start the password hashing pool
+    from .auth import create_access_token
+
+    return {"Authorization": f"Bearer {create_access_token({'sub': email, 'role': role})}"}
+
+
+def _routes_engine():
+    """The engine serving the routes (the async one with USE_ASYNC_DB=1)."""
+    from . import db
+
+    return db.async_engine.sync_engine if db.async_engine is not None else db.engine
+
+
+def test_ticket_list_query_count_is_constant(tmp_path, monkeypatch):
+    _seeded_sqlite(tmp_path, monkeypatch)
+    from .db import count_queries, get_session
+    from .models import SupportTicket
+
+    def list_tickets(client):
+        with count_queries(_routes_engine()) as counter:
+            resp = client.get("/adsweb/api/v1/tickets")
+        assert resp.status_code == 200
+        return resp.json(), counter
+
+    with _app_client() as client:
+        tickets, few = list_tickets(client)
+        assert len(tickets) == 2
+
+        session = get_session()
+        try:
+            # enough tickets that a lazy-loading list would issue many more queries
+            session.add_all([
+                SupportTicket(customerID=1 + i % 2, supportAgentID=(1 + i % 2) if i % 3 else None, issueDescription=f"issue {i}")
+                for i in range(48)
+            ])
+            session.commit()
+        finally:
+            session.close()
+
+        tickets, many = list_tickets(client)
+
+    assert len(tickets) == 50
+    # the table version lookup and the page query
+    assert few.count == many.count == 2, many.statements
+    assert all(t["customer"] is not None for t in tickets)
+    assert any(t["supportAgent"] is None for t in tickets)
+
+
+def test_ticket_endpoints_stay_within_query_budgets(tmp_path, monkeypatch):
+    _seeded_sqlite(tmp_path, monkeypatch)
+    from fastapi.testclient import TestClient
+
+    from . import querywatch
+    from .app import create_app
+
+    monkeypatch.setattr(querywatch, "MODE", "raise")
+
+    # entering the client runs the lifespan handler, which binds the engine
+    # to this test's database
+    with TestClient(create_app()) as client:
+        assert client.get("/adsweb/api/v1/tickets").status_code == 200
+        assert client.get("/adsweb/api/v1/tickets/1").status_code == 200
+        assert client.get("/adsweb/api/v1/customer/addresses").status_code == 200
+        assert client.put("/adsweb/api/v1/ticket/1", json={"status": "closed"}).status_code == 200
+
+
+def test_lazy_relationship_loads_are_flagged(tmp_path, monkeypatch):
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    from . import db, querywatch
+    from .models import Customer, SupportTicket
+
+    db.init_engine(db_url)
+    querywatch.instrument_engine(db.engine)
+    session = db.get_session()
+    try:
+        customers = [Customer(firstName="C", lastName=str(i), email=f"c{i}@example.com") for i in range(6)]
+        session.add_all(customers)
+        session.flush()
+        session.add_all([SupportTicket(customerID=c.customerID, issueDescription="lazy") for c in customers])
+        session.commit()
+        session.expunge_all()
+
+        with querywatch.track() as queries:
+            tickets = session.query(SupportTicket).filter(SupportTicket.issueDescription == "lazy").all()
+            # relationship access per ticket, as a naive serializer would do
+            [(t.customer.email, t.supportAgent) for t in tickets]
+    finally:
+        session.close()
+
+    problems = querywatch.find_problems(queries, budget=2)
+    assert "budget is 2" in problems[0]
+    assert any("6 times" in p and "FROM customers" in p for p in problems), problems
+
+
+def test_bulk_create_mixed_batch_is_one_insert(tmp_path, monkeypatch):
+    _seeded_sqlite(tmp_path, monkeypatch)
+    from . import db, querywatch
+
+    monkeypatch.setattr(querywatch, "MODE", "raise")
+    # alternate tickets with and without an agent
+    body = [
+        {"customerID": 1, "issueDescription": f"bulk {i}", **({"supportAgentID": 1} if i % 2 else {})}
+        for i in range(100)
+    ]
+    with _app_client() as client:
+        headers = _bearer()
+        with db.count_queries(_routes_engine()) as counter:
+            resp = client.post("/adsweb/api/v1/tickets/bulk", json=body, headers=headers)
+        assert resp.status_code == 200
+        created = resp.json()["created"]
+        assert [c["index"] for c in created] == list(range(100))
+        # IDs map back to the right items
+        first, second = (client.get(f"/adsweb/api/v1/tickets/{c['ticketID']}").json() for c in created[:2])
+        assert (first["issueDescription"], first["supportAgent"]) == ("bulk 0", None)
+        assert (second["issueDescription"], second["supportAgent"]["agentID"]) == ("bulk 1", 1)
+
+    inserts = [s for s in counter.statements if s.startswith("INSERT")]
+    assert len(inserts) == 1, inserts
+
+
+def test_internal_endpoints_are_closed_without_a_token(tmp_path, monkeypatch):
+    _seeded_sqlite(tmp_path, monkeypatch)
+    from . import auth
+
+    monkeypatch.setattr(auth, "INTERNAL_API_TOKEN", None)
+    with _app_client() as client:
+        assert client.get("/adsweb/internal/pool").status_code == 403
+        monkeypatch.setattr(auth, "INTERNAL_ENDPOINTS_OPEN", True)
+        assert client.get("/adsweb/internal/pool").status_code == 200
+
+        monkeypatch.setattr(auth, "INTERNAL_API_TOKEN", "s3cret")
+        assert client.get("/adsweb/internal/pool").status_code == 403
+        assert client.get("/adsweb/internal/pool", headers={"X-Internal-Token": "s3cret"}).status_code == 200
+
+
+def test_revocations_committed_out_of_order_are_picked_up(tmp_path, monkeypatch):
+    import datetime
+
+    from sqlalchemy import insert
+
+    from . import db
+    from .models import RevokedToken
+    from .revocation import RevocationList
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    db.init_engine()
+    revocations = RevocationList(session_factory=db.get_session)
+    expires = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    def commit_revocation(revocation_id, jti, revoked_at=None):
+        session = db.get_session()
+        try:
+            session.execute(insert(RevokedToken).values(
+                revocationID=revocation_id, tokenID=jti, expiresAt=expires,
+                revokedAt=revoked_at or datetime.datetime.utcnow()))
+            session.commit()
+        finally:
+            session.close()
+
+    # ID 5 commits first; 3 and 4 were allocated earlier but commit afterwards
+    commit_revocation(5, "jti-5")
+    revocations.refresh()
+    assert revocations.is_revoked("jti-5")
+    assert revocations.stats()["lastRevocationID"] == 5
+
+    commit_revocation(3, "jti-3")
+    revocations.refresh()
+    assert revocations.is_revoked("jti-3")
+
+    # slower than the overlap window: only the periodic full re-read finds it
+    commit_revocation(4, "jti-4", revoked_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+    revocations.refresh()
+    assert not revocations.is_revoked("jti-4")
+    revocations.refresh(full=True)
+    assert revocations.is_revoked("jti-4")
+
+
+def test_memory_search_index_picks_up_other_workers_writes(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, insert, update
+
+    from . import db, ngram_index, search
+    from .models import Customer
+
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(search, "CUSTOMER_SEARCH_MODE", "memory")
+    # another worker: same database, no Session events in this process's index
+    other = create_engine(db_url)
+    with _app_client() as client:
+        with other.begin() as conn:
+            conn.execute(insert(Customer).values(firstName="Zelda", lastName="Quorn", email="zelda@example.com"))
+        url = "/adsweb/api/v1/customer/search/quorn"
+        assert client.get(url).json() == []
+
+        monkeypatch.setattr(ngram_index, "_next_refresh", 0.0)
+        assert [c["email"] for c in client.get(url).json()] == ["zelda@example.com"]
+
+        # updates need the rebuild, which never runs on a search request
+        with other.begin() as conn:
+            conn.execute(update(Customer).where(Customer.email == "zelda@example.com").values(lastName="Varga"))
+        monkeypatch.setattr(ngram_index, "_next_refresh", 0.0)
+        assert client.get("/adsweb/api/v1/customer/search/varga").json() == []
+
+        ngram_index.rebuild(db.get_session)
+        assert [c["email"] for c in client.get("/adsweb/api/v1/customer/search/varga").json()] == ["zelda@example.com"]
+    other.dispose()
+
+
+def test_memory_search_index_rebuilds_in_the_background(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, update
+
+    from . import ngram_index, search
+    from .models import Customer
+
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(search, "CUSTOMER_SEARCH_MODE", "memory")
+    monkeypatch.setattr(ngram_index, "REBUILD_SECONDS", 0.05)
+    builders = []
+    build = ngram_index.CustomerNgramIndex.build
+
+    def recording_build(self, session, *args, **kwargs):
+        builders.append(threading.current_thread().name)
+        return build(self, session, *args, **kwargs)
+
+    monkeypatch.setattr(ngram_index.CustomerNgramIndex, "build", recording_build)
+    other = create_engine(db_url)
+    with _app_client() as client:
+        with other.begin() as conn:
+            conn.execute(update(Customer).where(Customer.email == "alice@example.com").values(lastName="Quorn"))
+        deadline = time.monotonic() + 5
+        found = []
+        while not found and time.monotonic() < deadline:
+            monkeypatch.setattr(ngram_index, "_next_refresh", 0.0)
+            found = client.get("/adsweb/api/v1/customer/search/quorn").json()
+            time.sleep(0.02)
+        assert [c["email"] for c in found] == ["alice@example.com"]
+        rebuilder = ngram_index._rebuilder
+        assert rebuilder is not None and rebuilder.is_alive()
+        # the startup build, then only the background thread
+        assert set(builders[1:]) == {"customer-ngram-rebuild"}
+    assert ngram_index._rebuilder is None and not rebuilder.is_alive()
+    other.dispose()
+
+
+def test_memory_search_index_rebuild_keeps_writes_made_meanwhile():
+    from . import ngram_index
+
+    class Rows:
+        # the table as read by the rebuild, before customer 3 was committed
+        def execute(self, stmt):
+            idx.add(3, ("Zelda", "Quorn", "zelda@example.com", None, None))
+            idx.remove(1)
+            return iter([(1, "Alice", "Smith", "alice@example.com", None, None)])
+
+    idx = ngram_index.CustomerNgramIndex()
+    idx.add(1, ("Alice", "Smith", "alice@example.com", None, None))
+    idx.build(Rows())
+    assert idx.search("quorn", 10) == [3]
+    assert idx.search("smith", 10) == []
+
+
+def test_ticket_pages_follow_the_cursor_without_gaps_or_duplicates(tmp_path, monkeypatch):
+    import datetime
+
+    from sqlalchemy import insert, select
+
+    from . import db
+    from .models import SupportTicket
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    db.init_engine()
+    # many tickets share a createdAt, so pages split inside ties
+    stamp = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    session = db.get_session()
+    try:
+        session.execute(insert(SupportTicket), [
+            {"customerID": 1 + i % 2, "issueDescription": f"page {i}", "createdAt": stamp + datetime.timedelta(seconds=i // 4)}
+            for i in range(40)
+        ])
+        session.commit()
+        expected = list(session.scalars(
+            select(SupportTicket.ticketID).order_by(SupportTicket.createdAt.desc(), SupportTicket.ticketID.desc())
+        ))
+    finally:
+        session.close()
+    assert len(expected) == 42
+
+    url = "/adsweb/api/v1/tickets"
+    with _app_client() as client:
+        # 42 = 6 * 7: the last page is full and still has no cursor
+        for limit in (5, 7, 42, 100):
+            seen, cursor, pages = [], None, 0
+            while True:
+                resp = client.get(url, params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+                assert resp.status_code == 200
+                page = [t["ticketID"] for t in resp.json()]
+                assert 0 < len(page) <= limit
+                seen.extend(page)
+                pages += 1
+                cursor = resp.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert seen == expected
+            assert pages == -(-len(expected) // limit)
+
+        assert client.get(url, params={"cursor": "not-a-cursor"}).status_code == 400
+        for bad in (0, -1, 1001):
+            assert client.get(url, params={"limit": bad}).status_code == 400, bad
+
+        # clients from before paging send neither limit nor cursor: whole list
+        unpaged = client.get(url)
+        assert [t["ticketID"] for t in unpaged.json()] == expected
+        assert "X-Next-Cursor" not in unpaged.headers
+        first = client.get(url, params={"limit": 40})
+        rest = client.get(url, params={"cursor": first.headers["X-Next-Cursor"]})
+        assert [t["ticketID"] for t in rest.json()] == expected[40:]
+
+
+def test_ticket_etags_answer_304_until_a_write(tmp_path, monkeypatch):
+    _seeded_sqlite(tmp_path, monkeypatch)
+    with _app_client() as client:
+        for url in ("/adsweb/api/v1/tickets", "/adsweb/api/v1/tickets/1"):
+            first = client.get(url)
+            etag = first.headers["ETag"]
+            assert first.status_code == 200 and first.headers["Cache-Control"] == "no-cache"
+
+            again = client.get(url, headers={"If-None-Match": etag})
+            assert again.status_code == 304 and again.content == b""
+            assert again.headers["ETag"] == etag
+            assert client.get(url, headers={"If-None-Match": 'W/"0-stale"'}).status_code == 200
+
+        list_url = "/adsweb/api/v1/tickets"
+        list_etag = client.get(list_url).headers["ETag"]
+        modified = client.get(list_url).headers["Last-Modified"]
+        # whole-second Last-Modified cannot tell a write in the same second apart
+        assert client.get(list_url, headers={"If-Modified-Since": modified}).status_code == 200
+        # other query strings are other representations
+        assert client.get(list_url, params={"limit": 1}).headers["ETag"] != list_etag
+
+        detail_etag = client.get("/adsweb/api/v1/tickets/1").headers["ETag"]
+        assert client.put("/adsweb/api/v1/ticket/1", json={"status": "closed"}).status_code == 200
+
+        after = client.get(list_url, headers={"If-None-Match": list_etag})
+        assert after.status_code == 200 and after.headers["ETag"] != list_etag
+        detail = client.get("/adsweb/api/v1/tickets/1", headers={"If-None-Match": detail_etag})
+        assert detail.status_code == 200 and detail.json()["status"] == "closed"
+        assert detail.headers["ETag"] != detail_etag
+
+
+def test_ticket_cache_drops_fills_that_raced_an_invalidation(tmp_path, monkeypatch):
+    from . import cache
+
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: clock[0])
+    ttl_cache = cache.TTLCache(maxsize=2, ttl=30)
+
+    token = ttl_cache.fill_token()
+    ttl_cache.set(1, "fresh", token)
+    assert ttl_cache.get(1) == "fresh"
+
+    # a write invalidates between the reader's query and its set()
+    token = ttl_cache.fill_token()
+    ttl_cache.invalidate(2)
+    ttl_cache.set(2, "stale", token)
+    assert ttl_cache.get(2) is None
+    ttl_cache.set(2, "refilled", ttl_cache.fill_token())
+    assert ttl_cache.get(2) == "refilled"
+
+    clock[0] += 31
+    assert ttl_cache.get(1) is None
+    assert ttl_cache.stats()["expirations"] == 1
+
+    # through the endpoints: a PUT invalidates the cached detail
+    _seeded_sqlite(tmp_path, monkeypatch)
+    with _app_client() as client:
+        assert client.get("/adsweb/api/v1/tickets/1").json()["status"] == "open"
+        assert cache.ticket_cache.get(1)[1]["status"] == "open"
+        assert client.put("/adsweb/api/v1/ticket/1", json={"status": "closed"}).status_code == 200
+        assert cache.ticket_cache.get(1) is None
+        assert client.get("/adsweb/api/v1/tickets/1").json()["status"] == "closed"
+
+
+def test_ticket_cache_sees_other_workers_writes(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from . import cache
+    from .models import Customer, SupportTicket, TicketStatus
+
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    # another worker: its own engine and its own (empty) cache
+    other = create_engine(db_url)
+    url = "/adsweb/api/v1/tickets/1"
+    with _app_client() as client:
+        ticket = client.get(url).json()
+        assert cache.ticket_cache.get(1) is not None
+
+        with Session(other) as session:
+            session.get(SupportTicket, 1).status = TicketStatus.closed
+            session.commit()
+        assert client.get(url).json()["status"] == "closed"
+
+        # customer names are embedded in the detail
+        with Session(other) as session:
+            session.get(Customer, ticket["customer"]["customerID"]).firstName = "Renamed"
+            session.commit()
+        assert client.get(url).json()["customer"]["firstName"] == "Renamed"
+
+        # unchanged version: served from the cache
+        hits = cache.ticket_cache.stats()["hits"]
+        client.get(url)
+        assert cache.ticket_cache.stats()["hits"] == hits + 1
+    other.dispose()
+
+
+def test_reused_refresh_token_revokes_its_family(tmp_path, monkeypatch):
+    from sqlalchemy import select
+
+    from . import auth, db
+    from .models import Customer
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    url = "/adsweb/api/v1/token/refresh"
+    with _app_client() as client:
+        # issued directly so the test does not start the password hashing pool
+        session = db.get_session()
+        try:
+            user = session.scalars(select(Customer).where(Customer.email == "tom.agent@example.com")).one()
+            first = auth.issue_tokens(session, user)["refresh_token"]
+            other_login = auth.issue_tokens(session, user)["refresh_token"]
+        finally:
+            session.close()
+
+        second = client.post(url, data={"refresh_token": first})
+        assert second.status_code == 200
+        second = second.json()["refresh_token"]
+        assert second != first
+        third = client.post(url, data={"refresh_token": second}).json()["refresh_token"]
+
+        # replaying a rotated token fails and takes the newest one with it
+        assert client.post(url, data={"refresh_token": first}).status_code == 401
+        assert client.post(url, data={"refresh_token": third}).status_code == 401
+        # a separate login is a separate family
+        assert client.post(url, data={"refresh_token": other_login}).status_code == 200
+        assert client.post(url, data={"grant_type": "password", "refresh_token": other_login}).status_code == 400
+
+
+def test_bulk_patch_updates_by_ids_and_by_filter(tmp_path, monkeypatch):
+    from . import db, querywatch
+    from .models import SupportTicket, TicketStatus
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(querywatch, "MODE", "raise")
+    url = "/adsweb/api/v1/tickets/bulk"
+    with _app_client() as client:
+        session = db.get_session()
+        try:
+            tickets = [SupportTicket(customerID=1, issueDescription=f"patch {i}") for i in range(6)]
+            session.add_all(tickets)
+            session.commit()
+            ids = [t.ticketID for t in tickets]
+            # seeded tickets the filter below also matches
+            seeded = [t.ticketID for t in session.query(SupportTicket).filter(
+                SupportTicket.status == TicketStatus.pending, SupportTicket.supportAgentID == 2, SupportTicket.ticketID.not_in(ids))]
+        finally:
+            session.close()
+        headers = _bearer()
+        # cached before the change, so a stale cache would show "open"
+        assert client.get(f"/adsweb/api/v1/tickets/{ids[0]}").json()["status"] == "open"
+
+        resp = client.patch(url, json={"ticketIDs": ids[:4] + [ids[0]], "status": "pending", "supportAgentID": 2}, headers=headers)
+        assert resp.status_code == 200
+        assert resp.json() == {"updated": 4, "ticketIDs": ids[:4]}
+        detail = client.get(f"/adsweb/api/v1/tickets/{ids[0]}").json()
+        assert detail["status"] == "pending" and detail["supportAgent"]["agentID"] == 2
+
+        resp = client.patch(url, json={"filter": {"status": "pending", "supportAgentID": 2}, "status": "closed", "supportAgentID": 0}, headers=headers)
+        assert resp.json() == {"updated": 4 + len(seeded), "ticketIDs": sorted(seeded + ids[:4])}
+        listed = {t["ticketID"]: t for t in client.get("/adsweb/api/v1/tickets", params={"customerID": 1, "limit": 1000}).json()}
+        assert all(listed[i]["status"] == "closed" and listed[i]["supportAgent"] is None for i in ids[:4])
+        assert all(listed[i]["status"] == "open" for i in ids[4:])
+
+        for bad in (
+            {"status": "closed"},
+            {"ticketIDs": ids, "filter": {"status": "open"}, "status": "closed"},
+            {"ticketIDs": [], "status": "closed"},
+            {"filter": {}, "status": "closed"},
+            {"ticketIDs": ids},
+            {"ticketIDs": ids, "supportAgentID": 999},
+        ):
+            assert client.patch(url, json=bad, headers=headers).status_code == 400, bad
+        assert client.patch(url, json={"ticketIDs": ids, "status": "closed"}).status_code == 401
+        customer = _bearer("alice@example.com", "customer")
+        assert client.patch(url, json={"ticketIDs": ids, "status": "closed"}, headers=customer).status_code == 403
+
+
+def test_fts5_and_memory_search_match_the_like_scan(tmp_path, monkeypatch):
+    from . import db, search
+    from .migrate_add_customer_search_indexes import run as add_search_indexes
+    from .models import Customer
+
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    add_search_indexes(db_url)
+    terms = ["smith", "ALI", "main st", "example.com", "0987", "o", "nobody", 'a"b']
+
+    for mode, setting in (("fts5", "auto"), ("memory", "memory")):
+        monkeypatch.setattr(search, "CUSTOMER_SEARCH_MODE", setting)
+        with _app_client() as client:
+            session = db.get_session()
+            try:
+                assert search.search_mode(session.connection()) == mode
+                # written after startup: the FTS5 triggers and the index's Session events pick it up
+                session.add(Customer(firstName="Alina", lastName="Smithers", email=f"alina.{mode}@example.com", address="9 Main St"))
+                session.commit()
+                expected = {
+                    term: sorted(c.email for c in session.scalars(search.customer_search_stmt(term, 500, "like")))
+                    for term in terms
+                }
+            finally:
+                session.close()
+            assert f"alina.{mode}@example.com" in expected["smith"]
+
+            for term in terms:
+                resp = client.get(f"/adsweb/api/v1/customer/search/{term}", params={"limit": 500})
+                assert resp.status_code == 200, term
+                assert sorted(c["email"] for c in resp.json()) == expected[term], (mode, term)
+
+            # ranked: a field starting with the term comes first
+            first = client.get("/adsweb/api/v1/customer/search/smith", params={"limit": 1}).json()
+            assert first[0]["lastName"] == "Smith"
+
+
+def _add_city_customers(db_url):
+    """Customers in mixed-case, non-ASCII and missing cities; returns their IDs."""
+    from sqlalchemy import update
+
+    from . import db
+    from .models import Customer
+
+    db.init_engine(db_url)
+    addresses = ["1 Rue, Évry", "2 Rue, évry", "3 Rue, Évry", "4 St, paris", "5 St, Paris", "6 St, PARIS",
+                 "7 St, Ávila", "8 St, zurich", "9 St", "10 St, Berlin"]
+    session = db.get_session()
+    try:
+        customers = [Customer(firstName="X", lastName=str(i), email=f"x{i}@e.com", address=a) for i, a in enumerate(addresses)]
+        session.add_all(customers)
+        session.commit()
+        ids = [c.customerID for c in customers]
+        # written by code from before the city column: not backfilled yet
+        session.execute(update(Customer).where(Customer.customerID.in_(ids[7:9])).values(city=None))
+        session.commit()
+    finally:
+        session.close()
+    return ids
+
+
+def test_address_pages_keep_every_customer_across_cities(tmp_path, monkeypatch):
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    _add_city_customers(db_url)
+    url = "/adsweb/api/v1/customer/addresses"
+    with _app_client() as client:
+        everyone = [r["customer"]["customerID"] for r in client.get(url, params={"limit": 1000}).json()]
+        assert len(everyone) == 14
+        for limit in (1, 2, 3, 5):
+            seen, cursor = [], None
+            while True:
+                resp = client.get(url, params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+                assert resp.status_code == 200
+                seen.extend(r["customer"]["customerID"] for r in resp.json())
+                cursor = resp.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert seen == everyone, limit
+
+        cities = [r["city"] for r in client.get(url, params={"limit": 1000}).json()]
+        # customers without a city (NULL or '') come first on every database;
+        # SQLite's lower() leaves non-ASCII letters alone, so those sort last
+        assert cities == [""] * 6 + ["Berlin", "paris", "Paris", "PARIS", "Ávila", "Évry", "Évry", "évry"]
+
+
+def test_city_counts_group_missing_cities_together(tmp_path, monkeypatch):
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    _add_city_customers(db_url)
+    with _app_client() as client:
+        counts = {r["city"]: r["count"] for r in client.get("/adsweb/api/v1/customer/cities").json()}
+    # four seeded customers without a comma in the address, plus one NULL and one ''
+    assert counts[""] == 6
+    assert counts["Paris"] == 1 and counts["PARIS"] == 1 and counts["paris"] == 1
+    assert counts["Évry"] == 2 and counts["évry"] == 1
+    assert sum(counts.values()) == 14
+
+
+def test_city_migration_backfills_and_indexes(tmp_path, monkeypatch):
+    from sqlalchemy import select, text
+
+    from . import db
+    from .migrate_add_customer_city import run as add_city
+    from .models import Customer
+
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    ids = _add_city_customers(db_url)
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_customers_city_key"))
+        conn.execute(text("CREATE INDEX ix_customers_city_lower ON customers (lower(city), customerid)"))
+
+    add_city(db_url, batch_size=3)
+
+    with db.engine.connect() as conn:
+        cities = dict(conn.execute(select(Customer.customerID, Customer.city).where(Customer.customerID.in_(ids))).all())
+        indexes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'customers'")).scalars())
+    assert cities[ids[7]] == "zurich" and cities[ids[8]] == ""
+    assert None not in cities.values()
+    assert "ix_customers_city_key" in indexes and "ix_customers_city_lower" not in indexes
+
+
+def test_ticket_list_etag_only_changes_with_the_ticket_payload(tmp_path, monkeypatch):
+    from sqlalchemy import select
+
+    from . import db
+    from .models import Customer, SupportAgent
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    url = "/adsweb/api/v1/tickets"
+
+    def change(fn):
+        session = db.get_session()
+        try:
+            fn(session)
+            session.commit()
+        finally:
+            session.close()
+
+    def alice(session):
+        return session.scalars(select(Customer).where(Customer.email == "alice@example.com")).one()
+
+    with _app_client() as client:
+        etag = client.get(url).headers["ETag"]
+        # a password rehash on login and a signup do not touch ticket responses
+        change(lambda s: setattr(alice(s), "password", "rehashed"))
+        change(lambda s: s.add(Customer(firstName="New", lastName="User", email="new@example.com")))
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+        change(lambda s: setattr(alice(s), "lastName", "Jones"))
+        resp = client.get(url, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+
+        change(lambda s: setattr(s.get(SupportAgent, 1), "email", "tom@example.com"))
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_revoking_a_token_twice_keeps_one_row(tmp_path, monkeypatch):
+    import datetime
+
+    from sqlalchemy import func, select
+
+    from . import db
+    from .models import RevokedToken
+    from .revocation import RevocationList
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    db.init_engine()
+    expires = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    # two workers revoking the same jti; neither has seen the other's row
+    for worker in (RevocationList(session_factory=db.get_session), RevocationList(session_factory=db.get_session)):
+        session = db.get_session()
+        try:
+            worker.revoke(session, "same-jti", expires)
+            session.commit()
+        finally:
+            session.close()
+        assert worker.is_revoked("same-jti")
+
+    session = db.get_session()
+    try:
+        assert session.scalar(select(func.count()).select_from(RevokedToken)) == 1
+    finally:
+        session.close()
+
+    with _app_client() as client:
+        token = _bearer()["Authorization"].split()[1]
+        for _ in range(2):
+            assert client.post("/adsweb/api/v1/token/revoke", data={"token": token}).status_code == 200
+        body = {"customerID": 1, "issueDescription": "after logout"}
+        assert client.post("/adsweb/api/v1/ticket", json=body, headers={"Authorization": f"Bearer {token}"}).status_code == 401
+
+
+def test_login_releases_the_connection_while_verifying(tmp_path, monkeypatch):
+    from . import db, hashing
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(hashing, "pool", hashing.HashingPool(kind="thread", workers=1))
+    monkeypatch.setattr(hashing, "_dummy_hash", None)
+    verified = []
+    real_verify = hashing.pool.verify
+
+    def verify(password, hashed_password):
+        verified.append((hashed_password, db.engine.pool.checkedout()))
+        return real_verify(password, hashed_password)
+
+    monkeypatch.setattr(hashing.pool, "verify", verify)
+    url = "/adsweb/api/v1/token"
+    with _app_client() as client:
+        assert client.post(url, data={"username": "alice@example.com", "password": "pass"}).status_code == 200
+        assert client.post(url, data={"username": "alice@example.com", "password": "wrong"}).status_code == 401
+        # unknown emails still pay for a verify, so they cannot be told apart by timing
+        assert client.post(url, data={"username": "nobody@example.com", "password": "pass"}).status_code == 401
+
+    assert [checked_out for _, checked_out in verified] == [0, 0, 0]
+    assert verified[2][0] == hashing.dummy_hash()
+    hashing.pool.shutdown()
+
+
+def test_login_upgrades_a_weak_password_hash(tmp_path, monkeypatch):
+    from sqlalchemy import select
+
+    from . import db, hashing
+    from .models import Customer
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(hashing, "pool", hashing.HashingPool(kind="thread", workers=1))
+    monkeypatch.setattr(hashing, "POLICY", hashing.HashPolicy(bcrypt_rounds=5))
+
+    def stored_hash():
+        session = db.get_session()
+        try:
+            return session.scalar(select(Customer.password).where(Customer.email == "alice@example.com"))
+        finally:
+            session.close()
+
+    with _app_client() as client:
+        session = db.get_session()
+        try:
+            alice = session.scalars(select(Customer).where(Customer.email == "alice@example.com")).one()
+            alice.password = hashing.hash_password("pass", hashing.HashPolicy(bcrypt_rounds=4))
+            session.commit()
+        finally:
+            session.close()
+        assert hashing.needs_rehash(stored_hash())
+
+        resp = client.post("/adsweb/api/v1/login", json={"username": "alice@example.com", "password": "pass"})
+        assert resp.status_code == 200
+        upgraded = stored_hash()
+        assert upgraded.startswith("$2b$05$") and not hashing.needs_rehash(upgraded)
+        assert client.post("/adsweb/api/v1/login", json={"username": "alice@example.com", "password": "pass"}).status_code == 200
+    hashing.pool.shutdown()
+
+
+def test_password_checks_fail_loudly_on_misconfiguration(monkeypatch):
+    import pytest
+
+    from . import hashing
+
+    assert hashing.check_password("pass", "not-a-hash") is False
+    assert hashing.check_password("pass", hashing.hash_password("other", hashing.HashPolicy(bcrypt_rounds=4))) is False
+
+    monkeypatch.setenv("PASSWORD_HASH_SCHEME", "scrypt")
+    with pytest.raises(RuntimeError, match="PASSWORD_HASH_SCHEME"):
+        hashing.policy_from_env()
+
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        # a stored argon2 hash without argon2-cffi is an error, not a wrong password
+        with pytest.raises(RuntimeError, match="argon2-cffi"):
+            hashing.check_password("pass", "$argon2id$v=19$m=65536,t=3,p=1$c2FsdHNhbHQ$aGFzaGhhc2hoYXNo")
+
+
+def test_trigram_search_orders_by_an_indexable_distance():
+    from sqlalchemy.dialects import postgresql
+    from .migrate_add_customer_search_indexes import postgres_ddl
+    from .search import _trigram_select, search_text
+
+    dialect = postgresql.dialect()
+    sql = str(_trigram_select("smi", 10).compile(dialect=dialect))
+    text_sql = str(search_text().compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    # ranking must not score every match per column; it is one KNN-able ORDER BY
+    assert "similarity(" not in sql and "greatest(" not in sql
+    order_by = sql.split("ORDER BY", 1)[1]
+    assert f"({text_sql}) <->> " in order_by and "LIMIT" in order_by
+    # the GiST index covers the very expression being ordered by
+    gist = [stmt for stmt in postgres_ddl() if "USING gist" in stmt]
+    assert gist == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_customers_search_text_trgm "
+        f"ON customers USING gist (({text_sql}) gist_trgm_ops);"
+    ]
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["sync", "async"])
+def test_ticket_and_customer_endpoints_behave_the_same_sync_and_async(tmp_path, monkeypatch, use_async):
+    from . import app as app_module, db
+    from .db import count_queries
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    # both flags are read at import; the async run goes through aiosqlite
+    monkeypatch.setattr(db, "USE_ASYNC_DB", use_async)
+    monkeypatch.setattr(app_module, "USE_ASYNC_DB", use_async)
+    monkeypatch.setattr(db, "async_engine", None)
+    monkeypatch.setattr(db, "AsyncSessionLocal", None)
+    api = "/adsweb/api/v1"
+
+    with _app_client() as client:
+        assert (db.async_engine is not None) == use_async
+        # the list is served by the engine of the implementation under test
+        with count_queries(db.engine) as sync_queries, count_queries(_routes_engine()) as route_queries:
+            tickets = client.get(f"{api}/tickets").json()
+        assert route_queries.count == 2
+        assert sync_queries.count == (0 if use_async else 2)
+
+        # list and detail
+        assert len(tickets) == 2
+        detail = client.get(f"{api}/tickets/{tickets[0]['ticketID']}").json()
+        assert detail == tickets[0]
+        assert client.get(f"{api}/tickets/999").status_code == 404
+        assert client.get(f"{api}/tickets", params={"limit": 0}).status_code == 400
+
+        # search and addresses
+        assert [c["email"] for c in client.get(f"{api}/customer/search/alice").json()] == ["alice@example.com"]
+        assert client.get(f"{api}/customer/search/%20").status_code == 400
+        page = client.get(f"{api}/customer/addresses", params={"limit": 1})
+        assert len(page.json()) == 1 and page.headers["X-Next-Cursor"]
+        rest = client.get(f"{api}/customer/addresses", params={"cursor": page.headers["X-Next-Cursor"]}).json()
+        everyone = client.get(f"{api}/customer/addresses").json()
+        assert page.json() + rest == everyone
+
+        # create, single and bulk
+        created = client.post(f"{api}/ticket", json={"customerID": 1, "issueDescription": "parity"}, headers=_bearer())
+        assert created.status_code == 201
+        ticket = created.json()
+        assert ticket["issueDescription"] == "parity" and ticket["status"] == "open"
+        assert ticket["customer"]["email"] == "alice@example.com" and ticket["supportAgent"] is None
+        assert client.post(f"{api}/ticket", json={"customerID": 999, "issueDescription": "x"}, headers=_bearer()).status_code == 400
+        bulk = client.post(f"{api}/tickets/bulk", headers=_bearer(), json=[
+            {"customerID": 2, "supportAgentID": 1, "issueDescription": "bulk a"},
+            {"customerID": 999, "issueDescription": "bulk b"},
+            {"customerID": 1, "issueDescription": "bulk c"},
+        ]).json()
+        assert [c["index"] for c in bulk["created"]] == [0, 2]
+        assert [e["index"] for e in bulk["errors"]] == [1]
+        bulk_ids = [c["ticketID"] for c in bulk["created"]]
+
+        # update, single and bulk
+        updated = client.put(f"{api}/ticket/{ticket['ticketID']}", json={"status": "closed", "supportAgentID": 2})
+        assert updated.status_code == 200
+        assert updated.json()["status"] == "closed" and updated.json()["supportAgent"]["agentID"] == 2
+        assert client.get(f"{api}/tickets/{ticket['ticketID']}").json() == updated.json()
+        assert client.put(f"{api}/ticket/999", json={"status": "closed"}).status_code == 404
+        patched = client.patch(f"{api}/tickets/bulk", headers=_bearer(), json={"ticketIDs": bulk_ids, "status": "pending"})
+        assert patched.json() == {"updated": 2, "ticketIDs": sorted(bulk_ids)}
+        assert {client.get(f"{api}/tickets/{i}").json()["status"] for i in bulk_ids} == {"pending"}
+
+        # delete
+        assert client.delete(f"{api}/ticket/{ticket['ticketID']}").status_code == 204
+        assert client.get(f"{api}/tickets/{ticket['ticketID']}").status_code == 404
+        assert client.delete(f"{api}/ticket/{ticket['ticketID']}").status_code == 404
+        assert len(client.get(f"{api}/tickets").json()) == 4
+
+
+def test_role_changes_reach_cached_principals(tmp_path, monkeypatch):
+    from sqlalchemy import select
+
+    from . import auth, db
+    from .cache import TTLCache
+    from .db import count_queries
+    from .models import Customer
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(auth, "AUTH_PRINCIPAL_MODE", "cache")
+    monkeypatch.setattr(auth, "principal_cache", TTLCache(maxsize=16, ttl=3600))
+    email = "tom.agent@example.com"
+    # the token keeps claiming "agent"; only the database row changes
+    headers = _bearer(email, "agent")
+    url = "/adsweb/api/v1/tickets/bulk"
+    body = {"ticketIDs": [1], "status": "pending"}
+
+    with _app_client() as client:
+        assert client.patch(url, json=body, headers=headers).status_code == 200
+        assert auth.principal_cache.get(email).role == "agent"
+        # served from the cache: no customer lookup
+        with count_queries(db.engine) as counter:
+            assert client.patch(url, json=body, headers=headers).status_code == 200
+        assert not any("FROM customers" in sql for sql in counter.statements), counter.statements
+
+        # a rolled-back change leaves the cached principal alone
+        session = db.get_session()
+        try:
+            session.scalars(select(Customer).where(Customer.email == email)).one().role = "customer"
+            session.flush()
+            session.rollback()
+        finally:
+            session.close()
+        assert auth.principal_cache.get(email).role == "agent"
+
+        session = db.get_session()
+        try:
+            session.scalars(select(Customer).where(Customer.email == email)).one().role = "customer"
+            session.commit()
+        finally:
+            session.close()
+        assert auth.principal_cache.get(email) is None
+        assert client.patch(url, json=body, headers=headers).status_code == 403
+        assert auth.principal_cache.get(email).role == "customer"
+
+
+def test_exports_stream_every_row_in_both_formats(tmp_path, monkeypatch):
+    import csv
+    import io
+    import json
+
+    from . import export
+    from .app import TICKET_EXPORT_FIELDS
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    api = "/adsweb/api/v1/export"
+
+    with _app_client() as client:
+        assert client.get(f"{api}/tickets").status_code == 401
+        assert client.get(f"{api}/tickets", headers=_bearer("alice@example.com", "customer")).status_code == 403
+        assert client.get(f"{api}/tickets", params={"format": "xml"}, headers=_bearer()).status_code == 400
+
+        resp = client.get(f"{api}/tickets", headers=_bearer())
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        assert resp.headers["content-disposition"] == 'attachment; filename="tickets.ndjson"'
+        exported = [json.loads(line) for line in resp.text.splitlines()]
+        listed = sorted(client.get("/adsweb/api/v1/tickets").json(), key=lambda t: t["ticketID"])
+        assert exported == listed
+
+        resp = client.get(f"{api}/tickets", params={"format": "csv"}, headers=_bearer())
+        rows = list(csv.DictReader(io.StringIO(resp.text)))
+        assert list(rows[0]) == TICKET_EXPORT_FIELDS
+        assert [(int(r["ticketID"]), r["customerEmail"], r["status"]) for r in rows] == [
+            (t["ticketID"], t["customer"]["email"], t["status"]) for t in listed
+        ]
+
+        resp = client.get(f"{api}/customers", params={"format": "csv"}, headers=_bearer())
+        assert resp.headers["content-type"].startswith("text/csv")
+        reader = csv.DictReader(io.StringIO(resp.text))
+        customers = list(reader)
+        assert "password" not in reader.fieldnames
+        assert "alice@example.com" in {c["email"] for c in customers}
+        assert len(customers) == len(client.get(f"{api}/customers", headers=_bearer()).text.splitlines())
+
+    # encoders pull records lazily, one chunk at a time
+    pulled = []
+
+    def records():
+        for i in range(5):
+            pulled.append(i)
+            yield {"n": i}
+
+    chunks = export.ndjson_chunks(records(), chunk_size=2)
+    assert next(chunks) == '{"n": 0}\n{"n": 1}\n' and pulled == [0, 1]
+    assert list(chunks) == ['{"n": 2}\n{"n": 3}\n', '{"n": 4}\n']
+    # an empty CSV export is still a header row
+    assert list(export.csv_chunks(iter(()), ["a", "b"])) == ["a,b\r\n"]
+
+
+def test_metrics_count_requests_and_statements_per_route(tmp_path, monkeypatch):
+    from . import auth, metrics
+    from .db import count_queries
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(auth, "INTERNAL_API_TOKEN", "s3cret")
+    detail = 'method="GET",route="/adsweb/api/v1/tickets/{ticket_id}"'
+
+    with _app_client() as client:
+        metrics.registry.clear()
+        with count_queries(_routes_engine()) as counter:
+            for ticket_id in (1, 2, 999):
+                client.get(f"/adsweb/api/v1/tickets/{ticket_id}")
+        client.get("/adsweb/api/v1/no-such-route/1")
+        client.get("/adsweb/api/v1/no-such-route/2")
+
+        assert client.get("/adsweb/internal/metrics").status_code == 403
+        resp = client.get("/adsweb/internal/metrics", headers={"X-Internal-Token": "s3cret"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = dict(line.rsplit(" ", 1) for line in resp.text.splitlines() if not line.startswith("#"))
+
+    # one series per route template, not per ticket ID
+    assert samples[f'shopease_http_requests_total{{{detail},status="200"}}'] == "2"
+    assert samples[f'shopease_http_requests_total{{{detail},status="404"}}'] == "1"
+    assert samples['shopease_http_requests_total{method="GET",route="unmatched",status="404"}'] == "2"
+    assert samples[f'shopease_http_request_duration_seconds_bucket{{{detail},le="+Inf"}}'] == "3"
+    assert samples[f"shopease_http_request_duration_seconds_count{{{detail}}}"] == "3"
+    assert counter.count and samples[f"shopease_db_statements_total{{{detail}}}"] == str(counter.count)
+    assert samples[f"shopease_http_request_db_seconds_count{{{detail}}}"] == "3"
+    # only the scrape being rendered
+    assert samples['shopease_http_requests_in_flight{method="GET"}'] == "1"
+
+
+def test_profiling_is_gated_and_writes_downloadable_profiles(tmp_path, monkeypatch):
+    import pstats
+
+    from . import auth, profiling, search
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    profile_dir = tmp_path / "profiles"
+    monkeypatch.setattr(auth, "INTERNAL_API_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "INTERNAL_API_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(profile_dir))
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(profiling, "MODE", "sample")
+    internal = {"X-Internal-Token": "s3cret"}
+    stmt = search.customer_search_stmt
+
+    def slow_search_stmt(*args):
+        # long enough for several stack samples
+        time.sleep(0.1)
+        return stmt(*args)
+
+    monkeypatch.setattr(search, "customer_search_stmt", slow_search_stmt)
+    url = "/adsweb/api/v1/customer/search/alice"
+
+    with _app_client() as client:
+        assert "x-profile-id" not in client.get(url).headers
+        assert "x-profile-id" not in client.get(url, headers={"X-Profile": "1", "X-Internal-Token": "wrong"}).headers
+        assert not profile_dir.exists()
+
+        resp = client.get(url, headers={"X-Profile": "1", **internal})
+        assert resp.status_code == 200 and resp.json()[0]["email"] == "alice@example.com"
+        name = resp.headers["x-profile-id"]
+        assert name.endswith(".collapsed") and "-GET-" in name
+        assert [p["name"] for p in client.get("/adsweb/internal/profiles", headers=internal).json()] == [name]
+        collapsed = client.get(f"/adsweb/internal/profiles/{name}", headers=internal).text
+        # "frame;frame;... count" lines through the endpoint down to the slow call
+        stack, count = collapsed.splitlines()[0].rsplit(" ", 1)
+        assert "search_customers (" in stack and "slow_search_stmt (" in stack and int(count) > 0
+        assert client.get("/adsweb/internal/profiles/..%2Fsecrets.prof", headers=internal).status_code == 404
+        assert client.get(f"/adsweb/internal/profiles/{name}").status_code == 403
+
+        # sampled requests need no header; cProfile output is plain pstats
+        monkeypatch.setattr(profiling, "SAMPLE_RATE", 1.0)
+        monkeypatch.setattr(profiling, "MODE", "cprofile")
+        monkeypatch.setattr(profiling, "MAX_FILES", 1)
+        name = client.get(url).headers["x-profile-id"]
+        assert name.endswith(".prof")
+        assert sorted(p.name for p in profile_dir.iterdir()) == [name]
+        assert pstats.Stats(str(profile_dir / name)).total_calls > 0
+
+
+def test_orjson_responses_match_the_default_rendering(tmp_path, monkeypatch):
+    from . import responses
+
+    db_url = _seeded_sqlite(tmp_path, monkeypatch)
+    # non-ASCII and missing cities, and tickets with and without an agent
+    _add_city_customers(db_url)
+    urls = [
+        ("/adsweb/api/v1/tickets", {}),
+        ("/adsweb/api/v1/tickets", {"limit": 1}),
+        ("/adsweb/api/v1/customer/addresses", {"limit": 5}),
+        ("/adsweb/api/v1/customer/addresses", {}),
+    ]
+
+    def fetch(mode):
+        monkeypatch.setattr(responses, "JSON_RESPONSE", mode)
+        with _app_client() as client:
+            return [client.get(url, params=params) for url, params in urls]
+
+    std, fast = fetch("std"), fetch("orjson")
+    for a, b in zip(std, fast):
+        assert a.status_code == b.status_code == 200
+        assert a.content == b.content
+        assert a.headers["content-type"] == b.headers["content-type"] == "application/json"
+        assert a.headers.get("ETag") == b.headers.get("ETag")
+        assert a.headers.get("X-Next-Cursor") == b.headers.get("X-Next-Cursor")
+        assert a.headers["content-length"] == b.headers["content-length"]
+    assert std[1].headers["X-Next-Cursor"] and std[0].headers["ETag"]
+    # UTF-8, not \u escapes, like Starlette's JSONResponse
+    assert "Évry".encode() in fast[3].content and b"\\u" not in fast[3].content
+
+
+def test_ticket_rows_unpack_in_select_column_order(tmp_path, monkeypatch):
+    from . import db
+    from .queries import ticket_list_select, ticket_rows_to_dicts
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    session = db.get_session()
+    try:
+        rows = session.execute(ticket_list_select()).all()
+    finally:
+        session.close()
+    by_name = [
+        {
+            "ticketID": r.ticketID,
+            "issueDescription": r.issueDescription,
+            "createdAt": r.createdAt,
+            "status": r.status.name,
+            "customer": {"customerID": r.customerID, "firstName": r.customerFirstName,
+                         "lastName": r.customerLastName, "email": r.customerEmail},
+            "supportAgent": None if r.agentID is None else {
+                "agentID": r.agentID, "firstName": r.agentFirstName,
+                "lastName": r.agentLastName, "email": r.agentEmail,
+            },
+        }
+        for r in rows
+    ]
+    assert ticket_rows_to_dicts(rows) == by_name
+
+
+def test_startup_is_lazy_and_reports_its_phases(tmp_path, monkeypatch, caplog):
+    import logging
+
+    from fastapi.testclient import TestClient
+
+    from . import auth, db, startup
+    from .app import create_app
+
+    # building the app needs no database at all
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setattr(db, "engine", None)
+    monkeypatch.setattr(db, "SessionLocal", None)
+    application = create_app()
+    assert db.engine is None
+
+    _seeded_sqlite(tmp_path, monkeypatch)
+    monkeypatch.setattr(auth, "INTERNAL_API_TOKEN", "s3cret")
+    monkeypatch.setattr(startup, "BUDGET_SECONDS", 1e-9)
+    with caplog.at_level(logging.INFO, logger="shopease.startup"):
+        with TestClient(application) as client:
+            assert db.engine is not None
+            timings = client.get("/adsweb/internal/startup", headers={"X-Internal-Token": "s3cret"}).json()
+            assert client.get("/adsweb/internal/startup").status_code == 403
+
+    assert {"create_app", "engine", "warm-up"} <= set(timings["phasesSeconds"])
+    assert timings["totalSeconds"] == round(startup.total(), 4) > 0
+    assert timings["budgetSeconds"] == 1e-9 and timings["overBudget"] is True
+    records = [r for r in caplog.records if r.name == "shopease.startup"]
+    assert [r.levelno for r in records] == [logging.INFO, logging.WARNING]
+    assert "engine " in records[0].getMessage() and "warm-up " in records[0].getMessage()
+    assert "over the" in records[1].getMessage()
+
+    # no budget, no warning
+    caplog.clear()
+    monkeypatch.setattr(startup, "BUDGET_SECONDS", None)
+    with caplog.at_level(logging.INFO, logger="shopease.startup"):
+        with _app_client():
+            pass
+    assert [r.levelno for r in caplog.records if r.name == "shopease.startup"] == [logging.INFO]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""Table change versions and HTTP conditional GET helpers for the ticket endpoints.
+
+Any ORM flush that writes SupportTicket rows, deletes Customer or
+SupportAgent rows, or changes their name or email (which are embedded in
+ticket responses) bumps the 'supporttickets' row of table_versions in the
+same transaction. Other customer writes, such as a password rehash on
+login or a signup, leave it alone. The ticket endpoints turn the version
+into an ETag and its timestamp into Last-Modified, and answer a matching
+If-None-Match with 304 after a single primary-key lookup, before running
+the list query. If-Modified-Since alone never gets a 304: Last-Modified
+has whole-second precision, so a write in the same second as the previous
+response would go unnoticed.
+
+Ticket detail is served from the ticket cache, so its ETag is a hash of the
+cached representation instead (`content_etag`); the cache itself checks
+entries against the version (cache.py).
+
+Writes that bypass the ORM must call `bump()` themselves.
+"""
+import datetime
+import hashlib
+import json
+from email.utils import format_datetime
+
+from fastapi import Response
+from sqlalchemy import event, insert, inspect, select, update
+from sqlalchemy.orm import Session
+
+from .models import Customer, SupportAgent, SupportTicket, TableVersion
+
+TICKETS = "supporttickets"
+# columns of these tables that appear in ticket responses
+_EMBEDDED = {
+    Customer: ("firstName", "lastName", "email"),
+    SupportAgent: ("firstName", "lastName", "email"),
+}
+
+
+def bump(connection, name: str = TICKETS):
+    now = datetime.datetime.utcnow()
+    result = connection.execute(
+        update(TableVersion)
+        .where(TableVersion.name == name)
+        .values(version=TableVersion.version + 1, updatedAt=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(TableVersion).values(name=name, version=1, updatedAt=now))
+
+
+def _changes_ticket_payload(obj) -> bool:
+    """Whether flushing `obj` (dirty or deleted) changes a ticket response."""
+    if isinstance(obj, SupportTicket):
+        return True
+    columns = _EMBEDDED.get(type(obj))
+    if columns is None:
+        return False
+    state = inspect(obj)
+    return state.deleted or any(state.attrs[c].history.has_changes() for c in columns)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_ticket_writes(session, flush_context):
+    # history still holds the flushed changes in after_flush; new customers
+    # and agents are not referenced by any ticket yet
+    if (any(isinstance(obj, SupportTicket) for obj in session.new)
+            or any(_changes_ticket_payload(obj) for obj in session.dirty)
+            or any(_changes_ticket_payload(obj) for obj in session.deleted)):
+        bump(session.connection())
+
+
+def version_select(name: str = TICKETS):
+    return select(TableVersion.version, TableVersion.updatedAt).where(TableVersion.name == name)
+
+
+def version_of(row) -> int:
+    """The version number in a `version_select` row (0 before the first write)."""
+    return row.version if row is not None else 0
+
+
+def validators(row, key: str):
+    """(ETag, Last-Modified datetime or None) for a `version_select` row.
+
+    `key` distinguishes representations sharing one table version, e.g.
+    the list's query string or a ticket ID.
+    """
+    version = version_of(row)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    etag = f'W/"{version}-{digest}"'
+    modified = None
+    if row is not None and row.updatedAt is not None:
+        modified = row.updatedAt.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+    return etag, modified
+
+
+def content_etag(obj) -> str:
+    """Weak ETag hashed from a JSON-serializable representation.
+
+    Used for ticket detail, which is usually answered from the ticket
+    cache; hashing the cached dict keeps a cache hit to the version lookup.
+    """
+    raw = json.dumps(obj, sort_keys=True, default=str).encode("utf-8")
+    return f'W/"{hashlib.sha1(raw).hexdigest()[:16]}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def is_not_modified(request, etag: str) -> bool:
+    """True when the request's If-None-Match matches `etag`.
+
+    If-Modified-Since is ignored: it is too coarse to answer 304 safely.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    return if_none_match is not None and _etag_matches(if_none_match, etag)
+
+
+def set_validators(response, etag: str, modified):
+    response.headers["ETag"] = etag
+    # clients may keep the body but must revalidate before reusing it
+    response.headers["Cache-Control"] = "no-cache"
+    if modified is not None:
+        response.headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+
+
+def not_modified_response(etag: str, modified) -> Response:
+    response = Response(status_code=304)
+    set_validators(response, etag, modified)
+    return response